@@ -1,10 +1,14 @@
+from collections import OrderedDict
 import logging
+import time
 
+from django.db import router
 from django.db.models import Case, When
 from django.conf import settings
 from django.contrib import admin, messages
-from django.contrib.admin.utils import unquote
-from django.core.exceptions import ValidationError
+from django.contrib.admin.utils import (NotRelationField,
+                                        get_fields_from_path, unquote)
+from django.core.exceptions import FieldDoesNotExist, ValidationError
 from django.http import HttpResponseRedirect
 from django.shortcuts import resolve_url
 from django.urls import reverse
@@ -13,12 +17,24 @@ from django.utils.module_loading import import_string
 from urllib import parse
 from django.utils.http import urlencode
 
+from . import signals
+from .cache import track_model
+from .compiler import apply_query, get_query_mode
+from .counts import get_filter_counts, show_counts
+from .dictionaries import dictionary_fields, track_dictionary
 from .forms import AdvancedFilterForm
 from .models import AdvancedFilter
+from .snapshots import filter_pks
+from .stats import recorder, tracking_enabled
+from .timeouts import QueryTimeout, query_timeout
 
 
 logger = logging.getLogger('advanced_filters.admin')
 
+# the columns of the filters listed in the changelist sidebar
+FILTER_FIELDS = ('id', 'title', 'b64_query', 'model', 'snapshot_enabled',
+                 'snapshot_at')
+
 admin_instance = getattr(settings, 'ADVANCED_FILTERS_ADMIN_INSTANCE', None)
 if admin_instance:
     site = import_string(admin_instance).site
@@ -35,6 +51,12 @@ def clone_filter(adv_filter, user):
     adv_filter.title = f'{adv_filter.title} (cloned)'[:255]
     adv_filter.created_at = None
     adv_filter.is_public = False
+    # the clone starts without usage statistics nor snapshot of its own
+    adv_filter.usage_count = 0
+    adv_filter.total_time = 0
+    adv_filter.last_used_at = adv_filter.p95_time = None
+    adv_filter.last_result_size = adv_filter.recent_times = None
+    adv_filter.snapshot = adv_filter.snapshot_at = None
     adv_filter.save()
     adv_filter.users.clear()
     adv_filter.users.add(user)
@@ -43,35 +65,107 @@ def clone_filter(adv_filter, user):
     return adv_filter
 
 
+def get_visible_filters(request, model):
+    """
+    Return the advanced filters of ``model`` visible to the user of the
+    request, as an ordered dict of id (as a string) to filter, the user's
+    own filters first.
+
+    Filters are loaded with a single query, fetching only the columns needed
+    to list and apply them, and remembered for the rest of the request. The
+    stored snapshot is left out: it is only loaded for the filter applied.
+    """
+    cache = request.__dict__.setdefault('_advanced_filters', {})
+    model_name = "%s.%s" % (model._meta.app_label, model._meta.object_name)
+    if model_name not in cache:
+        afilters = AdvancedFilter.objects.filter_by_user_or_public(
+            request.user).filter(
+                model=model_name).order_by(
+                    Case(When(created_by=request.user.id, then=0), default=1)
+                ).only(*FILTER_FIELDS)
+        visible = OrderedDict()
+        for afilter in afilters:
+            # a filter shared in more than one way is joined more than once
+            visible.setdefault(str(afilter.pk), afilter)
+        cache[model_name] = visible
+    return cache[model_name]
+
+
+def get_applied_filter(request, model, filter_id):
+    """
+    Return the filter of ``model`` with id ``filter_id`` if the user of the
+    request may apply it, None otherwise: any of their visible filters, or
+    any filter at all for those allowed to open every filter in the admin
+    (see ``AdvancedFilterAdmin.user_has_permission``).
+    """
+    afilter = get_visible_filters(request, model).get(filter_id)
+    if (afilter is None and filter_id.isdigit() and
+            AdvancedFilterAdmin.user_has_permission(request.user)):
+        model_name = "%s.%s" % (model._meta.app_label,
+                                model._meta.object_name)
+        afilter = AdvancedFilter.objects.filter(
+            pk=filter_id, model=model_name).only(*FILTER_FIELDS).first()
+    return afilter
+
+
 class AdvancedListFilters(admin.SimpleListFilter):
     """Allow filtering by stored advanced filters (selection by title)"""
     title = _('Advanced filters')
 
     parameter_name = '_afilter'
 
+    def __init__(self, request, params, model, model_admin):
+        self.model_admin = model_admin
+        super(AdvancedListFilters, self).__init__(
+            request, params, model, model_admin)
+
     def lookups(self, request, model_admin):
         if not model_admin:
             raise Exception('Cannot use AdvancedListFilters without a '
                             'model_admin')
-        model_name = "%s.%s" % (model_admin.model._meta.app_label,
-                                model_admin.model._meta.object_name)
-        return AdvancedFilter.objects.filter_by_user_or_public(
-            request.user).filter(
-                model=model_name).order_by(
-                    Case(When(created_by=request.user.id, then=0), default=1)
-                ).values_list('id', 'title')
+        afilters = list(get_visible_filters(
+            request, model_admin.model).values())
+        applied = self.value() and get_applied_filter(
+            request, model_admin.model, self.value())
+        if applied and applied not in afilters:
+            afilters.append(applied)
+        if not show_counts(model_admin):
+            return [(afilter.pk, afilter.title) for afilter in afilters]
+        counts = get_filter_counts(model_admin.get_queryset(request),
+                                   afilters, mode=get_query_mode(model_admin))
+        return [(afilter.pk, afilter.title if counts[afilter.pk] is None
+                 else '%s (%d)' % (afilter.title, counts[afilter.pk]))
+                for afilter in afilters]
 
     def queryset(self, request, queryset):
         if self.value():
-            filters = AdvancedFilter.objects.filter(id=self.value())
-            if hasattr(filters, 'first'):
-                advfilter = filters.first()
+            advfilter = get_applied_filter(
+                request, self.model_admin.model, self.value())
             if not advfilter:
                 logger.error("AdvancedListFilters.queryset: Invalid filter id")
                 return queryset
-            query = advfilter.query
-            logger.debug(query.__dict__)
-            return queryset.filter(query).distinct()
+            started = time.perf_counter()
+            # timed until the changelist is rendered, see changelist_view
+            request._advanced_filter_usage = (advfilter.pk, started)
+            mode = get_query_mode(self.model_admin)
+            filtered = None
+            if advfilter.snapshot_enabled:
+                pks = advfilter.get_snapshot()
+                if pks is None:
+                    pks = advfilter.refresh_snapshot(mode=mode)
+                if pks is not None:
+                    filtered = filter_pks(queryset, pks)
+            snapshot = filtered is not None
+            if not snapshot:
+                query = advfilter.query
+                logger.debug('Applying advanced filter %s: %s',
+                             advfilter.pk, query)
+                filtered = apply_query(queryset, query, mode=mode)
+            signals.send_timed(
+                signals.filter_applied, AdvancedListFilters, started,
+                filter_id=advfilter.pk, model=self.model_admin.model,
+                request=request, snapshot=snapshot, queryset=filtered)
+            return filtered
         return queryset
 
 
@@ -89,18 +183,31 @@ class AdminAdvancedFiltersMixin(object):
         self.change_list_template = self.advanced_change_list_template
         # add list filters to filters
         self.list_filter = (AdvancedListFilters,) + tuple(self.list_filter)
+        # cached choices depend on the rows of the model, and on those of
+        # the related models for related fields
+        track_model(self.model)
+        for field in getattr(self, 'advanced_filter_fields', ()):
+            if isinstance(field, (list, tuple)):
+                field = field[0]
+            try:
+                track_model(get_fields_from_path(self.model, field)[-1].model)
+            except (FieldDoesNotExist, NotRelationField):
+                logger.debug('Invalid advanced filter field %s', field)
+        for field in dictionary_fields(self):
+            track_dictionary(field)
 
     def save_advanced_filter(self, request, form):
         if form.is_valid():
             afilter = form.save(commit=False)
             afilter.created_by = request.user
-            afilter.query = form.generate_query()
             afilter.save()
             afilter.users.add(request.user)
             messages.add_message(
                 request, messages.SUCCESS,
                 _('Advanced filter added successfully.')
             )
+            for warning in form.warnings:
+                messages.add_message(request, messages.WARNING, warning)
             qparams = request.GET.urlencode()
             qparams = dict(parse.parse_qsl(qparams))
             qparams['_afilter'] = afilter.id
@@ -134,8 +241,61 @@ class AdminAdvancedFiltersMixin(object):
                                            extra_context=extra_context)
         if response:
             return response
-        return super(AdminAdvancedFiltersMixin, self
-                     ).changelist_view(request, extra_context=extra_context)
+        filter_id = request.GET.get('_afilter')
+        if not filter_id:
+            return super(AdminAdvancedFiltersMixin, self).changelist_view(
+                request, extra_context=extra_context)
+        if get_applied_filter(request, self.model, filter_id) is None:
+            messages.add_message(
+                request, messages.WARNING,
+                _('The advanced filter %s does not exist or is not '
+                  'available to you, it was not applied.') % filter_id)
+        try:
+            # the changelist runs its queries within the time budget, see
+            # get_changelist
+            response = super(AdminAdvancedFiltersMixin, self
+                             ).changelist_view(
+                                 request, extra_context=extra_context)
+        except QueryTimeout as e:
+            logger.warning('Advanced filter %s timed out: %s',
+                           request.GET['_afilter'], e)
+            messages.add_message(
+                request, messages.ERROR,
+                _('The advanced filter took too long to run and was not '
+                  'applied.'))
+            qparams = request.GET.copy()
+            del qparams['_afilter']
+            return HttpResponseRedirect('%s?%s' % (
+                request.path, qparams.urlencode()))
+        self.record_advanced_filter_usage(request, response)
+        return response
+
+    def get_changelist(self, request, **kwargs):
+        ChangeList = super(AdminAdvancedFiltersMixin, self).get_changelist(
+            request, **kwargs)
+        if not request.GET.get('_afilter'):
+            return ChangeList
+        using = router.db_for_read(self.model)
+
+        class TimedChangeList(ChangeList):
+            """Runs the queries of the changelist in the time budget"""
+            def __init__(self, *args, **kwargs):
+                with query_timeout(using=using):
+                    super(TimedChangeList, self).__init__(*args, **kwargs)
+                    # the results are lazy, fetch them before it ends
+                    len(self.result_list)
+
+        return TimedChangeList
+
+    def record_advanced_filter_usage(self, request, response):
+        """Record the time taken by the applied filter and its result size"""
+        usage = getattr(request, '_advanced_filter_usage', None)
+        if usage is None or not tracking_enabled():
+            return
+        filter_id, started = usage
+        cl = (getattr(response, 'context_data', None) or {}).get('cl')
+        recorder.record(filter_id, time.perf_counter() - started,
+                        getattr(cl, 'result_count', None))
 
 
 @admin.register(AdvancedFilter, site=site)
@@ -144,12 +304,15 @@ class AdvancedFilterAdmin(admin.ModelAdmin):
     form = AdvancedFilterForm
     extra = 0
 
-    list_display = ('title', 'created_by', 'is_public')
-    readonly_fields = ('created_by', 'model', 'created_at', )
+    list_display = ('title', 'created_by', 'is_public', 'snapshot_at',
+                    'usage_count', 'last_used_at', 'p95_time', 'total_time',
+                    'last_result_size')
+    readonly_fields = ('created_by', 'model', 'created_at', 'snapshot_at')
     list_filter = (
         'is_public',
     )
-    actions = ['delete_selected_filters', 'clone_selected_filters']
+    actions = ['delete_selected_filters', 'clone_selected_filters',
+               'refresh_selected_snapshots']
 
     def get_actions(self, request):
         actions = super().get_actions(request)
@@ -163,7 +326,8 @@ class AdvancedFilterAdmin(admin.ModelAdmin):
     def get_readonly_fields(self, request, obj=None):
         if request.user == obj.created_by:
             return super().get_readonly_fields(request, obj=obj)
-        return ['title', 'is_public'] + list(self.readonly_fields)
+        return (['title', 'is_public', 'snapshot_enabled'] +
+                list(self.readonly_fields))
 
     def get_form(self, request, obj=None, **kwargs):
         AdminForm = super(AdvancedFilterAdmin, self).get_form(request, obj, **kwargs)
@@ -175,6 +339,12 @@ class AdvancedFilterAdmin(admin.ModelAdmin):
 
         return AdminFormWithRequest
 
+    def save_form(self, request, form, change):
+        for warning in form.warnings:
+            messages.add_message(request, messages.WARNING, warning)
+        return super(AdvancedFilterAdmin, self).save_form(
+            request, form, change)
+
     def save_model(self, request, new_object, *args, **kwargs):
         if ('_clone' in request.GET) or ('_clone' in request.POST):
             # Cloning filter instance for current user
@@ -279,3 +449,15 @@ class AdvancedFilterAdmin(admin.ModelAdmin):
             request,
             f'{queryset.count()} filters successfully cloned.',
             level=messages.SUCCESS)
+
+    def refresh_selected_snapshots(self, request, queryset):
+        """Take a new snapshot of the results of the selected filters"""
+        refreshed = 0
+        for adv_filter in queryset.filter(snapshot_enabled=True):
+            if adv_filter.refresh_snapshot() is not None:
+                refreshed += 1
+
+        self.message_user(
+            request,
+            f'{refreshed} filter snapshots successfully refreshed.',
+            level=messages.SUCCESS)
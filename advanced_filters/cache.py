@@ -0,0 +1,177 @@
+"""Process-wide caches used to avoid repeated work on stored filters."""
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+
+GENERATION_KEY = 'advanced_filters:generation:%s'
+
+
+def clone_q(q):
+    """
+    Return a copy of a Q tree that shares no mutable state with the
+    original: every node and every list in the leaves is copied, while
+    immutable values are reused as-is.
+    """
+    def copy_node(node):
+        new = type(node)()
+        new.connector = node.connector
+        new.negated = node.negated
+        return new
+
+    root = copy_node(q)
+    stack = [(q, root)]
+    while stack:
+        src, dst = stack.pop()
+        for child in src.children:
+            if isinstance(child, Q):
+                new = copy_node(child)
+                stack.append((child, new))
+                dst.children.append(new)
+            elif isinstance(child, list) or isinstance(child[1], list):
+                key, value = child
+                if isinstance(value, list):
+                    value = list(value)
+                dst.children.append(type(child)((key, value)))
+            else:
+                dst.children.append(child)
+    return root
+
+
+class QueryCache(object):
+    """
+    A bounded, thread-safe LRU cache of deserialized Q objects, keyed by a
+    digest of the serialized query.
+
+    Cached objects are never handed out directly; ``get`` always returns a
+    copy so callers are free to modify the result. The number of entries
+    defaults to the ADVANCED_FILTERS_QUERY_CACHE_SIZE setting (256), read
+    on each access; a size of 0 disables caching altogether.
+    """
+    default_maxsize = 256
+
+    def __init__(self, maxsize=None):
+        self._maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    @property
+    def maxsize(self):
+        if self._maxsize is not None:
+            return self._maxsize
+        return getattr(settings, 'ADVANCED_FILTERS_QUERY_CACHE_SIZE',
+                       self.default_maxsize)
+
+    @staticmethod
+    def make_key(serialized):
+        if not isinstance(serialized, bytes):
+            serialized = serialized.encode('utf-8')
+        return hashlib.blake2b(serialized, digest_size=16).digest()
+
+    def get(self, serialized, loader, namespace=None):
+        """
+        Return a copy of the Q object for ``serialized``, calling
+        ``loader(serialized)`` to build it on a cache miss. Pass a
+        ``namespace`` when the loader's result depends on more than the
+        serialized query.
+        """
+        maxsize = self.maxsize
+        if maxsize <= 0:
+            return loader(serialized)
+        key = self.make_key(serialized if namespace is None else
+                            '%s:%s' % (namespace, serialized))
+        with self._lock:
+            query = self._data.get(key)
+            if query is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return clone_q(query)
+            self.misses += 1
+        query = loader(serialized)
+        with self._lock:
+            self._data[key] = query
+            self._data.move_to_end(key)
+            while len(self._data) > maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return clone_q(query)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        """Return the cache counters, to check whether the cache pays off"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+            }
+
+
+query_cache = QueryCache()
+
+
+def get_shared_cache():
+    """The Django cache (ADVANCED_FILTERS_CACHE setting) shared by processes"""
+    return caches[getattr(settings, 'ADVANCED_FILTERS_CACHE', 'default')]
+
+
+def _generation_key(model):
+    return GENERATION_KEY % model._meta.label_lower
+
+
+def get_generation(model):
+    """
+    The current generation of a model's data, bumped by ``bump_generation``
+    whenever one of its rows changes. Use it in the keys of cached results
+    that depend on the model's data.
+    """
+    cache = get_shared_cache()
+    key = _generation_key(model)
+    generation = cache.get(key)
+    if generation is None:
+        # start from the clock, so that an evicted counter never goes back
+        # to a generation that was already used
+        cache.add(key, int(time.time() * 1000000), None)
+        generation = cache.get(key, 0)
+    return generation
+
+
+def bump_generation(model):
+    """Invalidate all cached results that depend on a model's data"""
+    cache = get_shared_cache()
+    try:
+        cache.incr(_generation_key(model))
+    except ValueError:
+        get_generation(model)
+
+
+def _bump(sender, using=None, **kwargs):
+    bump_generation(sender)
+    if transaction.get_connection(using).in_atomic_block:
+        # results computed from the uncommitted data, or by other
+        # connections before the commit, were cached under the generation
+        # bumped above: bump again once the change is visible to everyone
+        transaction.on_commit(lambda: bump_generation(sender), using=using)
+
+
+def track_model(model):
+    """
+    Bump the generation of a model whenever one of its rows changes, and
+    again when the transaction making the change commits.
+    """
+    uid = 'advanced_filters_generation_%s' % model._meta.label_lower
+    post_save.connect(_bump, sender=model, dispatch_uid=uid)
+    post_delete.connect(_bump, sender=model, dispatch_uid=uid)
@@ -0,0 +1,295 @@
+"""
+Field and operator choices served to the advanced filter form, with their
+responses cached in the Django cache.
+
+Distinct values are searched with one of SEARCH_MODES, chosen per field by
+the ``advanced_filter_search_modes`` of its ModelAdmin, the
+ADVANCED_FILTERS_SEARCH_MODE setting, or else the cheapest mode for the
+field's type: a prefix search for text and an exact match for the others.
+
+Field choices are keyed by the request's parameters and the generation of
+the model they are read from (see ``advanced_filters.cache``), so saving or
+deleting one of its rows invalidates them; operator choices only depend on
+the field's type.
+"""
+from functools import lru_cache
+import hashlib
+import logging
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.admin.utils import get_fields_from_path
+from django.core.exceptions import ValidationError
+from django.db import connections, models
+from django.db.models.functions import Lower
+from django.utils.encoding import force_text
+
+from .admin import site
+from .cache import get_generation, get_shared_cache, track_model
+from .dictionaries import dictionary_value, has_dictionary
+from .forms import AdvancedFilterQueryForm
+from .models import FieldValue
+from .sampling import approximate_rows, sample_queryset
+from .timeouts import query_timeout
+
+logger = logging.getLogger('advanced_filters.choices')
+
+CHOICES_KEY = 'advanced_filters:choices:%s:%s'
+
+# search modes of the field choices
+ICONTAINS = 'icontains'
+ISTARTSWITH = 'istartswith'
+TRIGRAM = 'trigram'
+EXACT = 'exact'
+SEARCH_MODES = (ICONTAINS, ISTARTSWITH, TRIGRAM, EXACT)
+
+TEXT_OPERATORS = ["iexact", "icontains", "iregex", "in", "isnull"]
+BOOLEAN_OPERATORS = ["istrue", "isfalse", "isnull"]
+NUMBER_OPERATORS = ["lt", "gt", "lte", "gte", "in", "isnull"]
+DATE_OPERATORS = ["range", "lt", "gt", "lte", "gte", "isnull"]
+
+OPERATORS_BY_TYPE = {
+    'CharField': TEXT_OPERATORS,
+    'EmailField': TEXT_OPERATORS,
+    'URLField': TEXT_OPERATORS,
+    'BooleanField': BOOLEAN_OPERATORS,
+    'PositiveIntegerField': NUMBER_OPERATORS,
+    'SmallIntegerField': NUMBER_OPERATORS,
+    'PositiveSmallIntegerField': NUMBER_OPERATORS,
+    'BigIntegerField': NUMBER_OPERATORS,
+    'IntegerField': NUMBER_OPERATORS,
+    'FloatField': NUMBER_OPERATORS,
+    'DecimalField': NUMBER_OPERATORS,
+    'DateTimeField': DATE_OPERATORS,
+    'DateField': DATE_OPERATORS,
+}
+
+
+@lru_cache(maxsize=1024)
+def resolve_field(app_label, model_name, field_name):
+    """
+    Return the field a "path__to__field" of a model refers to, and make
+    sure the cached choices of the model it belongs to are invalidated when
+    its rows change.
+    """
+    model = apps.get_model(app_label, model_name)
+    field = get_fields_from_path(model, field_name)[-1]
+    track_model(field.model)
+    return field
+
+
+def get_search_mode(field, model_admin=None, field_name=None):
+    """
+    The search mode of a field: the ``advanced_filter_search_modes`` entry
+    (a dict of field path to mode) of a ModelAdmin, the
+    ADVANCED_FILTERS_SEARCH_MODE setting, or the cheapest mode that works
+    for the field's type.
+    """
+    modes = getattr(model_admin, 'advanced_filter_search_modes', None) or {}
+    mode = (modes.get(field_name or field.name) or
+            getattr(settings, 'ADVANCED_FILTERS_SEARCH_MODE', None))
+    if mode is None:
+        text = isinstance(field, (models.CharField, models.TextField))
+        mode = ISTARTSWITH if text else EXACT
+    if mode not in SEARCH_MODES:
+        raise ValueError('Invalid advanced filters search mode: %r' % mode)
+    return mode
+
+
+def search_queryset(queryset, field, search, mode):
+    """
+    Filter queryset by the values of field matching search, in a way an
+    index can serve: ``istartswith`` compares ``LOWER(column)`` with a
+    prefix (use a ``Lower()`` index), ``trigram`` uses the ``%`` operator of
+    pg_trgm (use a trigram index) and falls back to ``icontains`` on other
+    databases or without ``django.contrib.postgres``. Returns None when the
+    search can't match any value of the field.
+    """
+    if not search:
+        return queryset
+    if mode == ISTARTSWITH:
+        return queryset.annotate(_afilter_search=Lower(field.name)).filter(
+            _afilter_search__startswith=search.lower())
+    if mode == EXACT:
+        try:
+            return queryset.filter(**{field.name: field.to_python(search)})
+        except ValidationError:
+            return None
+    if (mode == TRIGRAM and
+            connections[queryset.db].vendor == 'postgresql' and
+            field.get_lookup('trigram_similar')):
+        return queryset.filter(**{'%s__trigram_similar' % field.name: search})
+    return queryset.filter(**{'%s__icontains' % field.name: search})
+
+
+def indexed_search(field, mode, using):
+    """Whether an index can serve the searches of ``search_queryset``"""
+    if mode == TRIGRAM:
+        return (connections[using].vendor == 'postgresql' and
+                field.get_lookup('trigram_similar') is not None)
+    return mode in (ISTARTSWITH, EXACT)
+
+
+def choices_ttl():
+    """Seconds choices responses are cached for, 0 disables the cache"""
+    return getattr(settings, 'ADVANCED_FILTERS_CHOICES_TTL', 300)
+
+
+def cached_choices(kind, model, params, compute, generation=True):
+    """
+    Return the cached response of kind ("field" or "operators") for params,
+    calling ``compute()`` to build and cache it on a miss. With
+    ``generation`` the response is invalidated by changes to ``model``.
+    """
+    ttl = choices_ttl()
+    if not ttl:
+        return compute()
+    cache = get_shared_cache()
+    parts = (model._meta.label_lower,) + tuple(params)
+    if generation:
+        parts += (get_generation(model),)
+    key = CHOICES_KEY % (kind, hashlib.blake2b(
+        repr(parts).encode('utf-8'), digest_size=16).hexdigest())
+    response = cache.get(key)
+    if response is None:
+        response = compute()
+        cache.set(key, response, ttl)
+    return response
+
+
+def fetch_page(queryset, field_name, page_size, page=1, after=None):
+    """
+    Return a page of the values of an ordered ``values_list`` queryset and
+    whether there are more, without counting them: one extra row is
+    fetched instead. With ``after`` (the last value of the previous page)
+    the page continues from that value, which unlike an offset stays cheap
+    however deep it is.
+    """
+    if after is not None:
+        queryset = queryset.filter(**{'%s__gt' % field_name: after})
+        offset = 0
+    else:
+        offset = (page - 1) * page_size
+    values = list(queryset[offset:offset + page_size + 1])
+    return values[:page_size], len(values) > page_size
+
+
+def lookup_field_choices(field, search='', page=1, after=None, mode=None):
+    """
+    Return the response of the field choices view: the field's choices or
+    a page of its distinct values matching ``search`` (see
+    ``search_queryset``, mode defaults to the field's ``get_search_mode``),
+    flagged as "approximate" when read from a sample of a large table.
+    Searches an index can serve are never sampled.
+    ``after`` must already be converted with ``field.to_python``.
+
+    Raises QueryTimeout when the lookup takes longer than
+    ADVANCED_FILTERS_QUERY_TIMEOUT.
+    """
+    choices = sorted(field.choices)
+    has_next = False
+    queryset = rows = None
+    # if no choices, populate with distinct values from instances
+    if not choices:
+        disabled = getattr(settings, 'ADVANCED_FILTERS_DISABLE_FOR_FIELDS',
+                           tuple())
+        if field.name in disabled:
+            logger.debug('Skipped lookup of choices for disabled fields')
+        elif isinstance(field, (models.BooleanField, models.DateField,
+                                models.TimeField)):
+            logger.debug('No choices calculated for field %s of type %s',
+                         field, type(field))
+        elif (page > 0 or after is not None) and has_dictionary(field):
+            return lookup_dictionary_choices(
+                field, search, page, after, mode or get_search_mode(field))
+        elif page > 0 or after is not None:
+            mode = mode or get_search_mode(field)
+            queryset = field.model.objects.filter(**{
+                "{}__isnull".format(field.name): False})
+            if not search or not indexed_search(field, mode, queryset.db):
+                rows = approximate_rows(field.model)
+            if rows is not None:
+                sampled = sample_queryset(queryset, rows)
+                if sampled is None:
+                    rows = None
+                else:
+                    queryset = sampled
+            queryset = search_queryset(queryset, field, search, mode)
+        if queryset is not None:
+            # the order_by() avoids ambiguity with values() and distinct()
+            queryset = queryset.order_by(field.name).values_list(
+                field.name, flat=True).distinct()
+            page_size = getattr(settings, 'ADVANCED_FILTERS_PAGE_SIZE', 20)
+            with query_timeout(using=queryset.db):
+                values, has_next = fetch_page(
+                    queryset, field.name, page_size, page, after)
+            choices = list(zip(values, values))
+
+    results = [{'id': c[0], 'text': force_text(c[1])} for c in choices]
+    if rows is not None:
+        return {'results': results, 'more': has_next, 'approximate': True}
+    return {'results': results, 'more': has_next}
+
+
+def lookup_dictionary_choices(field, search='', page=1, after=None,
+                              mode=ISTARTSWITH):
+    """
+    Same as ``lookup_field_choices``, from the value dictionary of the
+    field (see ``advanced_filters.dictionaries``) instead of its table:
+    values are ordered as text, and come with the number of rows holding
+    them.
+    """
+    queryset = search_queryset(
+        FieldValue.objects.filter(model=field.model._meta.label_lower,
+                                  field=field.name),
+        FieldValue._meta.get_field('value'), search, mode)
+    if queryset is None:
+        return {'results': [], 'more': False}
+    queryset = queryset.order_by('value').values_list('value', 'count')
+    page_size = getattr(settings, 'ADVANCED_FILTERS_PAGE_SIZE', 20)
+    rows, has_next = fetch_page(queryset, 'value', page_size, page,
+                                dictionary_value(after))
+    results = [{'id': field.to_python(value), 'text': value, 'count': count}
+               for value, count in rows]
+    return {'results': results, 'more': has_next}
+
+
+def get_field_choices(model, field_name, search='', page=1, after=None):
+    """
+    Cached ``lookup_field_choices`` of the field at ``field_name`` of
+    ``model`` ("app.Model"). ``after`` is the raw value of the cursor.
+    """
+    app_label, model_name = model.split('.', 1)
+    field = resolve_field(app_label, model_name, field_name)
+    model_admin = site._registry.get(apps.get_model(app_label, model_name))
+    mode = get_search_mode(field, model_admin, field_name)
+    # a cursor makes the page number irrelevant, share the response
+    cursor = ('after', after) if after is not None else ('page', page)
+    return cached_choices('field', field.model, (
+        model, field_name, mode, search) + cursor,
+        lambda: lookup_field_choices(
+            field, search, page,
+            None if after is None else field.to_python(after), mode))
+
+
+def operator_choices(field):
+    """The operators offered for a field, according to its type"""
+    disabled = getattr(settings, 'ADVANCED_FILTERS_DISABLE_FOR_FIELDS',
+                       tuple())
+    if field.name in disabled:
+        logger.debug('Skipped lookup of operators for disabled fields')
+        return []
+    af_options = dict(AdvancedFilterQueryForm.OPERATORS)
+    field_options = OPERATORS_BY_TYPE.get(field.get_internal_type(),
+                                          af_options)
+    return [{'key': option, 'value': af_options[option]}
+            for option in field_options]
+
+
+def get_operator_choices(model, field_name):
+    """Cached ``operator_choices`` of the field at ``field_name``"""
+    app_label, model_name = model.split('.', 1)
+    field = resolve_field(app_label, model_name, field_name)
+    return cached_choices('operators', field.model, (model, field_name),
+                          lambda: {'results': operator_choices(field)},
+                          generation=False)
@@ -0,0 +1,228 @@
+"""Turn stored filter queries into querysets as cheaply as possible."""
+from functools import lru_cache
+import time
+
+from django.conf import settings
+from django.contrib.admin.utils import NotRelationField, get_fields_from_path
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections
+from django.db.models import Exists, OuterRef, Q
+
+from . import signals
+from .in_lists import in_list_values, max_in_list_size
+
+LOOKUP_SEP = '__'
+
+# query compilation modes
+JOIN = 'join'
+EXISTS = 'exists'
+QUERY_MODES = (JOIN, EXISTS)
+
+
+def iter_lookups(query):
+    """Yield the lookup keys (i.e "field__iexact") of all leaves of a Q"""
+    stack = [query]
+    while stack:
+        node = stack.pop()
+        for child in node.children:
+            if isinstance(child, Q):
+                stack.append(child)
+            else:
+                yield child[0]
+
+
+def resolve_lookup(model, lookup):
+    """
+    Return the list of fields a lookup key follows, without the trailing
+    lookups/transforms, or None if it can't be followed at all.
+    """
+    parts = lookup.split(LOOKUP_SEP)
+    for n in range(len(parts), 0, -1):
+        try:
+            return get_fields_from_path(model, LOOKUP_SEP.join(parts[:n]))
+        except (FieldDoesNotExist, NotRelationField):
+            continue
+    return None
+
+
+def is_multivalued(fields):
+    """Whether following the fields may join more than one row per object"""
+    return any(f.many_to_many or f.one_to_many for f in fields)
+
+
+@lru_cache(maxsize=1024)
+def _lookups_require_distinct(model, lookups):
+    for lookup in lookups:
+        fields = resolve_lookup(model, lookup)
+        # be on the safe side with paths that could not be followed
+        if fields is None or is_multivalued(fields):
+            return True
+    return False
+
+
+def requires_distinct(model, query):
+    """
+    Whether filtering ``model`` by ``query`` may produce duplicate rows,
+    i.e if any condition spans a reverse foreign key or a many to many
+    relation. Results are cached per model and set of lookups.
+    """
+    return _lookups_require_distinct(model, frozenset(iter_lookups(query)))
+
+
+@lru_cache(maxsize=4096)
+def multivalued_prefix(model, lookup):
+    """
+    Return the part of a lookup key up to (and including) its first
+    multi-valued relation, or None if it follows no such relation.
+    """
+    fields = resolve_lookup(model, lookup) or ()
+    for index, field in enumerate(fields):
+        if field.many_to_many or field.one_to_many:
+            return LOOKUP_SEP.join(lookup.split(LOOKUP_SEP)[:index + 1])
+    return None
+
+
+class _ExistsGroup(list):
+    """Leaves of a node that will be tested by the same EXISTS subquery"""
+
+
+def rewrite_exists(model, query):
+    """
+    Rewrite the conditions of query that span multi-valued relations into
+    correlated EXISTS subqueries. Returns a new Q object and a dict of the
+    annotations it refers to.
+
+    Conditions AND'ed in the same node over the same relation share a
+    single subquery, to keep Django's semantics of matching them against
+    the same related row; negated conditions become NOT EXISTS instead of
+    NOT IN (subquery).
+    """
+    annotations = {}
+
+    def copy_node(node):
+        new = type(node)()
+        new.connector = node.connector
+        new.negated = node.negated
+        return new
+
+    root = copy_node(query)
+    stack = [(query, root)]
+    while stack:
+        src, dst = stack.pop()
+        groups = {}
+        for child in src.children:
+            if isinstance(child, Q):
+                new = copy_node(child)
+                dst.children.append(new)
+                stack.append((child, new))
+                continue
+            prefix = multivalued_prefix(model, child[0])
+            if prefix is None:
+                dst.children.append(child)
+            elif src.connector == Q.AND and prefix in groups:
+                groups[prefix].append(child)
+            else:
+                group = _ExistsGroup([child])
+                if src.connector == Q.AND:
+                    groups[prefix] = group
+                dst.children.append(group)
+
+        for index, child in enumerate(dst.children):
+            if isinstance(child, _ExistsGroup):
+                alias = '_afilter_exists_%d' % len(annotations)
+                annotations[alias] = Exists(
+                    model._base_manager.filter(pk=OuterRef('pk')).filter(
+                        *[Q(tuple(leaf)) for leaf in child]))
+                dst.children[index] = (alias, True)
+    return root, annotations
+
+
+def _is_long_list(child, size):
+    return (child[0].endswith(LOOKUP_SEP + 'in') and
+            isinstance(child[1], (list, tuple)) and len(child[1]) > size)
+
+
+def rewrite_in_lists(model, query, connection):
+    """
+    Return query with the ``__in`` lists too long to be passed as query
+    parameters replaced by a single one (see ``in_lists``), or query itself
+    if there are none.
+    """
+    size = max_in_list_size(connection)
+    stack = [query]
+    while stack:
+        node = stack.pop()
+        if any(not isinstance(c, Q) and _is_long_list(c, size)
+               for c in node.children):
+            break
+        stack.extend(c for c in node.children if isinstance(c, Q))
+    else:
+        return query
+
+    def copy_node(node):
+        new = type(node)()
+        new.connector = node.connector
+        new.negated = node.negated
+        return new
+
+    root = copy_node(query)
+    stack = [(query, root)]
+    while stack:
+        src, dst = stack.pop()
+        for child in src.children:
+            if isinstance(child, Q):
+                new = copy_node(child)
+                dst.children.append(new)
+                stack.append((child, new))
+                continue
+            fields = resolve_lookup(model, child[0])
+            if fields and _is_long_list(child, size):
+                field = fields[-1]
+                if field.is_relation:
+                    field = field.target_field
+                child = (child[0], in_list_values(connection, field, child[1]))
+            dst.children.append(child)
+    return root
+
+
+def get_query_mode(model_admin=None):
+    """
+    The query compilation mode of a ModelAdmin (the
+    ``advanced_filter_query_mode`` attribute), defaulting to the
+    ADVANCED_FILTERS_QUERY_MODE setting ("join").
+    """
+    mode = (getattr(model_admin, 'advanced_filter_query_mode', None) or
+            getattr(settings, 'ADVANCED_FILTERS_QUERY_MODE', JOIN))
+    if mode not in QUERY_MODES:
+        raise ValueError('Invalid advanced filters query mode: %r' % mode)
+    return mode
+
+
+def apply_query(queryset, query, mode=None):
+    """
+    Filter a queryset by query.
+
+    In "join" mode, multi-valued relations are joined and DISTINCT is
+    only added when they are. In "exists" mode they are tested with
+    correlated (NOT) EXISTS subqueries, which never produce duplicates.
+
+    Long ``__in`` lists are passed as a single parameter.
+    """
+    started = time.perf_counter()
+    mode = mode or get_query_mode()
+    model = queryset.model
+    compiled = rewrite_in_lists(model, query, connections[queryset.db])
+    if mode == EXISTS:
+        compiled, annotations = rewrite_exists(model, compiled)
+        if annotations:
+            # alias() (Django >= 3.2) keeps the subqueries out of SELECT
+            add = getattr(queryset, 'alias', queryset.annotate)
+            queryset = add(**annotations)
+        queryset = queryset.filter(compiled)
+    else:
+        queryset = queryset.filter(compiled)
+        if requires_distinct(model, compiled):
+            queryset = queryset.distinct()
+    signals.send_timed(signals.query_compiled, model, started, query=query,
+                       mode=mode, queryset=queryset)
+    return queryset
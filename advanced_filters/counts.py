@@ -0,0 +1,88 @@
+"""
+Cached result counts of advanced filters, shown next to their titles.
+
+Counts are kept in the Django cache, keyed by the filter's query, the
+queryset it is counted on and the model's generation, so saving or deleting
+a row (once committed) invalidates them. They also expire after
+ADVANCED_FILTERS_COUNT_TTL seconds.
+"""
+import logging
+
+from django.conf import settings
+from django.core.exceptions import EmptyResultSet
+
+from .cache import get_generation, get_shared_cache, query_cache
+from .compiler import apply_query
+
+logger = logging.getLogger('advanced_filters.counts')
+
+COUNT_KEY = 'advanced_filters:count:%s:%s:%s:%s'
+
+
+def show_counts(model_admin=None):
+    """
+    Whether counts are shown for a ModelAdmin (the
+    ``advanced_filter_show_counts`` attribute), defaulting to the
+    ADVANCED_FILTERS_SHOW_COUNTS setting.
+    """
+    show = getattr(model_admin, 'advanced_filter_show_counts', None)
+    if show is None:
+        show = getattr(settings, 'ADVANCED_FILTERS_SHOW_COUNTS', False)
+    return show
+
+
+def _scope(queryset):
+    """
+    A digest of the SQL of a queryset, so that the counts on the querysets
+    of different users (a ModelAdmin's ``get_queryset`` is often restricted
+    by the request) are cached apart.
+    """
+    try:
+        sql = str(queryset.query)
+    except EmptyResultSet:
+        sql = ''
+    return query_cache.make_key(sql).hex()
+
+
+def get_filter_counts(queryset, afilters, mode=None):
+    """
+    Return a dict of filter id to the number of rows of ``queryset`` (the
+    ModelAdmin's ``get_queryset(request)``) it matches, or None when it is
+    not known yet.
+
+    Cached counts are fetched at once; at most
+    ADVANCED_FILTERS_COUNT_REFRESH_BUDGET missing counts are computed per
+    call (so a page view never runs a COUNT per filter).
+    """
+    model = queryset.model
+    cache = get_shared_cache()
+    prefix = (model._meta.label_lower, get_generation(model),
+              _scope(queryset))
+    keys = {}
+    for afilter in afilters:
+        if afilter.b64_query:
+            keys[afilter.pk] = COUNT_KEY % (prefix +
+                                            (afilter._query_digest(),))
+    cached = cache.get_many(list(keys.values()))
+
+    budget = getattr(settings, 'ADVANCED_FILTERS_COUNT_REFRESH_BUDGET', 3)
+    counts = {}
+    refreshed = {}
+    for afilter in afilters:
+        key = keys.get(afilter.pk)
+        count = cached.get(key)
+        if count is None and key is not None and budget > 0:
+            budget -= 1
+            try:
+                count = apply_query(queryset, afilter.query,
+                                    mode=mode).count()
+            except Exception:
+                logger.exception('Failed counting advanced filter %s',
+                                 afilter.pk)
+            else:
+                refreshed[key] = count
+        counts[afilter.pk] = count
+    if refreshed:
+        cache.set_many(refreshed, getattr(
+            settings, 'ADVANCED_FILTERS_COUNT_TTL', 300))
+    return counts
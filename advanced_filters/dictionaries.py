@@ -0,0 +1,217 @@
+"""
+Value dictionaries: the distinct values of a field and the number of rows
+holding each, kept in the FieldValue table so that the choices of low to
+medium cardinality fields (a status, a country, a plan) are looked up
+without touching the field's own, possibly large, table.
+
+Dictionaries are opt-in, per field, with the
+``advanced_filter_dictionary_fields`` of a ModelAdmin. They are updated
+through model signals as rows are saved and deleted; bulk operations
+(``update()``, ``bulk_create()``, raw SQL) bypass signals, so they should
+also be rebuilt periodically with ``rebuild_advanced_filter_dictionaries``.
+
+Tracking has a cost on the writes of the model: every loaded instance
+remembers the values of its tracked fields (a ``post_init`` handler), and
+the counts of the values a transaction changed are updated once it is
+committed, in a batch, so that writers don't hold the locks of the shared
+count rows for the rest of their transaction. Counts changed by a savepoint
+that is rolled back, or by a process that dies before applying them, drift
+until the next rebuild.
+"""
+from collections import Counter
+import logging
+import threading
+import weakref
+
+from django.contrib.admin.utils import NotRelationField, get_fields_from_path
+from django.core.exceptions import FieldDoesNotExist
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Count, F
+from django.db.models.signals import post_delete, post_init, post_save
+from django.utils.encoding import force_text
+
+from .cache import bump_generation
+from .models import FieldValue
+
+logger = logging.getLogger('advanced_filters.dictionaries')
+
+MAX_LENGTH = FieldValue._meta.get_field('value').max_length
+
+# model: {name: attname} of its fields with a dictionary
+_fields = {}
+
+# the batches of counts waiting for the commit of the current transaction of
+# each database connection of a thread, in ``batches`` ({alias: weakref})
+_pending = threading.local()
+
+
+def dictionary_value(value):
+    """The text a value is stored as, None if it is not stored at all"""
+    if value is None:
+        return None
+    value = force_text(value)
+    return value if len(value) <= MAX_LENGTH else None
+
+
+def has_dictionary(field):
+    return field.name in _fields.get(field.model, ())
+
+
+def _values(model, field_name, value):
+    return FieldValue.objects.filter(model=model._meta.label_lower,
+                                     field=field_name, value=value)
+
+
+def add_value(model, field_name, value, count=1):
+    """Count ``count`` more rows of model holding value"""
+    value = dictionary_value(value)
+    if value is None:
+        return
+    values = _values(model, field_name, value)
+    if values.update(count=F('count') + count):
+        return
+    try:
+        with transaction.atomic(using=values.db):
+            FieldValue.objects.create(model=model._meta.label_lower,
+                                      field=field_name, value=value,
+                                      count=count)
+    except IntegrityError:
+        # created concurrently
+        values.update(count=F('count') + count)
+
+
+def remove_value(model, field_name, value, count=1):
+    """Count ``count`` less rows of model holding value"""
+    value = dictionary_value(value)
+    if value is None:
+        return
+    values = _values(model, field_name, value)
+    if not values.filter(count__gt=count).update(count=F('count') - count):
+        values.delete()
+
+
+class _PendingCounts(Counter):
+    """
+    The changes to the counts of values made by the current transaction of
+    a connection, applied at once when it is committed.
+    """
+    applied = False
+
+    def __call__(self):
+        self.applied = True
+        # in a stable order, so that concurrent batches don't deadlock
+        for (model, field_name, value), count in sorted(
+                self.items(), key=lambda item: (
+                    item[0][0]._meta.label_lower,) + item[0][1:]):
+            if count > 0:
+                add_value(model, field_name, value, count)
+            elif count < 0:
+                remove_value(model, field_name, value, -count)
+        # choices cached since the rows were committed predate the counts
+        for model in {key[0] for key in self}:
+            bump_generation(model)
+
+
+def _queue(using, model, field_name, value, count):
+    value = dictionary_value(value)
+    if value is None:
+        return
+    connection = connections[using]
+    if not connection.in_atomic_block:
+        _PendingCounts({(model, field_name, value): count})()
+        return
+    batches = getattr(_pending, 'batches', None)
+    if batches is None:
+        batches = _pending.batches = {}
+    # only the on_commit callback holds on to the batch: when a rollback
+    # drops the callback, the batch is gone with it
+    pending = batches[using]() if using in batches else None
+    if pending is None or pending.applied:
+        pending = _PendingCounts()
+        batches[using] = weakref.ref(pending)
+        transaction.on_commit(pending, using=using)
+    pending[model, field_name, value] += count
+
+
+def _current_values(sender, instance):
+    values = {}
+    for name, attname in _fields.get(sender, {}).items():
+        if attname in instance.__dict__:  # not deferred
+            values[name] = instance.__dict__[attname]
+    return values
+
+
+def _remember(sender, instance, **kwargs):
+    instance._afilter_dictionary = _current_values(sender, instance)
+
+
+def _saved(sender, instance, created, using, update_fields=None,
+           **kwargs):
+    old = getattr(instance, '_afilter_dictionary', {})
+    new = _current_values(sender, instance)
+    for name, value in new.items():
+        if created:
+            _queue(using, sender, name, value, 1)
+        elif update_fields is not None and name not in update_fields:
+            continue
+        elif name in old and old[name] != value:
+            _queue(using, sender, name, old[name], -1)
+            _queue(using, sender, name, value, 1)
+    instance._afilter_dictionary = new
+
+
+def _deleted(sender, instance, using, **kwargs):
+    # the values remembered from the database are the ones counted, unsaved
+    # changes to the instance are not
+    values = _current_values(sender, instance)
+    values.update(getattr(instance, '_afilter_dictionary', {}))
+    for name, value in values.items():
+        _queue(using, sender, name, value, -1)
+
+
+def track_dictionary(field):
+    """Keep the dictionary of a field current as its model's rows change"""
+    model = field.model
+    _fields.setdefault(model, {})[field.name] = field.attname
+    uid = 'advanced_filters_dictionary_%s' % model._meta.label_lower
+    post_init.connect(_remember, sender=model, dispatch_uid=uid)
+    post_save.connect(_saved, sender=model, dispatch_uid=uid)
+    post_delete.connect(_deleted, sender=model, dispatch_uid=uid)
+
+
+def dictionary_fields(model_admin):
+    """The fields of a ModelAdmin's ``advanced_filter_dictionary_fields``"""
+    fields = []
+    for path in getattr(model_admin, 'advanced_filter_dictionary_fields', ()):
+        try:
+            field = get_fields_from_path(model_admin.model, path)[-1]
+        except (FieldDoesNotExist, NotRelationField):
+            logger.debug('Invalid advanced filter dictionary field %s', path)
+            continue
+        if field.concrete and not field.many_to_many:
+            fields.append(field)
+    return fields
+
+
+def rebuild_dictionary(field):
+    """
+    Replace the dictionary of a field by the values counted in its table,
+    with a single aggregate query. Returns the number of distinct values.
+    """
+    model = field.model
+    counts = Counter()
+    rows = model._default_manager.filter(**{
+        '%s__isnull' % field.name: False}).order_by().values_list(
+            field.name).annotate(count=Count('pk'))
+    for value, count in rows.iterator():
+        value = dictionary_value(value)
+        if value is not None:
+            counts[value] += count
+    label = model._meta.label_lower
+    with transaction.atomic(using=FieldValue.objects.db):
+        FieldValue.objects.filter(model=label, field=field.name).delete()
+        FieldValue.objects.bulk_create(
+            [FieldValue(model=label, field=field.name, value=value,
+                        count=count) for value, count in counts.items()],
+            batch_size=500)
+    return len(counts)
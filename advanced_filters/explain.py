@@ -0,0 +1,100 @@
+"""
+Estimate the cost of a filter with the database's query planner, so that
+pathological filters can be flagged before they are saved.
+
+PostgreSQL reports an estimated total cost and number of rows. SQLite only
+reports the query plan, so full table scans are counted instead.
+"""
+from collections import namedtuple
+import logging
+import re
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.utils.translation import ugettext as _
+import simplejson as json
+
+from .compiler import apply_query
+
+logger = logging.getLogger('advanced_filters.explain')
+
+Estimate = namedtuple('Estimate', ('cost', 'rows', 'scans', 'plan'))
+
+SQLITE_SCAN = re.compile(r'\bSCAN (?!CONSTANT ROW)')
+
+
+def _estimate_postgresql(queryset):
+    plan = json.loads(queryset.explain(format='json'))
+    if isinstance(plan, list):
+        plan = plan[0]
+    root = plan['Plan']
+    scans = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node.get('Node Type') == 'Seq Scan':
+            scans += 1
+        stack.extend(node.get('Plans', ()))
+    return Estimate(root.get('Total Cost'), root.get('Plan Rows'), scans,
+                    plan)
+
+
+def _estimate_sqlite(queryset):
+    plan = queryset.explain()
+    scans = sum(1 for line in plan.splitlines() if SQLITE_SCAN.search(line))
+    return Estimate(None, None, scans, plan)
+
+
+ESTIMATORS = {
+    'postgresql': _estimate_postgresql,
+    'sqlite': _estimate_sqlite,
+}
+
+
+def estimate_query(queryset, query, mode=None):
+    """
+    Return the planner's Estimate of filtering queryset by query, or None
+    if the database backend is not supported or the planner failed.
+    """
+    vendor = connections[queryset.db].vendor
+    estimator = ESTIMATORS.get(vendor)
+    if estimator is None:
+        return None
+    try:
+        return estimator(apply_query(queryset, query, mode=mode))
+    except (DatabaseError, ValueError, KeyError, IndexError) as e:
+        logger.warning('Could not estimate the cost of a filter: %s', e)
+        return None
+
+
+def _threshold(name):
+    return getattr(settings, 'ADVANCED_FILTERS_%s' % name, None)
+
+
+def explain_enabled():
+    """Whether any of the cost thresholds is set"""
+    return any(_threshold(name) is not None for name in (
+        'WARN_COST', 'REFUSE_COST', 'WARN_SCANS', 'REFUSE_SCANS'))
+
+
+def check_estimate(estimate):
+    """
+    Compare an estimate with the ADVANCED_FILTERS_{WARN,REFUSE}_{COST,SCANS}
+    settings; return a ('warning' or 'error', message) tuple or None.
+    """
+    if estimate is None:
+        return None
+    for level, prefix in (('error', 'REFUSE'), ('warning', 'WARN')):
+        max_cost = _threshold('%s_COST' % prefix)
+        if (max_cost is not None and estimate.cost is not None and
+                estimate.cost > max_cost):
+            return level, _(
+                'This filter is expensive to run (estimated cost %(cost)s, '
+                'about %(rows)s rows).') % {
+                    'cost': estimate.cost, 'rows': estimate.rows}
+        max_scans = _threshold('%s_SCANS' % prefix)
+        if max_scans is not None and estimate.scans > max_scans:
+            return level, _(
+                'This filter is expensive to run (%(scans)d full table '
+                'scans).') % {'scans': estimate.scans}
+    return None
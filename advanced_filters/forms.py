@@ -8,7 +8,7 @@ from django import forms
 from django.apps import apps
 from django.conf import settings
 from django.contrib import admin
-from django.contrib.admin.utils import get_fields_from_path
+from django.contrib.admin.utils import NotRelationField, get_fields_from_path
 from django.db.models import FieldDoesNotExist, Q
 from django.db.models.fields import DateField
 from django.forms.formsets import BaseFormSet, formset_factory
@@ -18,8 +18,12 @@ from django.utils.six.moves import range, reduce
 from django.utils.text import capfirst
 from django.utils.translation import ugettext_lazy as _
 
+from .compiler import get_query_mode
+from .explain import check_estimate, estimate_query, explain_enabled
 from .form_helpers import CleanWhiteSpacesMixin, VaryingTypeCharField
+from .in_lists import split_values
 from .models import AdvancedFilter
+from .snapshots import supports_snapshot
 
 # django < 1.9 support
 USE_VENDOR_DIR = django.VERSION >= (1, 9)
@@ -43,6 +47,7 @@ class AdvancedFilterQueryForm(CleanWhiteSpacesMixin, forms.Form):
         ("iexact", _("Equals")),
         ("icontains", _("Contains")),
         ("iregex", _("One of")),
+        ("in", _("In list")),
         ("range", _("DateTime Range")),
         ("isnull", _("Is NULL")),
         ("istrue", _("Is TRUE")),
@@ -139,8 +144,12 @@ class AdvancedFilterQueryForm(CleanWhiteSpacesMixin, forms.Form):
             else:
                 query_data['operator'] = operator  # default
 
-        if isinstance(query_data.get('value'),
-                      list) and query_data['operator'] == 'range':
+        if (isinstance(query_data.get('value'), list) and
+                query_data['operator'] == 'in'):
+            query_data['value'] = ', '.join(
+                str(v) for v in query_data['value'])
+        elif isinstance(query_data.get('value'),
+                        list) and query_data['operator'] == 'range':
             date_from = date_to_string(query_data.get('value_from'))
             date_to = date_to_string(query_data.get('value_to'))
             query_data['value'] = ','.join([date_from, date_to])
@@ -159,12 +168,46 @@ class AdvancedFilterQueryForm(CleanWhiteSpacesMixin, forms.Form):
             raise forms.ValidationError([])
         data['value'] = (dtfrom, dtto)
 
+    def set_list_value(self, data):
+        """
+        Parse the raw value (commas and newlines are not meaningful to the
+        value field) into a list of values.
+        """
+        values = split_values(self.data.get(self.add_prefix('value')))
+        if not values:
+            raise forms.ValidationError(
+                {'value': ["This field is required.", ]})
+        field = self.get_model_field(data.get('field'))
+        if field is not None:
+            invalid = []
+            for value in values:
+                try:
+                    field.to_python(value)
+                except forms.ValidationError:
+                    invalid.append(value)
+            if invalid:
+                raise forms.ValidationError({'value': [
+                    _('Invalid values: %s') % ', '.join(invalid)]})
+        data['value'] = values
+
+    def get_model_field(self, path):
+        """The field of the form's model at path, None if not known"""
+        if self.model is None or not path:
+            return None
+        try:
+            field = get_fields_from_path(self.model, path)[-1]
+        except (FieldDoesNotExist, NotRelationField):
+            return None
+        return field.target_field if field.is_relation else field
+
     def clean(self):
         cleaned_data = super(AdvancedFilterQueryForm, self).clean()
         if cleaned_data.get('operator') == "range":
             if ('value_from' in cleaned_data and
                     'value_to' in cleaned_data):
                 self.set_range_value(cleaned_data)
+        elif cleaned_data.get('operator') == "in":
+            self.set_list_value(cleaned_data)
         elif (not (cleaned_data.get('field') == "_OR" or
                    cleaned_data.get('operator') == "isnull" or
                    cleaned_data.get('operator') == "istrue" or
@@ -188,6 +231,7 @@ class AdvancedFilterQueryForm(CleanWhiteSpacesMixin, forms.Form):
 
     def __init__(self, model_fields={}, readonly=False, *args, **kwargs):
         self.readonly = readonly
+        self.model = kwargs.pop('model', None)
         super(AdvancedFilterQueryForm, self).__init__(*args, **kwargs)
         self.FIELD_CHOICES = self._build_field_choices(model_fields)
         self.fields['field'].choices = self.FIELD_CHOICES
@@ -210,6 +254,7 @@ class AdvancedFilterFormSet(BaseFormSet):
     def __init__(self, *args, **kwargs):
         self.model_fields = kwargs.pop('model_fields', {})
         self.readonly = kwargs.pop('readonly', False)
+        self.model = kwargs.pop('model', None)
         super(AdvancedFilterFormSet, self).__init__(*args, **kwargs)
         if self.forms:
             form = self.forms[0]
@@ -219,13 +264,15 @@ class AdvancedFilterFormSet(BaseFormSet):
         kwargs = super(AdvancedFilterFormSet, self).get_form_kwargs(index)
         kwargs['model_fields'] = self.model_fields
         kwargs['readonly'] = self.readonly
+        kwargs['model'] = self.model
         return kwargs
 
     @cached_property
     def forms(self):
         # override the original property to include `model_fields` and `readonly` argument
         forms = [self._construct_form(
-                    i, model_fields=self.model_fields, readonly=self.readonly)
+                    i, model_fields=self.model_fields, readonly=self.readonly,
+                    model=self.model)
                  for i in range(self.total_form_count())]
         forms.append(self.empty_form)  # add initial empty form
         return forms
@@ -244,7 +291,7 @@ class AdvancedFilterForm(CleanWhiteSpacesMixin, forms.ModelForm):
     """ Form to save/edit advanced filter forms """
     class Meta:
         model = AdvancedFilter
-        fields = ('title', 'is_public')
+        fields = ('title', 'is_public', 'snapshot_enabled')
 
     class Media:
         required_js = [
@@ -310,8 +357,11 @@ class AdvancedFilterForm(CleanWhiteSpacesMixin, forms.ModelForm):
             raise Exception('Adding new AdvancedFilter from admin is '
                             'not supported')
 
+        self._model_admin = model_admin
         self._filter_fields = filter_fields or getattr(
             model_admin, 'advanced_filter_fields', ())
+        # cost warnings, set when the form is cleaned
+        self.warnings = []
 
         super(AdvancedFilterForm, self).__init__(*args, **kwargs)
 
@@ -333,8 +383,32 @@ class AdvancedFilterForm(CleanWhiteSpacesMixin, forms.ModelForm):
             raise forms.ValidationError("Error validating filter forms")
         cleaned_data['model'] = "%s.%s" % (self._model._meta.app_label,
                                            self._model._meta.object_name)
+        if (cleaned_data.get('snapshot_enabled') and
+                not supports_snapshot(self._model)):
+            self.add_error('snapshot_enabled', _(
+                'Only models with integer primary keys can be '
+                'snapshotted.'))
+        if explain_enabled():
+            self.check_cost()
         return cleaned_data
 
+    def check_cost(self):
+        """
+        Estimate the cost of the filter with the database's query planner,
+        refusing or warning about it above the configured thresholds.
+        """
+        estimate = estimate_query(
+            self._model._default_manager.all(), self.generate_query(),
+            mode=get_query_mode(self._model_admin))
+        logger.debug('AdvancedFilterForm: estimated cost %s', estimate)
+        result = check_estimate(estimate)
+        if result is None:
+            return
+        level, message = result
+        if level == 'error':
+            raise forms.ValidationError(message)
+        self.warnings.append(message)
+
     @property
     def _non_deleted_forms(self):
         forms = []
@@ -362,26 +436,37 @@ class AdvancedFilterForm(CleanWhiteSpacesMixin, forms.ModelForm):
             query = reduce(operator.or_, ORed)
         return query
 
+    @staticmethod
+    def parse_form_rows(instance, model):
+        """ Parse the stored query of <instance> into form initial data """
+        return [AdvancedFilterQueryForm._parse_query_dict(field_data, model)
+                for field_data in instance.list_fields()]
+
     def initialize_form(self, instance, model, data=None, extra=None):
         """ Takes a "finalized" query and generate it's form data """
         model_fields = self.get_fields_from_model(model, self._filter_fields)
 
         forms = []
-        if instance:
-            for field_data in instance.list_fields():
-                forms.append(
-                    AdvancedFilterQueryForm._parse_query_dict(
-                        field_data, model))
+        if instance and instance.b64_query:
+            forms = instance.get_form_rows()
+            if forms is None:
+                forms = self.parse_form_rows(instance, model)
 
         formset = AFQFormSetNoExtra if not extra else AFQFormSet
         self.fields_formset = formset(
             data=data,
             initial=forms or None,
             model_fields=model_fields,
-            readonly=self.readonly
+            readonly=self.readonly,
+            model=model
         )
 
     def save(self, commit=True):
         self.instance.query = self.generate_query()
         self.instance.model = self.cleaned_data.get('model')
+        try:
+            self.instance.set_form_rows(
+                self.parse_form_rows(self.instance, self._model))
+        except FieldDoesNotExist as e:
+            logger.warning('AdvancedFilterForm: not storing form rows - %s', e)
         return super(AdvancedFilterForm, self).save(commit)
@@ -0,0 +1,76 @@
+"""
+Filter on very long lists of values.
+
+Backends cap the number of parameters of a query (999 on older SQLite
+versions) and long ``IN (...)`` lists are slow to parse and plan. Lists
+longer than ``max_in_list_size`` are instead passed as a single parameter,
+and unnested by a subquery: ``IN (SELECT * FROM unnest(%s))``.
+"""
+import re
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models.expressions import RawSQL
+import simplejson as json
+
+SEPARATORS = re.compile(r'[,;\t\r\n]+')
+
+
+def split_values(value):
+    """
+    Split a pasted list of values on commas, semicolons, tabs and newlines,
+    dropping blanks and duplicates.
+
+    >>> split_values('a, b\\nc\\r\\n\\n b;d')
+    ['a', 'b', 'c', 'd']
+    """
+    values = (v.strip() for v in SEPARATORS.split(value or ''))
+    return list(dict.fromkeys(v for v in values if v))
+
+
+def max_in_list_size(connection):
+    """
+    Longest list of values passed as query parameters: the
+    ADVANCED_FILTERS_IN_LIST_MAX_PARAMS setting (500), within the
+    backend's limit.
+    """
+    size = getattr(settings, 'ADVANCED_FILTERS_IN_LIST_MAX_PARAMS', 500)
+    max_params = connection.features.max_query_params
+    if max_params:
+        size = min(size, max_params // 2)
+    return size
+
+
+class ValuesTable(RawSQL):
+    """A subquery selecting a list of values, as the rhs of an ``__in``"""
+    def as_sql(self, compiler, connection):
+        # RawSQL adds its own parentheses, which would turn the subquery
+        # into a scalar one within IN ((...))
+        return self.sql, self.params
+
+
+def in_list_values(connection, field, values):
+    """
+    Return the right hand side of an ``__in`` lookup on ``field`` matching
+    ``values``, however many there are: a subquery unnesting them from a
+    single parameter, an array on PostgreSQL and a JSON list on SQLite.
+    Other backends get the list itself, which Django splits as needed.
+
+    Values that are not valid for the field are dropped, as they can't
+    match any of its values.
+    """
+    prepared = []
+    for value in values:
+        try:
+            value = field.to_python(value)
+        except ValidationError:
+            continue
+        prepared.append(field.get_db_prep_value(value, connection))
+    prepared = list(dict.fromkeys(prepared))
+    if connection.vendor == 'postgresql':
+        return ValuesTable('SELECT * FROM unnest(%%s::%s[])' %
+                           field.rel_db_type(connection), (prepared,))
+    if connection.vendor == 'sqlite':
+        return ValuesTable('SELECT value FROM json_each(%s)',
+                           (json.dumps(prepared, default=str),))
+    return prepared
@@ -0,0 +1,102 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+import simplejson as json
+
+from ...models import AdvancedFilter
+
+FIELDS = ('pk', 'title', 'url', 'model', 'b64_query', 'form_rows',
+          'is_public', 'snapshot_enabled', 'created_at')
+
+
+def related_names(manager_field, filter_ids, name_field):
+    """
+    Map each filter id to the natural keys (username or group name) of a
+    M2M relation, reading the through table only.
+    """
+    through = manager_field.remote_field.through
+    rows = through.objects.filter(**{
+        '%s__in' % manager_field.m2m_field_name(): filter_ids
+    }).values_list(manager_field.m2m_column_name(), '%s__%s' % (
+        manager_field.m2m_reverse_field_name(), name_field))
+    names = {}
+    for filter_id, name in rows:
+        names.setdefault(filter_id, []).append(name)
+    return names
+
+
+def export_chunks(queryset, chunk_size):
+    """
+    Yield the serializable records of all filters in ``queryset``, chunk by
+    chunk, using keyset pagination so memory use does not grow with the
+    number of filters.
+    """
+    username_field = get_user_model().USERNAME_FIELD
+    users_field = AdvancedFilter._meta.get_field('users')
+    groups_field = AdvancedFilter._meta.get_field('groups')
+    last_pk = None
+    while True:
+        chunk = queryset.order_by('pk')
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        chunk = list(chunk.values(
+            *FIELDS, created_by_name=F('created_by__%s' % username_field)
+        )[:chunk_size])
+        if not chunk:
+            return
+        ids = [record['pk'] for record in chunk]
+        last_pk = ids[-1]
+        users = related_names(users_field, ids, username_field)
+        groups = related_names(groups_field, ids, 'name')
+        records = []
+        for record in chunk:
+            pk = record.pop('pk')
+            created_at = record['created_at']
+            record.update(
+                created_by=record.pop('created_by_name'),
+                created_at=created_at and created_at.isoformat(),
+                users=users.get(pk, []),
+                groups=groups.get(pk, []))
+            records.append(record)
+        yield records
+
+
+class Command(BaseCommand):
+    help = ('Export saved advanced filters as JSON Lines (one filter per '
+            'line). Users and groups are exported by username and name.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-o', '--output', default='-',
+            help='File to write to, defaults to stdout.')
+        parser.add_argument(
+            '--model', help='Only export filters for this "app.Model".')
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help='Number of filters fetched per query.')
+
+    def handle(self, *args, **options):
+        queryset = AdvancedFilter.objects.all()
+        if options['model']:
+            queryset = queryset.filter(model=options['model'])
+
+        if options['output'] == '-':
+            out = None
+            write = self.stdout.write  # appends the line ending itself
+        else:
+            out = open(options['output'], 'w', encoding='utf-8')
+
+            def write(line):
+                out.write(line + '\n')
+        count = 0
+        try:
+            for records in export_chunks(queryset, options['chunk_size']):
+                for record in records:
+                    write(json.dumps(record, sort_keys=True))
+                count += len(records)
+        finally:
+            if out is not None:
+                out.close()
+        if options['verbosity'] > 0:
+            self.stderr.write('Exported %d advanced filters' % count)
@@ -0,0 +1,119 @@
+from itertools import islice
+import sys
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+
+import simplejson as json
+
+from ...models import AdvancedFilter
+
+
+def read_chunks(lines, chunk_size):
+    """Lazily parse JSON Lines into lists of at most chunk_size records"""
+    records = (json.loads(line) for line in lines if line.strip())
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = ('Import advanced filters from a JSON Lines file created with '
+            'export_advanced_filters. Users and groups are matched by '
+            'username and name; filters whose creator does not exist are '
+            'skipped. Note created_at is set to the time of import.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'input', help='File to read from, use "-" for stdin.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Number of filters inserted per transaction.')
+
+    def handle(self, *args, **options):
+        if options['input'] == '-':
+            stream = sys.stdin
+        else:
+            try:
+                stream = open(options['input'], encoding='utf-8')
+            except IOError as e:
+                raise CommandError(e)
+        imported = skipped = 0
+        try:
+            for chunk in read_chunks(stream, options['chunk_size']):
+                created, missing = self.import_chunk(chunk)
+                imported += created
+                skipped += missing
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        if options['verbosity'] > 0:
+            self.stderr.write('Imported %d advanced filters, skipped %d' % (
+                imported, skipped))
+
+    def import_chunk(self, records):
+        """
+        Insert a chunk of records with bulk inserts for both the filters
+        and their users/groups through tables. Returns the number of created
+        and skipped filters.
+        """
+        User = get_user_model()
+        username_field = User.USERNAME_FIELD
+        usernames = set()
+        group_names = set()
+        for record in records:
+            usernames.add(record['created_by'])
+            usernames.update(record.get('users', ()))
+            group_names.update(record.get('groups', ()))
+        user_ids = dict(User._default_manager.filter(**{
+            '%s__in' % username_field: usernames
+        }).values_list(username_field, 'pk'))
+        group_ids = dict(Group.objects.filter(
+            name__in=group_names).values_list('name', 'pk'))
+
+        filters = []
+        kept = []
+        for record in records:
+            created_by = user_ids.get(record['created_by'])
+            if created_by is None:
+                continue
+            filters.append(AdvancedFilter(
+                title=record['title'], url=record['url'],
+                model=record.get('model'), b64_query=record['b64_query'],
+                form_rows=record.get('form_rows'),
+                is_public=record.get('is_public', False),
+                snapshot_enabled=record.get('snapshot_enabled', False),
+                created_by_id=created_by))
+            kept.append(record)
+
+        features = connections[router.db_for_write(AdvancedFilter)].features
+        returns_ids = getattr(
+            features, 'can_return_rows_from_bulk_insert',
+            getattr(features, 'can_return_ids_from_bulk_insert', False))
+        with transaction.atomic():
+            if returns_ids:
+                AdvancedFilter.objects.bulk_create(filters)
+            else:
+                # ids are needed for the through tables
+                for afilter in filters:
+                    afilter.save(force_insert=True)
+            self.bulk_add(AdvancedFilter._meta.get_field('users'), filters,
+                          kept, 'users', user_ids)
+            self.bulk_add(AdvancedFilter._meta.get_field('groups'), filters,
+                          kept, 'groups', group_ids)
+        return len(filters), len(records) - len(filters)
+
+    @staticmethod
+    def bulk_add(m2m_field, filters, records, key, ids):
+        through = m2m_field.remote_field.through
+        source = m2m_field.m2m_column_name()
+        target = m2m_field.m2m_reverse_name()
+        through.objects.bulk_create([
+            through(**{source: afilter.pk, target: ids[name]})
+            for afilter, record in zip(filters, records)
+            for name in set(record.get(key, ())) if name in ids
+        ])
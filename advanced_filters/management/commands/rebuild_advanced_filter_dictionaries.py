@@ -0,0 +1,36 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from ...admin import site
+from ...dictionaries import dictionary_fields, rebuild_dictionary
+
+
+class Command(BaseCommand):
+    help = ('Recount the value dictionaries of the fields listed in the '
+            'advanced_filter_dictionary_fields of registered admins.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'model', nargs='*',
+            help='Only rebuild the dictionaries of these "app.Model".')
+
+    def handle(self, *args, **options):
+        models = []
+        for label in options['model']:
+            try:
+                models.append(apps.get_model(label))
+            except (LookupError, ValueError) as e:
+                raise CommandError(e)
+
+        rebuilt = 0
+        for model, model_admin in site._registry.items():
+            if models and model not in models:
+                continue
+            for field in dictionary_fields(model_admin):
+                count = rebuild_dictionary(field)
+                rebuilt += 1
+                if options['verbosity'] > 1:
+                    self.stdout.write('%s.%s: %d values' % (
+                        field.model._meta.label, field.name, count))
+        if options['verbosity'] > 0:
+            self.stdout.write('%d dictionaries rebuilt' % rebuilt)
@@ -0,0 +1,210 @@
+from collections import Counter
+import re
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router
+from django.db.models import BooleanField
+
+from ...compiler import LOOKUP_SEP, iter_lookups, resolve_lookup
+from ...models import AdvancedFilter, serializer
+
+# lookups a plain (b-tree) index on the column can serve, "year" is
+# compiled as a range
+PLAIN_LOOKUPS = {'exact', 'in', 'gt', 'gte', 'lt', 'lte', 'range', 'isnull',
+                 'startswith', 'year'}
+# case insensitive lookups, served by an index on UPPER(column) with pattern
+# ops on PostgreSQL (Django compares UPPER(column::text)), or on the column
+# with a case insensitive collation on SQLite
+FOLDED_LOOKUPS = {'iexact', 'istartswith'}
+# lookups with leading wildcards, served by a trigram index on PostgreSQL
+TRIGRAM_LOOKUPS = {'contains', 'icontains', 'endswith', 'iendswith',
+                   'regex', 'iregex'}
+
+UPPER_DEFINITION = re.compile(r'upper\(\(?"?(\w+)"?', re.IGNORECASE)
+NOCASE_DEFINITION = re.compile(r'\(\s*"?(\w+)"?\s+COLLATE\s+NOCASE',
+                               re.IGNORECASE)
+
+
+def split_lookup(model, key):
+    """
+    Return the model field a lookup key applies to and its lookup type
+    (i.e "iexact"), or (None, None) if the path can not be followed.
+    """
+    fields = resolve_lookup(model, key)
+    if not fields:
+        return None, None
+    field = fields[-1]
+    if field.is_relation and not (field.many_to_one or field.one_to_one):
+        return None, None
+    rest = key.split(LOOKUP_SEP)[len(fields):]
+    return field, rest[0] if rest else 'exact'
+
+
+def tally_lookups(queryset, chunk_size=500):
+    """
+    Count how many times each (field, lookup type) is used by the filters in
+    queryset, weighted by the number of times each filter was applied.
+    Filters are read in chunks of primary keys, loading only the columns
+    needed to decode them.
+    """
+    tally = Counter()
+    last_pk = None
+    while True:
+        chunk = queryset.order_by('pk').only(
+            'pk', 'model', 'b64_query', 'usage_count')
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return tally
+        last_pk = chunk[-1].pk
+        for afilter in chunk:
+            model = afilter.get_model()
+            if model is None or not afilter.b64_query:
+                continue
+            try:
+                query = serializer.loads(afilter.b64_query)
+            except Exception:
+                continue
+            for key in iter_lookups(query):
+                field, lookup = split_lookup(model, key)
+                if field is not None:
+                    tally[field, lookup] += max(afilter.usage_count, 1)
+
+
+def existing_indexes(model):
+    """
+    Return the sets of columns of ``model`` that lead a plain index, have
+    an index serving case insensitive lookups, or have a trigram index;
+    read from the model's options and from the database.
+    """
+    opts = model._meta
+    plain, folded, trigram = set(), set(), set()
+    for field in opts.local_fields:
+        if field.primary_key or field.unique or field.db_index:
+            plain.add(field.column)
+    for fields in list(opts.unique_together) + list(opts.index_together):
+        plain.add(opts.get_field(fields[0]).column)
+    for index in opts.indexes:
+        if index.fields:
+            column = opts.get_field(index.fields[0].lstrip('-')).column
+            if 'gin_trgm_ops' in (getattr(index, 'opclasses', None) or ()):
+                trigram.add(column)
+            else:
+                plain.add(column)
+
+    connection = connections[router.db_for_read(model)]
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(
+            cursor, opts.db_table)
+        if connection.vendor == 'sqlite':
+            # the collation of indexed columns is not introspected
+            cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'index'"
+                           " AND tbl_name = %s AND sql IS NOT NULL",
+                           [opts.db_table])
+            for sql, in cursor.fetchall():
+                folded.update(NOCASE_DEFINITION.findall(sql))
+    for constraint in constraints.values():
+        columns = constraint.get('columns') or [None]
+        definition = constraint.get('definition') or ''
+        if 'gin_trgm_ops' in definition or (
+                constraint.get('type') == 'gin' and columns[0]):
+            trigram.add(columns[0])
+        elif columns[0] is None:
+            match = UPPER_DEFINITION.search(definition)
+            if match and 'pattern_ops' in definition:
+                folded.add(match.group(1))
+        elif (constraint.get('index') or constraint.get('unique') or
+              constraint.get('primary_key')):
+            plain.add(columns[0])
+    return plain, folded, trigram
+
+
+def index_name(field, suffix):
+    return ('%s_%s_%s' % (field.model._meta.model_name[:10],
+                          field.column[:12], suffix))[:30]
+
+
+def suggest_index(field, lookup, indexes, vendor):
+    """
+    Return a (python, sql) suggestion of an index serving ``lookup`` on
+    ``field``, None if it is already indexed or no index would help.
+    Expression indexes are suggested as a ``RunSQL`` migration operation.
+    """
+    if isinstance(field, BooleanField):
+        return None  # too few distinct values for an index to help
+    plain, folded, trigram = indexes
+    table = field.model._meta.db_table
+    column = field.column
+    if lookup in FOLDED_LOOKUPS and vendor not in ('postgresql', 'sqlite'):
+        lookup = 'exact'  # i.e MySQL's collations are case insensitive
+    if lookup in PLAIN_LOOKUPS and column not in plain:
+        name = index_name(field, 'idx')
+        return ("models.Index(fields=['%s'], name='%s')" % (field.name, name),
+                'CREATE INDEX %s ON %s (%s);' % (name, table, column))
+    if lookup in FOLDED_LOOKUPS and column not in folded:
+        name = index_name(field, 'ci')
+        if vendor == 'postgresql':
+            sql = 'CREATE INDEX %s ON %s (UPPER(%s) varchar_pattern_ops);' % (
+                name, table, column)
+        else:
+            sql = 'CREATE INDEX %s ON %s (%s COLLATE NOCASE);' % (
+                name, table, column)
+        return ('migrations.RunSQL("%s", "DROP INDEX %s;")' % (sql, name),
+                sql)
+    if (lookup in TRIGRAM_LOOKUPS and column not in trigram and
+            vendor == 'postgresql'):
+        name = index_name(field, 'trgm')
+        return ("GinIndex(fields=['%s'], name='%s', opclasses=["
+                "'gin_trgm_ops'])" % (field.name, name),
+                'CREATE INDEX %s ON %s USING gin (%s gin_trgm_ops);  '
+                '-- requires CREATE EXTENSION pg_trgm' % (name, table, column))
+    return None
+
+
+class Command(BaseCommand):
+    help = ('Suggest database indexes for the fields and lookups used by '
+            'saved advanced filters, most used first.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'model', nargs='?',
+            help='Only consider filters for this "app.Model".')
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Number of filters fetched per query.')
+
+    def handle(self, *args, **options):
+        queryset = AdvancedFilter.objects.all()
+        if options['model']:
+            try:
+                apps.get_model(options['model'])
+            except (LookupError, ValueError) as e:
+                raise CommandError(e)
+            queryset = queryset.filter(model=options['model'])
+
+        tally = tally_lookups(queryset, options['chunk_size'])
+        indexes = {}
+        suggested = set()
+        for (field, lookup), count in tally.most_common():
+            model = field.model
+            if model not in indexes:
+                indexes[model] = existing_indexes(model)
+            vendor = connections[router.db_for_read(model)].vendor
+            suggestion = suggest_index(field, lookup, indexes[model], vendor)
+            label = '%s.%s %s' % (model._meta.label, field.name, lookup)
+            if suggestion in suggested:
+                continue
+            if suggestion is None:
+                if options['verbosity'] > 1:
+                    self.stdout.write('%6d  %s: no index suggested' % (
+                        count, label))
+                continue
+            suggested.add(suggestion)
+            python, sql = suggestion
+            self.stdout.write('%6d  %s\n        %s\n        %s' % (
+                count, label, python, sql))
+        if options['verbosity'] > 0:
+            self.stderr.write('%d lookups analyzed, %d indexes suggested' % (
+                len(tally), len(suggested)))
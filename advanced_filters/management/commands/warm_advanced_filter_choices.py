@@ -0,0 +1,69 @@
+from django.apps import apps
+from django.contrib.admin.utils import NotRelationField
+from django.core.exceptions import FieldDoesNotExist
+from django.core.management.base import BaseCommand, CommandError
+
+from ...admin import site
+from ...choices import get_field_choices, get_operator_choices
+from ...timeouts import QueryTimeout
+
+
+def filter_field_names(model_admin):
+    """The field paths of a ModelAdmin's ``advanced_filter_fields``"""
+    for field in getattr(model_admin, 'advanced_filter_fields', ()):
+        yield field[0] if isinstance(field, (list, tuple)) else field
+
+
+class Command(BaseCommand):
+    help = ('Fill the cache of field and operator choices for every field '
+            'listed in the advanced_filter_fields of registered admins.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'model', nargs='*',
+            help='Only warm the fields of these "app.Model".')
+        parser.add_argument(
+            '--pages', type=int, default=1,
+            help='Number of pages of choices fetched per search.')
+        parser.add_argument(
+            '--search', action='append',
+            help='Search term to warm (repeatable), defaults to no search.')
+
+    def warm(self, model, field_name, search, pages):
+        """Fetch the pages of choices like the javascript would"""
+        after = None
+        for page in range(1, pages + 1):
+            response = get_field_choices(model, field_name, search, page,
+                                         after)
+            if not response['more']:
+                return page
+            after = str(response['results'][-1]['id'])
+        return pages
+
+    def handle(self, *args, **options):
+        models = []
+        for label in options['model']:
+            try:
+                models.append(apps.get_model(label))
+            except (LookupError, ValueError) as e:
+                raise CommandError(e)
+
+        warmed = 0
+        for model, model_admin in site._registry.items():
+            if models and model not in models:
+                continue
+            label = model._meta.label
+            for field_name in filter_field_names(model_admin):
+                try:
+                    get_operator_choices(label, field_name)
+                    for search in options['search'] or ['']:
+                        warmed += self.warm(label, field_name, search,
+                                            options['pages'])
+                except (FieldDoesNotExist, NotRelationField,
+                        QueryTimeout) as e:
+                    self.stderr.write('%s.%s: %s' % (label, field_name, e))
+                    continue
+                if options['verbosity'] > 1:
+                    self.stdout.write('Warmed %s.%s' % (label, field_name))
+        if options['verbosity'] > 0:
+            self.stdout.write('%d pages of choices cached' % warmed)
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advanced_filters', '0004_advancedfilter_is_public'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='advancedfilter',
+            name='b64_query',
+            field=models.TextField(),
+        ),
+    ]
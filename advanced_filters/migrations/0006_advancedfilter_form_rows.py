@@ -0,0 +1,290 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:40
+
+import base64
+from datetime import date, datetime, time as dtime, timedelta, timezone
+from decimal import Decimal
+import hashlib
+import struct
+import time
+from uuid import UUID
+
+from django.contrib.admin.utils import get_fields_from_path
+from django.db import migrations, models
+from django.db.models import FieldDoesNotExist
+from django.db.models.fields import DateField
+
+import simplejson as json
+
+CHUNK_SIZE = 500
+
+# A frozen copy of the decoding of stored queries and of their parsing
+# into form rows, as of this migration: it must not depend on the current
+# code of the app.
+
+OPERATORS = ('iexact', 'icontains', 'iregex', 'in', 'range', 'isnull',
+             'istrue', 'isfalse', 'lt', 'gt', 'lte', 'gte')
+FORM_ROWS_VERSION = 2
+FORM_ROW_TYPES = (
+    ('datetime', datetime, datetime.isoformat),
+    ('date', date, date.isoformat),
+    ('time', dtime, dtime.isoformat),
+    ('decimal', Decimal, str),
+    ('uuid', UUID, str),
+)
+
+PACKED_V1 = 1
+_EPOCH = datetime(1970, 1, 1)
+_double = struct.Struct('>d')
+
+
+class InvalidQuery(Exception):
+    pass
+
+
+class PackedDecoder(object):
+    """Decoder of the packed (binary) format of stored queries"""
+    def __init__(self, data):
+        if not data or data[0] != PACKED_V1:
+            raise InvalidQuery('Unsupported packed query version')
+        self.data = data
+        self.pos = 1
+        self.strings = []
+
+    def byte(self):
+        b = self.data[self.pos]
+        self.pos += 1
+        return b
+
+    def bytes(self, n):
+        if self.pos + n > len(self.data):
+            raise InvalidQuery('payload truncated')
+        raw = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return raw
+
+    def uint(self):
+        n = shift = 0
+        while True:
+            b = self.byte()
+            n |= (b & 0x7f) << shift
+            if b < 0x80:
+                return n
+            shift += 7
+
+    def int(self):
+        n = self.uint()
+        return n >> 1 if not n & 1 else -(n >> 1) - 1
+
+    def tz(self):
+        if self.byte() & 1:
+            return timezone(timedelta(seconds=self.int()))
+        return None
+
+    def node_header(self):
+        flags = self.byte()
+        node = {'children': [], 'connector': 'OR' if flags & 2 else 'AND',
+                'negated': bool(flags & 1)}
+        return [node, self.uint()]
+
+    def node(self):
+        root = self.node_header()
+        stack = [root]
+        while stack:
+            frame = stack[-1]
+            if not frame[1]:
+                stack.pop()
+                continue
+            frame[1] -= 1
+            children = frame[0]['children']
+            tag = self.data[self.pos]
+            if tag == 14:  # leaf
+                self.pos += 1
+                children.append([self.value(), self.value()])
+            elif tag == 13:  # node
+                self.pos += 1
+                child = self.node_header()
+                children.append(child[0])
+                stack.append(child)
+            else:
+                children.append(self.value())
+        return root[0]
+
+    def value(self):
+        tag = self.byte()
+        if tag in (0, 1, 2):
+            return (None, True, False)[tag]
+        elif tag == 3:
+            return self.int()
+        elif tag == 4:
+            return _double.unpack(self.bytes(8))[0]
+        elif tag == 5:
+            s = self.bytes(self.uint()).decode('utf-8')
+            self.strings.append(s)
+            return s
+        elif tag == 6:
+            return self.strings[self.uint()]
+        elif tag == 7:
+            return [self.value() for _ in range(self.uint())]
+        elif tag == 8:
+            tz = self.tz()
+            value = _EPOCH + timedelta(microseconds=self.int())
+            return value.replace(tzinfo=tz) if tz else value
+        elif tag == 9:
+            return date.fromordinal(self.uint())
+        elif tag == 10:
+            tz = self.tz()
+            seconds, micros = divmod(self.uint(), 1000000)
+            minutes, seconds = divmod(seconds, 60)
+            hours, minutes = divmod(minutes, 60)
+            return dtime(hours, minutes, seconds, micros, tzinfo=tz)
+        elif tag == 11:
+            return Decimal(self.bytes(self.uint()).decode('ascii'))
+        elif tag == 12:
+            return UUID(bytes=self.bytes(16))
+        elif tag == 13:
+            return self.node()
+        raise InvalidQuery('Unknown packed type tag %d' % tag)
+
+
+def decode_query(b64_query):
+    data = base64.b64decode(b64_query)
+    if data[:1] == b'{':
+        return json.loads(data.decode('utf-8'))
+    try:
+        return PackedDecoder(data).value()
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise InvalidQuery(e)
+
+
+def timestamp(value):
+    return time.mktime(value.timetuple()) if isinstance(value, date) else value
+
+
+def is_range(leaf):
+    return leaf[0].endswith('__range') and len(leaf[1]) == 2
+
+
+def field_values_list(d):
+    fields = []
+    stack = [(d, 0)]
+    while stack:
+        node, index = stack.pop()
+        children = node.get('children', [])
+        if index >= len(children):
+            continue
+        if index and node['connector'] == 'OR':
+            fields.append({'field': '_OR', 'value': 'null'})
+        stack.append((node, index + 1))
+        child = children[index]
+        if isinstance(child, dict):
+            stack.append((child, 0))
+        else:
+            f = {'field': child[0], 'value': child[1]}
+            if is_range(child):
+                f['value_from'] = timestamp(child[1][0])
+                f['value_to'] = timestamp(child[1][1])
+            f['negate'] = node.get('negated', False)
+            fields.append(f)
+    return fields
+
+
+def date_to_string(value):
+    if value:
+        return datetime.fromtimestamp(value).strftime('%Y-%m-%d')
+    return ''
+
+
+def parse_query_dict(query_data, model):
+    operator = 'iexact'
+    if query_data['field'] == '_OR':
+        query_data['operator'] = operator
+        return query_data
+
+    parts = query_data['field'].split('__')
+    if len(parts) < 2:
+        field = parts[0]
+    elif parts[-1] in OPERATORS:
+        field = '__'.join(parts[:-1])
+        operator = parts[-1]
+    else:
+        field = query_data['field']
+    query_data['field'] = field
+    mfield = get_fields_from_path(model, field)[-1]
+
+    if operator == 'isnull' or query_data['value'] is None:
+        query_data['operator'] = 'isnull'
+    elif query_data['value'] is True:
+        query_data['operator'] = 'istrue'
+    elif query_data['value'] is False:
+        query_data['operator'] = 'isfalse'
+    elif isinstance(mfield, DateField):
+        query_data['operator'] = 'range'
+    else:
+        query_data['operator'] = operator
+
+    if (isinstance(query_data.get('value'), list) and
+            query_data['operator'] == 'in'):
+        query_data['value'] = ', '.join(str(v) for v in query_data['value'])
+    elif (isinstance(query_data.get('value'), list) and
+            query_data['operator'] == 'range'):
+        query_data['value'] = ','.join([
+            date_to_string(query_data.get('value_from')),
+            date_to_string(query_data.get('value_to'))])
+    return query_data
+
+
+def encode_form_value(value):
+    for name, type_, encode in FORM_ROW_TYPES:
+        if isinstance(value, type_):
+            return {'__type__': name, 'value': encode(value)}
+    return str(value)
+
+
+def form_rows(b64_query, model):
+    rows = [parse_query_dict(field_data, model)
+            for field_data in field_values_list(decode_query(b64_query))]
+    digest = hashlib.blake2b(b64_query.encode('utf-8'),
+                             digest_size=16).hexdigest()
+    return json.dumps(
+        {'version': FORM_ROWS_VERSION, 'query': digest, 'rows': rows},
+        default=encode_form_value, use_decimal=False)
+
+
+def backfill_form_rows(apps, schema_editor):
+    """Store pre-parsed form rows for existing filters, in chunks"""
+    AdvancedFilter = apps.get_model('advanced_filters', 'AdvancedFilter')
+    db_alias = schema_editor.connection.alias
+    queryset = AdvancedFilter.objects.using(db_alias).filter(
+        form_rows__isnull=True).exclude(b64_query='').order_by('pk')
+    last_pk = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_pk).values_list(
+            'pk', 'model', 'b64_query')[:CHUNK_SIZE])
+        if not chunk:
+            break
+        last_pk = chunk[-1][0]
+        for pk, model, b64_query in chunk:
+            try:
+                rows = form_rows(b64_query,
+                                 apps.get_model(*model.split('.')))
+            except (AttributeError, LookupError, ValueError, TypeError,
+                    FieldDoesNotExist, InvalidQuery):
+                continue  # rows are parsed on demand when opening the form
+            AdvancedFilter.objects.using(db_alias).filter(pk=pk).update(
+                form_rows=rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advanced_filters', '0005_advancedfilter_b64_query'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='advancedfilter',
+            name='form_rows',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_form_rows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advanced_filters', '0006_advancedfilter_form_rows'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='advancedfilter',
+            name='snapshot',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='advancedfilter',
+            name='snapshot_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Snapshot taken at'),
+        ),
+        migrations.AddField(
+            model_name='advancedfilter',
+            name='snapshot_enabled',
+            field=models.BooleanField(default=False, help_text='If checked, matching records are computed once and reused until the snapshot expires or is refreshed', verbose_name='Snapshot results'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 2.2.28 on 2026-10-18 03:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advanced_filters', '0007_advancedfilter_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='advancedfilter',
+            name='last_result_size',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Last result size'),
+        ),
+        migrations.AddField(
+            model_name='advancedfilter',
+            name='last_used_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Last used at'),
+        ),
+        migrations.AddField(
+            model_name='advancedfilter',
+            name='p95_time',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='95th percentile time (s)'),
+        ),
+        migrations.AddField(
+            model_name='advancedfilter',
+            name='recent_times',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='advancedfilter',
+            name='total_time',
+            field=models.FloatField(default=0, editable=False, verbose_name='Total time (s)'),
+        ),
+        migrations.AddField(
+            model_name='advancedfilter',
+            name='usage_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Uses'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 03:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advanced_filters', '0008_advancedfilter_usage_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FieldValue',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=64)),
+                ('field', models.CharField(max_length=64)),
+                ('value', models.CharField(max_length=255)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Field value',
+                'verbose_name_plural': 'Field values',
+                'unique_together': {('model', 'field', 'value')},
+            },
+        ),
+    ]
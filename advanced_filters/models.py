@@ -1,9 +1,53 @@
+from datetime import date, datetime, time as dtime, timedelta
+from decimal import Decimal
+from uuid import UUID
+import time
+
+from django.apps import apps
 from django.conf import settings
+from django.core.serializers.base import SerializationError
 from django.db import models
 from django.db.models import Q
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
+from . import signals
+from .cache import query_cache
+from .compiler import apply_query
+from .q_optimizer import optimize_q
 from .q_serializer import QSerializer
+from .snapshots import pack_pks, supports_snapshot, unpack_pks
+
+import simplejson as json
+
+serializer = QSerializer(base64=True, packed=True)
+json_serializer = QSerializer(base64=True)
+
+# version of the form rows format, rows stored in another one are ignored
+FORM_ROWS_VERSION = 2
+# typed values of form rows, stored as {"__type__": name, "value": text}
+FORM_ROW_TYPES = (
+    ('datetime', datetime, datetime.isoformat, datetime.fromisoformat),
+    ('date', date, date.isoformat, date.fromisoformat),
+    ('time', dtime, dtime.isoformat, dtime.fromisoformat),
+    ('decimal', Decimal, str, Decimal),
+    ('uuid', UUID, str, UUID),
+)
+
+
+def _encode_form_value(value):
+    for name, type_, encode, _decode in FORM_ROW_TYPES:
+        if isinstance(value, type_):
+            return {'__type__': name, 'value': encode(value)}
+    return str(value)
+
+
+def _decode_form_value(obj):
+    if set(obj) == {'__type__', 'value'}:
+        for name, _type, _encode, decode in FORM_ROW_TYPES:
+            if obj['__type__'] == name:
+                return decode(obj['value'])
+    return obj
 
 
 class UserLookupManager(models.Manager):
@@ -37,8 +81,33 @@ class AdvancedFilter(models.Model):
 
     objects = UserLookupManager()
 
-    b64_query = models.CharField(max_length=2048)
+    b64_query = models.TextField()
     model = models.CharField(max_length=64, blank=True, null=True)
+    form_rows = models.TextField(blank=True, null=True, editable=False)
+
+    snapshot_enabled = models.BooleanField(
+        default=False, verbose_name=_('Snapshot results'),
+        help_text=_('If checked, matching records are computed once and '
+                    'reused until the snapshot expires or is refreshed'))
+    snapshot = models.BinaryField(blank=True, null=True, editable=False)
+    snapshot_at = models.DateTimeField(
+        blank=True, null=True, editable=False,
+        verbose_name=_('Snapshot taken at'))
+
+    # usage statistics, see advanced_filters.stats
+    usage_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name=_('Uses'))
+    last_used_at = models.DateTimeField(
+        blank=True, null=True, editable=False, verbose_name=_('Last used at'))
+    total_time = models.FloatField(
+        default=0, editable=False, verbose_name=_('Total time (s)'))
+    p95_time = models.FloatField(
+        blank=True, null=True, editable=False,
+        verbose_name=_('95th percentile time (s)'))
+    last_result_size = models.PositiveIntegerField(
+        blank=True, null=True, editable=False,
+        verbose_name=_('Last result size'))
+    recent_times = models.TextField(blank=True, null=True, editable=False)
 
     def __str__(self):
         return f'{self.title} - {self.created_by}'
@@ -47,11 +116,34 @@ class AdvancedFilter(models.Model):
     def query(self):
         """
         De-serialize, decode and return an ORM query stored in b64_query.
+
+        Decoded queries are optimized (see ``optimize_q``) and kept in a
+        process-wide LRU cache (see ``advanced_filters.cache.QueryCache``),
+        each access returns a copy.
         """
         if not self.b64_query:
             return None
-        s = QSerializer(base64=True)
-        return s.loads(self.b64_query)
+        return query_cache.get(self.b64_query, self._load_query,
+                               namespace=self.model)
+
+    def _load_query(self, b64_query):
+        started = time.perf_counter()
+        if signals.query_decode_started.has_listeners(AdvancedFilter):
+            signals.query_decode_started.send(
+                sender=AdvancedFilter, filter_id=self.pk, model=self.model,
+                started=started)
+        query = serializer.loads(b64_query)
+        query = optimize_q(query, merge_in=True, model=self.get_model())
+        signals.send_timed(signals.query_decoded, AdvancedFilter, started,
+                           filter_id=self.pk, model=self.model, query=query)
+        return query
+
+    def get_model(self):
+        """The model class this filter applies to, None if unavailable"""
+        try:
+            return apps.get_model(*self.model.split('.'))
+        except (AttributeError, LookupError, TypeError, ValueError):
+            return None
 
     @query.setter
     def query(self, value):
@@ -61,10 +153,99 @@ class AdvancedFilter(models.Model):
         """
         if not isinstance(value, Q):
             raise Exception('Must only be passed a Django (Q)uery object')
-        s = QSerializer(base64=True)
-        self.b64_query = s.dumps(value)
+        # the query is stored as entered, so that it maps back to the rows
+        # of the filter form; it is only optimized when loaded
+        try:
+            self.b64_query = serializer.dumps(value)
+        except SerializationError:
+            # values the packed format can't hold are stored as JSON
+            self.b64_query = json_serializer.dumps(value)
+        self.form_rows = None
+        self.snapshot = self.snapshot_at = None
+
+    def _query_digest(self):
+        return query_cache.make_key(self.b64_query).hex()
+
+    def get_form_rows(self):
+        """
+        Return the pre-parsed form rows stored alongside the query, or None
+        if there are none or they were stored for a different query.
+        """
+        if not self.form_rows or not self.b64_query:
+            return None
+        stored = json.loads(self.form_rows, object_hook=_decode_form_value)
+        if (stored.get('version') != FORM_ROWS_VERSION or
+                stored.get('query') != self._query_digest()):
+            return None
+        return stored['rows']
+
+    def set_form_rows(self, rows):
+        """
+        Store the form rows (field, operator, value, negate and _OR
+        separators) parsed from the current query. Date, time, Decimal and
+        UUID values keep their type, so the rows read back are the same as
+        the ones parsed from the query.
+        """
+        self.form_rows = json.dumps(
+            {'version': FORM_ROWS_VERSION, 'query': self._query_digest(),
+             'rows': rows},
+            default=_encode_form_value, use_decimal=False)
 
     def list_fields(self):
-        s = QSerializer(base64=True)
-        d = s.loads(self.b64_query, raw=True)
-        return s.get_field_values_list(d)
+        d = serializer.loads(self.b64_query, raw=True)
+        return serializer.get_field_values_list(d)
+
+    def get_snapshot(self):
+        """
+        Return the primary keys stored by the last ``refresh_snapshot``, or
+        None if snapshots are disabled, or the snapshot is missing or older
+        than ADVANCED_FILTERS_SNAPSHOT_MAX_AGE seconds.
+        """
+        if not self.snapshot_enabled:
+            return None
+        max_age = getattr(settings, 'ADVANCED_FILTERS_SNAPSHOT_MAX_AGE', 3600)
+        if (self.snapshot_at is None or
+                self.snapshot_at + timedelta(seconds=max_age) < timezone.now()):
+            return None
+        # checked last, it may be deferred
+        if not self.snapshot:
+            return None
+        return unpack_pks(self.snapshot)
+
+    def refresh_snapshot(self, mode=None):
+        """
+        Run the query and store the primary keys of the matching records.
+        Returns them, or None if the model is unavailable or its primary
+        keys are not integers.
+        """
+        model = self.get_model()
+        if model is None or not supports_snapshot(model):
+            return None
+        queryset = apply_query(model._default_manager.all(), self.query,
+                               mode=mode)
+        pks = list(queryset.values_list('pk', flat=True))
+        self.snapshot = pack_pks(pks)
+        self.snapshot_at = timezone.now()
+        if self.pk:
+            self.save(update_fields=['snapshot', 'snapshot_at'])
+        return sorted(pks)
+
+
+class FieldValue(models.Model):
+    """
+    A distinct value of a model field and the number of rows holding it,
+    for the fields with a value dictionary (see
+    ``advanced_filters.dictionaries``).
+    """
+    class Meta:
+        verbose_name = 'Field value'
+        verbose_name_plural = 'Field values'
+        unique_together = ('model', 'field', 'value')
+
+    model = models.CharField(max_length=64)
+    field = models.CharField(max_length=64)
+    value = models.CharField(max_length=255)
+    count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.model}.{self.field}: {self.value} ({self.count})'
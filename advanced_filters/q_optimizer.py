@@ -0,0 +1,159 @@
+"""
+Simplify Q trees before they are stored or executed.
+
+Queries built from the advanced filter form are reduced from many small
+Q objects and end up with empty nodes, single child wrappers and repeated
+predicates, all of which Django turns into redundant SQL. ``optimize_q``
+returns an equivalent, flatter tree.
+"""
+from django.contrib.admin.utils import NotRelationField, get_fields_from_path
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Field, Q
+
+LOOKUP_SEP = '__'
+
+
+def _freeze(value):
+    # values are compared along with their type, 1 == True == 1.0 would
+    # otherwise make different predicates look the same
+    if isinstance(value, (list, tuple)):
+        return (list, tuple(_freeze(v) for v in value))
+    return (type(value), value)
+
+
+def _signature(child, signatures):
+    """A hashable signature of a leaf or of an already optimized node"""
+    if isinstance(child, Q):
+        return signatures.get(id(child))
+    try:
+        signature = ('leaf', child[0], _freeze(child[1]))
+        hash(signature)
+    except TypeError:
+        return None
+    return signature
+
+
+def _equality_base(key, model):
+    """
+    Return the field path an equality lookup applies to, or None if
+    ``key`` is not an equality lookup that can be merged into ``__in``.
+    A lookup without an explicit suffix is only considered to be an exact
+    match when ``model`` is given and the path resolves to a field.
+    """
+    base, _, lookup = key.rpartition(LOOKUP_SEP)
+    if lookup in ('exact', 'in') and base:
+        return base
+    if model is None or lookup in Field.get_lookups():
+        return None
+    try:
+        get_fields_from_path(model, key)
+    except (FieldDoesNotExist, NotRelationField, AttributeError, TypeError):
+        return None
+    return key
+
+
+def _equality_values(child):
+    """The values an equality (or __in) leaf matches, if it can be merged"""
+    value = child[1]
+    values = value if child[0].endswith('__in') else [value]
+    if not isinstance(values, (list, tuple)):
+        return None
+    for v in values:
+        if v is None or isinstance(v, bool):
+            return None
+        try:
+            hash(v)
+        except TypeError:
+            return None
+    return list(values)
+
+
+def _merge_in(children, model):
+    """Merge OR'd equality leaves on the same field into single __in leaves"""
+    merged = []
+    groups = {}
+    for child in children:
+        if not isinstance(child, Q):
+            base = _equality_base(child[0], model)
+            values = _equality_values(child)
+            if base is not None and values is not None:
+                index = groups.get(base)
+                if index is None:
+                    groups[base] = len(merged)
+                    merged.append(child)
+                else:
+                    values = _equality_values(merged[index]) + values
+                    unique = list({(type(v), v): v
+                                   for v in values}.values())
+                    merged[index] = type(child)(('%s__in' % base, unique))
+                continue
+        merged.append(child)
+    return merged
+
+
+def optimize_q(q, merge_in=False, model=None):
+    """
+    Return an optimized copy of the Q object ``q`` (which is not modified):
+
+    - child nodes that share their parent's connector, and wrappers with a
+      single child, are flattened into their parent (unless negated);
+    - empty nodes are dropped, just like Django ignores them;
+    - duplicate predicates and sub-trees are removed;
+    - with ``merge_in=True``, equality predicates OR'd on the same field
+      are merged into a single ``__in`` predicate. Pass ``model`` to also
+      recognize lookups without an explicit ``__exact`` suffix.
+
+    The tree is processed bottom-up with an explicit stack, so deeply
+    nested trees do not hit the recursion limit.
+    """
+    signatures = {}
+    results = {}
+    stack = [(q, False)]
+    while stack:
+        node, visited = stack.pop()
+        if not visited:
+            stack.append((node, True))
+            stack.extend((child, False) for child in node.children
+                         if isinstance(child, Q))
+            continue
+
+        children = []
+        for child in node.children:
+            if isinstance(child, Q):
+                child = results[id(child)]
+                if not child.children:
+                    continue
+                if not child.negated and (child.connector == node.connector or
+                                          len(child.children) == 1):
+                    children.extend(child.children)
+                    continue
+            children.append(child)
+
+        if merge_in and node.connector == Q.OR and len(children) > 1:
+            children = _merge_in(children, model)
+
+        unique = []
+        seen = set()
+        for child in children:
+            signature = _signature(child, signatures)
+            if signature is not None:
+                if signature in seen:
+                    continue
+                seen.add(signature)
+            unique.append(child)
+
+        new = type(node)()
+        new.connector = node.connector
+        new.negated = node.negated
+        new.children = unique
+        child_signatures = [_signature(c, signatures) for c in unique]
+        if None not in child_signatures:
+            signatures[id(new)] = ('node', new.connector, new.negated,
+                                   frozenset(child_signatures))
+        results[id(node)] = new
+
+    root = results[id(q)]
+    while (not root.negated and len(root.children) == 1 and
+           isinstance(root.children[0], Q)):
+        root = root.children[0]
+    return root
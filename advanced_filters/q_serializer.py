@@ -1,6 +1,10 @@
 """This is a module to serializers/deserializes Django Q (query) object."""
-from datetime import datetime, date
+from datetime import datetime, date, time as dtime, timedelta, timezone
+from decimal import Decimal
+from uuid import UUID
+from concurrent.futures import ProcessPoolExecutor
 import base64
+import struct
 import time
 
 from django.utils import six
@@ -25,6 +29,301 @@ def dt2ts(obj):
     return time.mktime(obj.timetuple()) if isinstance(obj, date) else obj
 
 
+# Packed (binary) format
+# ----------------------
+# A packed payload starts with a single header byte holding the format
+# version, followed by one type-tagged value (the root node).  Legacy
+# payloads are JSON documents, which always start with "{", so both can
+# be told apart by looking at the first byte only.
+PACKED_V1 = 1
+LEGACY_JSON_HEADER = b'{'
+
+_T_NONE = 0
+_T_TRUE = 1
+_T_FALSE = 2
+_T_INT = 3
+_T_FLOAT = 4
+_T_STR = 5
+_T_STRREF = 6
+_T_LIST = 7
+_T_DATETIME = 8
+_T_DATE = 9
+_T_TIME = 10
+_T_DECIMAL = 11
+_T_UUID = 12
+_T_NODE = 13
+_T_LEAF = 14
+_T_DICT = 15
+
+_F_NEGATED = 1
+_F_OR = 2
+_F_AWARE = 1
+
+_EPOCH = datetime(1970, 1, 1)
+_double = struct.Struct('>d')
+
+
+def _micros(delta):
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+class PackedEncoder(object):
+    """
+    Encode a serialized Q dict (see ``QSerializer.serialize``) into the
+    compact packed format.
+
+    Strings are interned: the first occurrence is written inline and
+    following ones refer to it by index, which keeps repeated field
+    names and lookups cheap.
+    """
+    def __init__(self):
+        self.buf = bytearray()
+        self.strings = {}
+
+    def encode(self, d):
+        self.buf = bytearray((PACKED_V1,))
+        self.strings = {}
+        self._node(d)
+        return bytes(self.buf)
+
+    def _uint(self, n):
+        buf = self.buf
+        while n > 0x7f:
+            buf.append((n & 0x7f) | 0x80)
+            n >>= 7
+        buf.append(n)
+
+    def _int(self, n):
+        # zigzag, so small negative numbers stay small
+        self._uint(n * 2 if n >= 0 else -n * 2 - 1)
+
+    def _str(self, s):
+        index = self.strings.get(s)
+        if index is not None:
+            self.buf.append(_T_STRREF)
+            self._uint(index)
+            return
+        self.strings[s] = len(self.strings)
+        raw = s.encode('utf-8')
+        self.buf.append(_T_STR)
+        self._uint(len(raw))
+        self.buf += raw
+
+    def _tz(self, obj):
+        offset = obj.utcoffset()
+        if offset is None:
+            self.buf.append(0)
+        else:
+            self.buf.append(_F_AWARE)
+            self._int(offset.days * 86400 + offset.seconds)
+
+    def _node_header(self, d):
+        self.buf.append(_T_NODE)
+        self.buf.append((_F_NEGATED if d.get('negated') else 0) |
+                        (_F_OR if d.get('connector') == 'OR' else 0))
+        self._uint(len(d['children']))
+
+    def _node(self, root):
+        # depth-first, with an explicit stack of children iterators
+        stack = [iter((root,))]
+        while stack:
+            for child in stack[-1]:
+                if isinstance(child, dict):
+                    self._node_header(child)
+                    stack.append(iter(child['children']))
+                    break
+                self.buf.append(_T_LEAF)
+                self._str(child[0])
+                self._value(child[1])
+            else:
+                stack.pop()
+
+    def _value(self, obj):
+        buf = self.buf
+        if obj is None:
+            buf.append(_T_NONE)
+        elif obj is True:
+            buf.append(_T_TRUE)
+        elif obj is False:
+            buf.append(_T_FALSE)
+        elif isinstance(obj, int):
+            buf.append(_T_INT)
+            self._int(obj)
+        elif isinstance(obj, float):
+            buf.append(_T_FLOAT)
+            buf += _double.pack(obj)
+        elif isinstance(obj, str):
+            self._str(obj)
+        elif isinstance(obj, dict):
+            # a mapping value of a leaf, i.e. for a JSONField lookup
+            buf.append(_T_DICT)
+            self._uint(len(obj))
+            for key, item in obj.items():
+                if not isinstance(key, str):
+                    raise SerializationError(
+                        'Cannot pack mapping key of type %s' %
+                        type(key).__name__)
+                self._str(key)
+                self._value(item)
+        elif isinstance(obj, (list, tuple)):
+            buf.append(_T_LIST)
+            self._uint(len(obj))
+            for item in obj:
+                self._value(item)
+        elif isinstance(obj, datetime):
+            buf.append(_T_DATETIME)
+            self._tz(obj)
+            self._int(_micros(obj.replace(tzinfo=None) - _EPOCH))
+        elif isinstance(obj, date):
+            buf.append(_T_DATE)
+            self._uint(obj.toordinal())
+        elif isinstance(obj, dtime):
+            buf.append(_T_TIME)
+            self._tz(obj)
+            self._uint(((obj.hour * 60 + obj.minute) * 60 + obj.second) *
+                       1000000 + obj.microsecond)
+        elif isinstance(obj, Decimal):
+            raw = str(obj).encode('ascii')
+            buf.append(_T_DECIMAL)
+            self._uint(len(raw))
+            buf += raw
+        elif isinstance(obj, UUID):
+            buf.append(_T_UUID)
+            buf += obj.bytes
+        else:
+            raise SerializationError(
+                'Cannot pack value of type %s' % type(obj).__name__)
+
+
+class PackedDecoder(object):
+    """
+    Decode a packed payload back into the same (possibly nested) dict
+    structure that ``json.loads`` returns for the legacy format.
+    """
+    def __init__(self):
+        self.data = b''
+        self.pos = 0
+        self.strings = []
+
+    def decode(self, data):
+        data = bytes(data)
+        if not data or data[0] != PACKED_V1:
+            raise SerializationError('Unsupported packed query version')
+        self.data = data
+        self.pos = 1
+        self.strings = []
+        try:
+            return self._value()
+        except (IndexError, struct.error, UnicodeDecodeError) as e:
+            raise SerializationError('Corrupt packed query: %s' % e)
+
+    def _byte(self):
+        b = self.data[self.pos]
+        self.pos += 1
+        return b
+
+    def _bytes(self, n):
+        if self.pos + n > len(self.data):
+            raise IndexError('payload truncated')
+        raw = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return raw
+
+    def _uint(self):
+        n = shift = 0
+        while True:
+            b = self._byte()
+            n |= (b & 0x7f) << shift
+            if b < 0x80:
+                return n
+            shift += 7
+
+    def _int(self):
+        n = self._uint()
+        return n >> 1 if not n & 1 else -(n >> 1) - 1
+
+    def _tz(self):
+        if self._byte() & _F_AWARE:
+            return timezone(timedelta(seconds=self._int()))
+        return None
+
+    def _node_header(self):
+        flags = self._byte()
+        node = {
+            'children': [],
+            'connector': 'OR' if flags & _F_OR else 'AND',
+            'negated': bool(flags & _F_NEGATED),
+        }
+        return [node, self._uint()]
+
+    def _node(self):
+        # each frame holds a node and the number of children left to read
+        root = self._node_header()
+        stack = [root]
+        while stack:
+            frame = stack[-1]
+            if not frame[1]:
+                stack.pop()
+                continue
+            frame[1] -= 1
+            children = frame[0]['children']
+            tag = self.data[self.pos]
+            if tag == _T_LEAF:
+                self.pos += 1
+                children.append([self._value(), self._value()])
+            elif tag == _T_NODE:
+                self.pos += 1
+                child = self._node_header()
+                children.append(child[0])
+                stack.append(child)
+            else:
+                children.append(self._value())
+        return root[0]
+
+    def _value(self):
+        tag = self._byte()
+        if tag == _T_NONE:
+            return None
+        elif tag == _T_TRUE:
+            return True
+        elif tag == _T_FALSE:
+            return False
+        elif tag == _T_INT:
+            return self._int()
+        elif tag == _T_FLOAT:
+            return _double.unpack(self._bytes(8))[0]
+        elif tag == _T_STR:
+            s = self._bytes(self._uint()).decode('utf-8')
+            self.strings.append(s)
+            return s
+        elif tag == _T_STRREF:
+            return self.strings[self._uint()]
+        elif tag == _T_NODE:
+            return self._node()
+        elif tag == _T_LIST:
+            return [self._value() for _ in range(self._uint())]
+        elif tag == _T_DICT:
+            return dict((self._value(), self._value())
+                        for _ in range(self._uint()))
+        elif tag == _T_DATETIME:
+            tz = self._tz()
+            value = _EPOCH + timedelta(microseconds=self._int())
+            return value.replace(tzinfo=tz) if tz else value
+        elif tag == _T_DATE:
+            return date.fromordinal(self._uint())
+        elif tag == _T_TIME:
+            tz = self._tz()
+            seconds, micros = divmod(self._uint(), 1000000)
+            minutes, seconds = divmod(seconds, 60)
+            hours, minutes = divmod(minutes, 60)
+            return dtime(hours, minutes, seconds, micros, tzinfo=tz)
+        elif tag == _T_DECIMAL:
+            return Decimal(self._bytes(self._uint()).decode('ascii'))
+        elif tag == _T_UUID:
+            return UUID(bytes=self._bytes(16))
+        raise SerializationError('Unknown packed type tag %d' % tag)
+
+
 class QSerializer(object):
     """
     A Q object serializer base class. Pass base64=True when initializing
@@ -33,56 +332,88 @@ class QSerializer(object):
     By default the class provides loads/dumps methods that wrap around
     json serialization, but they may be easily overwritten to serialize
     into other formats (i.e XML, YAML, etc...)
+
+    Pass packed=True to dump into the compact, versioned binary format
+    instead (see ``PackedEncoder``), which keeps date, Decimal and UUID
+    values typed. ``loads`` detects the format from the header byte, so
+    payloads in either format can always be loaded.
     """
     b64_enabled = False
+    packed = False
 
-    def __init__(self, base64=False):
+    def __init__(self, base64=False, packed=False):
         if base64:
             self.b64_enabled = True
+        if packed:
+            self.packed = True
 
     @staticmethod
     def _is_range(qtuple):
         return qtuple[0].endswith("__range") and len(qtuple[1]) == 2
 
+    @staticmethod
+    def _to_datetime(value, default):
+        if isinstance(value, date):
+            return value  # packed payloads keep their types
+        return datetime.fromtimestamp(value or default)
+
     def prepare_value(self, qtuple):
         if self._is_range(qtuple):
-            qtuple[1][0] = qtuple[1][0] or min_ts
-            qtuple[1][1] = qtuple[1][1] or max_ts
-            qtuple[1] = (datetime.fromtimestamp(qtuple[1][0]),
-                         datetime.fromtimestamp(qtuple[1][1]))
+            return [qtuple[0], (self._to_datetime(qtuple[1][0], min_ts),
+                                self._to_datetime(qtuple[1][1], max_ts))]
         return qtuple
 
     def serialize(self, q):
         """
         Serialize a Q object into a (possibly nested) dict.
+
+        The tree is walked with an explicit stack, so the nesting depth is
+        not bound by the recursion limit; the passed Q object is not
+        modified and leaf tuples are shared, not copied.
         """
-        children = []
-        for child in q.children:
-            if isinstance(child, Q):
-                children.append(self.serialize(child))
-            else:
-                children.append(child)
-        serialized = q.__dict__
-        serialized['children'] = children
-        return serialized
+        root = {'children': [], 'connector': q.connector,
+                'negated': q.negated}
+        stack = [(q, root)]
+        while stack:
+            node, serialized = stack.pop()
+            children = serialized['children']
+            for child in node.children:
+                if isinstance(child, Q):
+                    d = {'children': [], 'connector': child.connector,
+                         'negated': child.negated}
+                    children.append(d)
+                    stack.append((child, d))
+                else:
+                    children.append(child)
+        return root
 
     def deserialize(self, d):
         """
         De-serialize a Q object from a (possibly nested) dict.
+
+        The passed dict is left untouched, so raw dicts may be reused.
         """
-        children = []
-        for child in d.pop('children'):
-            if isinstance(child, dict):
-                children.append(self.deserialize(child))
-            else:
-                children.append(self.prepare_value(child))
-        query = Q()
-        query.children = children
-        query.connector = d['connector']
-        query.negated = d['negated']
-        if 'subtree_parents' in d:
-            query.subtree_parents = d['subtree_parents']
-        return query
+        def make_node(d):
+            query = Q()
+            query.connector = d['connector']
+            query.negated = d['negated']
+            if 'subtree_parents' in d:
+                query.subtree_parents = d['subtree_parents']
+            return query
+
+        root = make_node(d)
+        stack = [(d, root)]
+        while stack:
+            d, query = stack.pop()
+            children = query.children
+            for child in d['children']:
+                if isinstance(child, dict):
+                    node = make_node(child)
+                    children.append(node)
+                    stack.append((child, node))
+                else:
+                    children.append(self.prepare_value(child))
+        return root
 
     def get_field_values_list(self, d):
         """
@@ -99,36 +430,117 @@ class QSerializer(object):
         OR relations are expressed as an extra "line" between queries.
         """
         fields = []
-        children = d.get('children', [])
-        for child in children:
+        # each frame holds a node and the index of its next child to visit
+        stack = [(d, 0)]
+        while stack:
+            node, index = stack.pop()
+            children = node.get('children', [])
+            if index >= len(children):
+                continue
+            # add _OR line
+            if index and node['connector'] == 'OR':
+                fields.append({'field': '_OR', 'value': 'null'})
+            stack.append((node, index + 1))
+            child = children[index]
             if isinstance(child, dict):
-                fields.extend(self.get_field_values_list(child))
+                stack.append((child, 0))
             else:
                 f = {'field': child[0], 'value': child[1]}
                 if self._is_range(child):
-                    f['value_from'] = child[1][0]
-                    f['value_to'] = child[1][1]
-                f['negate'] = d.get('negated', False)
+                    f['value_from'] = dt2ts(child[1][0])
+                    f['value_to'] = dt2ts(child[1][1])
+                f['negate'] = node.get('negated', False)
                 fields.append(f)
-
-            # add _OR line
-            if d['connector'] == 'OR' and children[-1] != child:
-                fields.append({'field': '_OR', 'value': 'null'})
         return fields
 
-    def dumps(self, obj):
+    def _dumps(self, obj, encoder):
         if not isinstance(obj, Q):
             raise SerializationError
-        string = json.dumps(self.serialize(obj), default=dt2ts)
+        if self.packed:
+            data = encoder.encode(self.serialize(obj))
+            if self.b64_enabled:
+                return base64.b64encode(data).decode("ascii")
+            return data
+        string = encoder.encode(self.serialize(obj))
         if self.b64_enabled:
             return base64.b64encode(six.b(string)).decode("utf-8")
         return string
 
-    def loads(self, string, raw=False):
-        if self.b64_enabled:
-            d = json.loads(base64.b64decode(string))
+    def _loads(self, string, raw, decoder):
+        data = base64.b64decode(string) if self.b64_enabled else string
+        if (isinstance(data, (bytes, bytearray)) and
+                data[:1] != LEGACY_JSON_HEADER):
+            d = decoder.decode(data)
         else:
-            d = json.loads(string)
+            d = _json_decoder.decode(
+                data.decode('utf-8') if isinstance(data, (bytes, bytearray))
+                else data)
         if raw:
             return d
         return self.deserialize(d)
+
+    def _encoder(self):
+        return PackedEncoder() if self.packed else _json_encoder
+
+    def dumps(self, obj):
+        return self._dumps(obj, self._encoder())
+
+    def loads(self, string, raw=False):
+        return self._loads(string, raw, PackedDecoder())
+
+    def dumps_many(self, objs, processes=None, chunksize=500):
+        """
+        Serialize a sequence of Q objects in one pass, reusing the encoder
+        state, and return a list of the serialized strings.
+
+        Pass ``processes`` (a number of worker processes, or 0 to use all
+        CPUs) to spread batches larger than ``chunksize`` over a process
+        pool.
+        """
+        objs = list(objs)
+        if processes is not None and len(objs) > chunksize:
+            return self._map_chunks(_dumps_chunk, objs, processes, chunksize)
+        encoder = self._encoder()
+        return [self._dumps(obj, encoder) for obj in objs]
+
+    def loads_many(self, strings, raw=False, processes=None, chunksize=500):
+        """
+        De-serialize a sequence of strings in one pass, reusing the decoder
+        state, and return a list of Q objects (or dicts, if ``raw``).
+
+        See ``dumps_many`` for ``processes`` and ``chunksize``.
+        """
+        strings = list(strings)
+        if processes is not None and len(strings) > chunksize:
+            return self._map_chunks(
+                _loads_raw_chunk if raw else _loads_chunk, strings, processes,
+                chunksize)
+        decoder = PackedDecoder()
+        return [self._loads(string, raw, decoder) for string in strings]
+
+    def _map_chunks(self, func, items, processes, chunksize):
+        chunks = [(self, items[i:i + chunksize])
+                  for i in range(0, len(items), chunksize)]
+        with ProcessPoolExecutor(max_workers=processes or None) as pool:
+            return [item for chunk in pool.map(func, chunks)
+                    for item in chunk]
+
+
+_json_encoder = json.JSONEncoder(default=dt2ts)
+_json_decoder = json.JSONDecoder()
+
+
+# process pool workers, module level so they can be pickled
+def _dumps_chunk(args):
+    serializer, objs = args
+    return serializer.dumps_many(objs)
+
+
+def _loads_chunk(args):
+    serializer, strings = args
+    return serializer.loads_many(strings)
+
+
+def _loads_raw_chunk(args):
+    serializer, strings = args
+    return serializer.loads_many(strings, raw=True)
@@ -0,0 +1,136 @@
+"""
+Approximate distinct values of the fields of very large tables.
+
+The number of rows of a table is estimated from the database's statistics
+(``pg_class.reltuples`` on PostgreSQL, ``sqlite_stat1`` or the largest
+rowid on SQLite) rather than counted. Above ADVANCED_FILTERS_APPROXIMATE_ROWS
+the choices of a field are read from a sample of about
+ADVANCED_FILTERS_SAMPLE_ROWS rows: ``TABLESAMPLE SYSTEM`` on PostgreSQL,
+a few random blocks of rowids on SQLite. Values that are rare in the table
+may be missing from the sample, so responses are flagged as approximate.
+"""
+import logging
+import random
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.models import AutoField, BigAutoField, Q
+
+from .cache import get_generation, get_shared_cache
+from .in_lists import ValuesTable
+
+logger = logging.getLogger('advanced_filters.sampling')
+
+ROWS_KEY = 'advanced_filters:rows:%s'
+# seconds row estimates are cached for
+ROWS_TTL = 300
+# number of rowid blocks sampled on SQLite
+SQLITE_BLOCKS = 10
+
+
+def _rows_postgresql(cursor, connection, table):
+    cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                   [connection.ops.quote_name(table)])
+    row = cursor.fetchone()
+    # reltuples is -1 (or 0 on older versions) before the first ANALYZE
+    return int(row[0]) if row and row[0] > 0 else None
+
+
+def _rows_sqlite(cursor, connection, table):
+    try:
+        cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s',
+                       [table])
+        stats = [int(row[0].split()[0]) for row in cursor.fetchall()]
+    except DatabaseError:  # no ANALYZE run yet
+        stats = []
+    if stats:
+        return max(stats)
+    cursor.execute('SELECT MAX(rowid) FROM %s' %
+                   connection.ops.quote_name(table))
+    return cursor.fetchone()[0]
+
+
+ESTIMATORS = {
+    'postgresql': _rows_postgresql,
+    'sqlite': _rows_sqlite,
+}
+
+
+def estimate_rows(model, using=None):
+    """
+    The number of rows of model's table according to the database's
+    statistics, None if the backend is not supported. Estimates are cached
+    for ROWS_TTL seconds.
+    """
+    connection = connections[using or model._default_manager.db]
+    estimator = ESTIMATORS.get(connection.vendor)
+    if estimator is None:
+        return None
+    cache = get_shared_cache()
+    key = ROWS_KEY % model._meta.label_lower
+    rows = cache.get(key)
+    if rows is None:
+        try:
+            with connection.cursor() as cursor:
+                rows = estimator(cursor, connection, model._meta.db_table)
+        except DatabaseError as e:
+            logger.warning('Failed estimating the rows of %s: %s',
+                           model._meta.label, e)
+            rows = None
+        # cache unknown estimates too, as -1
+        cache.set(key, -1 if rows is None else rows, ROWS_TTL)
+    return None if rows is None or rows < 0 else rows
+
+
+def approximate_rows(model):
+    """
+    The estimated rows of model when its choices should be sampled, i.e
+    above ADVANCED_FILTERS_APPROXIMATE_ROWS (None, never), else None.
+    """
+    threshold = getattr(settings, 'ADVANCED_FILTERS_APPROXIMATE_ROWS', None)
+    if threshold is None:
+        return None
+    rows = estimate_rows(model)
+    if rows is None or rows <= threshold:
+        return None
+    return rows
+
+
+def sample_queryset(queryset, rows, size=None):
+    """
+    Restrict queryset to a sample of about ``size`` (the
+    ADVANCED_FILTERS_SAMPLE_ROWS setting, 10000) of its model's ``rows``.
+    The sample only changes with the model's generation, so that pages of
+    choices are read from the same sample. Returns None when the backend or
+    primary key can't be sampled.
+    """
+    if size is None:
+        size = getattr(settings, 'ADVANCED_FILTERS_SAMPLE_ROWS', 10000)
+    model = queryset.model
+    connection = connections[queryset.db]
+    seed = get_generation(model) % (2 ** 31)
+    if connection.vendor == 'postgresql':
+        percent = min(100.0, 100.0 * size / max(rows, 1))
+        pk = model._meta.pk
+        return queryset.filter(pk__in=ValuesTable(
+            'SELECT %s FROM %s TABLESAMPLE SYSTEM (%%s) REPEATABLE (%%s)' % (
+                connection.ops.quote_name(pk.column),
+                connection.ops.quote_name(model._meta.db_table)),
+            (percent, seed)))
+    if (connection.vendor == 'sqlite' and
+            isinstance(model._meta.pk, (AutoField, BigAutoField))):
+        # the integer primary key is the rowid, each block is a range seek
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT MIN(rowid), MAX(rowid) FROM %s' %
+                           connection.ops.quote_name(model._meta.db_table))
+            low, high = cursor.fetchone()
+        if low is None:
+            return queryset
+        block = max(1, size // SQLITE_BLOCKS)
+        rand = random.Random(seed)
+        blocks = Q()
+        for _ in range(SQLITE_BLOCKS):
+            start = rand.randint(low, max(high - block + 1, low))
+            blocks |= Q(pk__gte=start, pk__lt=start + block)
+        return queryset.filter(blocks)
+    return None
@@ -0,0 +1,30 @@
+"""
+Signals to trace how filters are decoded, compiled and applied.
+
+All durations are in seconds, measured with ``time.perf_counter``, and
+``started`` arguments are ``perf_counter`` values. Signals are only sent
+when a receiver is connected, so they cost next to nothing otherwise.
+"""
+import time
+
+from django.dispatch import Signal
+
+# sender: AdvancedFilter; filter_id, model, started
+query_decode_started = Signal()
+# sender: AdvancedFilter; filter_id, model, started, duration, query
+query_decoded = Signal()
+# sender: the filtered model; query, mode, started, duration, queryset
+query_compiled = Signal()
+# sender: AdvancedListFilters; filter_id, model, request, snapshot,
+# started, duration, queryset
+filter_applied = Signal()
+# sender: GetFieldChoices or GetOperatorChoices view class; model,
+# field_name, request, started, duration, results (number of choices)
+choices_looked_up = Signal()
+
+
+def send_timed(signal, sender, started, **kwargs):
+    """Send a signal with the time elapsed since ``started``, if needed"""
+    if signal.has_listeners(sender):
+        signal.send(sender=sender, started=started,
+                    duration=time.perf_counter() - started, **kwargs)
@@ -0,0 +1,59 @@
+"""
+Compact storage of the primary keys matched by a filter.
+
+Integer primary keys are sorted, delta encoded in a signed 64 bit array and
+zlib compressed, which takes a few bits per key for typical id ranges.
+"""
+from array import array
+import zlib
+
+from django.db import connections, models
+
+from .in_lists import in_list_values, max_in_list_size
+
+SNAPSHOT_V1 = b'\x01'
+
+
+def supports_snapshot(model):
+    """Whether the primary keys of a model are integers that can be packed"""
+    pk = model._meta.pk
+    # the primary key of a child model is a link to its parent's
+    pk = getattr(pk, 'target_field', pk)
+    return isinstance(pk, (models.AutoField, models.IntegerField))
+
+
+def pack_pks(pks):
+    """Pack an iterable of integer primary keys into bytes"""
+    deltas = array('q')
+    previous = 0
+    for pk in sorted(pks):
+        deltas.append(pk - previous)
+        previous = pk
+    return SNAPSHOT_V1 + zlib.compress(deltas.tobytes())
+
+
+def unpack_pks(data):
+    """Return the sorted list of primary keys packed by ``pack_pks``"""
+    data = bytes(data)
+    if data[:1] != SNAPSHOT_V1:
+        raise ValueError('Unknown snapshot format')
+    deltas = array('q')
+    deltas.frombytes(zlib.decompress(data[1:]))
+    pks = []
+    previous = 0
+    for delta in deltas:
+        previous += delta
+        pks.append(previous)
+    return pks
+
+
+def filter_pks(queryset, pks):
+    """
+    Filter a queryset by a list of primary keys, whatever its length: long
+    lists are passed as a single query parameter (see ``in_lists``).
+    """
+    connection = connections[queryset.db]
+    if len(pks) <= max_in_list_size(connection):
+        return queryset.filter(pk__in=pks)
+    return queryset.filter(pk__in=in_list_values(
+        connection, queryset.model._meta.pk, pks))
@@ -74,6 +74,17 @@ var OperatorHandlers = function($) {
 	};
 
 
+	self.paste_list = function(e) {
+		// text inputs drop the newlines of pasted lists, keep them as separators
+		var op = $(this).parents('tr').find('.query-operator');
+		var clipboard = (e.originalEvent || e).clipboardData;
+		if ($(op).val() !== 'in' || !clipboard) return;
+		e.preventDefault();
+		var text = clipboard.getData('text').split(/[\r\n\t]+/).filter(Boolean).join(', ');
+		var current = $(this).val();
+		$(this).val(current ? current + ', ' + text : text);
+	};
+
 	self.removeSelect2 = function(elm) {
 		var input = $(elm).parents('tr').find('input.query-value');
 		input.select2("destroy");
@@ -104,6 +115,8 @@ var OperatorHandlers = function($) {
 		var choices_url = ADVANCED_FILTER_CHOICES_LOOKUP_URL + (FORM_MODEL ||
 						  MODEL_LABEL) + '/' + field;
 		var input = $(elm).parents('tr').find('input.query-value');
+		// last value loaded, the next page is requested after it
+		var cursor = null;
 		input.select2("destroy");
 		input.select2({
       minimumInputLength: ADVANCED_FILTERS_MINIMUM_INPUT,
@@ -116,9 +129,14 @@ var OperatorHandlers = function($) {
             search: term,
             page
           };
+          if (page > 1 && cursor !== null) {
+            query.after = cursor;
+          }
           return query;
         },
         results: function results(data) {
+          var count = data.results.length;
+          cursor = count ? data.results[count - 1].id : null;
           return {
             results: data.results,
             more: data.more
@@ -213,6 +231,10 @@ var OperatorHandlers = function($) {
 			}).change();
 			self.field_selected($(this), true);
 		});
+		$('.form-row input.query-value').each(function() {
+			$(this).off("paste");
+			$(this).on("paste", self.paste_list);
+		});
 
 	};
 
@@ -224,6 +246,7 @@ var OperatorHandlers = function($) {
 			$(this).off("change");
 		});
 		$('.form-row input.query-value').each(function() {
+			$(this).off("paste");
 			$(this).select2("destroy");
 		});
 	};
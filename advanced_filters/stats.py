@@ -0,0 +1,109 @@
+"""
+Usage and latency statistics of advanced filters.
+
+Applying a filter must not cost a write per request: uses are buffered in
+memory by a process-wide ``UsageRecorder`` and written in batches, every
+ADVANCED_FILTERS_STATS_FLUSH_INTERVAL seconds or
+ADVANCED_FILTERS_STATS_FLUSH_SIZE filters, whichever comes first.
+"""
+import atexit
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+import simplejson as json
+
+logger = logging.getLogger('advanced_filters.stats')
+
+STATS_FIELDS = ('usage_count', 'last_used_at', 'total_time', 'p95_time',
+                'last_result_size', 'recent_times')
+
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile of a list of values.
+
+    >>> percentile([5, 1, 4, 2, 3], 95)
+    5
+    >>> percentile(list(range(1, 101)), 95)
+    95
+    """
+    ordered = sorted(values)
+    rank = max(1, int(math.ceil(percent / 100.0 * len(ordered))))
+    return ordered[rank - 1]
+
+
+def tracking_enabled():
+    return getattr(settings, 'ADVANCED_FILTERS_TRACK_USAGE', True)
+
+
+class UsageRecorder(object):
+    """Buffer the uses of filters and write them to the database in batches"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._last_flush = time.monotonic()
+
+    def record(self, filter_id, elapsed, result_size=None):
+        """Record that a filter was applied in ``elapsed`` seconds"""
+        with self._lock:
+            usage = self._pending.setdefault(filter_id, {
+                'count': 0, 'total': 0.0, 'times': []})
+            usage['count'] += 1
+            usage['total'] += elapsed
+            usage['times'].append(elapsed)
+            usage['last_used_at'] = timezone.now()
+            usage['last_result_size'] = result_size
+            due = (len(self._pending) >= getattr(
+                settings, 'ADVANCED_FILTERS_STATS_FLUSH_SIZE', 100) or
+                time.monotonic() - self._last_flush >= getattr(
+                    settings, 'ADVANCED_FILTERS_STATS_FLUSH_INTERVAL', 60))
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered uses, with one UPDATE per filter"""
+        from .models import AdvancedFilter
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        window = getattr(settings, 'ADVANCED_FILTERS_STATS_WINDOW', 100)
+        try:
+            with transaction.atomic():
+                afilters = list(AdvancedFilter.objects.select_for_update(
+                    ).filter(pk__in=pending).only(*STATS_FIELDS))
+                for afilter in afilters:
+                    usage = pending[afilter.pk]
+                    times = (json.loads(afilter.recent_times or '[]') +
+                             usage['times'])[-window:]
+                    afilter.usage_count += usage['count']
+                    afilter.total_time += usage['total']
+                    afilter.last_used_at = usage['last_used_at']
+                    if usage['last_result_size'] is not None:
+                        afilter.last_result_size = usage['last_result_size']
+                    afilter.recent_times = json.dumps(
+                        [round(t, 6) for t in times])
+                    afilter.p95_time = percentile(times, 95)
+                AdvancedFilter.objects.bulk_update(afilters, STATS_FIELDS)
+        except DatabaseError:
+            logger.exception('Failed writing the usage of %d advanced filters',
+                             len(pending))
+
+
+recorder = UsageRecorder()
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        recorder.flush()
+    except Exception:
+        pass
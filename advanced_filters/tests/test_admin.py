@@ -4,10 +4,13 @@ except ImportError:  # Django < 2.0
     from django.core.urlresolvers import reverse
 from django.contrib.auth.models import Permission
 from django.db.models import Q
-from django.test import TestCase
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
 
 from ..models import AdvancedFilter
-from ..admin import AdvancedListFilters
+from ..admin import (AdvancedListFilters, clone_filter, get_visible_filters,
+                     site)
+from ..cache import get_shared_cache
 from tests import factories
 
 
@@ -174,3 +177,83 @@ class AdvancedFilterUsageTest(TestCase):
         assert cl.filter_specs
         if hasattr(cl, 'queryset'):
             assert cl.queryset.count() == 2
+
+    def test_filters_available_to_superusers(self):
+        self.user.is_superuser = True
+        self.user.save()
+        url = reverse('admin:customers_client_changelist')
+        res = self.client.get(url, data={'_afilter': self.a.pk})
+        assert res.status_code == 200
+        assert res.context_data['cl'].result_count == 2
+        assert not list(res.context['messages'])
+
+    def test_unknown_filter_reported(self):
+        url = reverse('admin:customers_client_changelist')
+        res = self.client.get(url, data={'_afilter': self.a.pk + 1})
+        assert res.status_code == 200
+        assert res.context_data['cl'].result_count == 10
+        messages = [m.message for m in res.context['messages']]
+        assert len(messages) == 1
+        assert 'was not applied' in messages[0]
+
+
+class VisibleFiltersTest(TestCase):
+    def setUp(self):
+        self.user = factories.SalesRep()
+        self.other = factories.SalesRep(username='other')
+        self.request = RequestFactory().get('/')
+        self.request.user = self.user
+        self.Client = factories.Client._meta.model
+        self.own = AdvancedFilter.objects.create(
+            title='own', url='foo', created_by=self.user,
+            model='customers.Client', b64_query='')
+        self.shared = AdvancedFilter.objects.create(
+            title='shared', url='foo', created_by=self.other,
+            model='customers.Client', b64_query='', is_public=True)
+        AdvancedFilter.objects.create(
+            title='hidden', url='foo', created_by=self.other,
+            model='customers.Client', b64_query='')
+        self.shared.users.add(self.user)
+        self.own.users.add(self.user)
+
+    def test_single_query_per_request(self):
+        with self.assertNumQueries(1):
+            visible = get_visible_filters(self.request, self.Client)
+            assert get_visible_filters(self.request, self.Client) is visible
+        assert list(visible) == [str(self.own.pk), str(self.shared.pk)]
+        deferred = visible[str(self.own.pk)].get_deferred_fields()
+        assert {'form_rows', 'snapshot'} <= deferred
+
+    @override_settings(ADVANCED_FILTERS_SHOW_COUNTS=True)
+    def test_lookups_with_counts(self):
+        get_shared_cache().clear()
+        self.own.query = Q(language='en')
+        self.own.save()
+        factories.Client.create_batch(2, assigned_to=self.user,
+                                      language='en')
+        model_admin = site._registry[self.Client]
+        afilter = AdvancedListFilters(self.request, {}, self.Client,
+                                      model_admin)
+        assert afilter.lookup_choices == [
+            (self.own.pk, 'own (2)'), (self.shared.pk, 'shared')]
+
+
+class CloneFilterTest(TestCase):
+    def test_clone_resets_stats_and_snapshot(self):
+        user = factories.SalesRep()
+        other = factories.SalesRep(username='other')
+        afilter = AdvancedFilter.objects.create(
+            title='en', url='foo', created_by=user, model='customers.Client',
+            usage_count=3, total_time=1.5, p95_time=0.6, last_result_size=10,
+            recent_times='[0.5]', last_used_at=timezone.now(),
+            snapshot_enabled=True, snapshot=b'\x01',
+            snapshot_at=timezone.now())
+        original = afilter.pk
+        clone = AdvancedFilter.objects.get(pk=clone_filter(afilter, other).pk)
+        assert clone.pk != original
+        assert clone.title == 'en (cloned)'
+        assert clone.snapshot_enabled
+        assert (clone.usage_count, clone.total_time) == (0, 0)
+        assert clone.last_used_at is clone.p95_time is None
+        assert clone.last_result_size is clone.recent_times is None
+        assert clone.snapshot is clone.snapshot_at is None
@@ -0,0 +1,101 @@
+from django.db import transaction
+from django.db.models import Q
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from ..cache import (QueryCache, clone_q, get_generation, get_shared_cache,
+                     track_model)
+from ..models import AdvancedFilter
+from ..q_serializer import QSerializer
+from tests import factories
+
+
+class QueryCacheTest(TestCase):
+    def setUp(self):
+        self.s = QSerializer(base64=True, packed=True)
+        self.cache = QueryCache(maxsize=2)
+        self.loads = []
+
+    def loader(self, b64_query):
+        self.loads.append(b64_query)
+        return self.s.loads(b64_query)
+
+    def test_hits_and_misses(self):
+        b64_query = self.s.dumps(Q(first_name__iexact='foo'))
+        first = self.cache.get(b64_query, self.loader)
+        second = self.cache.get(b64_query, self.loader)
+        assert first.children == second.children
+        assert len(self.loads) == 1
+        info = self.cache.info()
+        assert (info['hits'], info['misses'], info['size']) == (1, 1, 1)
+
+    def test_lru_eviction(self):
+        a, b, c = [self.s.dumps(Q(name=n)) for n in 'abc']
+        self.cache.get(a, self.loader)
+        self.cache.get(b, self.loader)
+        self.cache.get(a, self.loader)  # a is now most recently used
+        self.cache.get(c, self.loader)  # evicts b
+        assert self.cache.info()['evictions'] == 1
+        self.cache.get(a, self.loader)
+        assert self.loads == [a, b, c]
+        self.cache.get(b, self.loader)
+        assert self.loads == [a, b, c, b]
+
+    def test_returns_defensive_copies(self):
+        b64_query = self.s.dumps(Q(a__range=[1, 2]) & ~Q(b=1))
+        first = self.cache.get(b64_query, self.loader)
+        first.children[1].children.append(['c', 3])
+        first.negated = True
+        second = self.cache.get(b64_query, self.loader)
+        assert not second.negated
+        assert second.children[1].children == [['b', 1]]
+
+    def test_clone_q(self):
+        q = Q(a=[1, 2]) | ~Q(b=3)
+        clone = clone_q(q)
+        assert clone == q
+        assert clone is not q
+        assert clone.children[1] is not q.children[1]
+        assert clone.children[0][1] is not q.children[0][1]
+
+    @override_settings(ADVANCED_FILTERS_QUERY_CACHE_SIZE=0)
+    def test_disabled(self):
+        cache = QueryCache()
+        b64_query = self.s.dumps(Q(name='a'))
+        cache.get(b64_query, self.loader)
+        cache.get(b64_query, self.loader)
+        assert len(self.loads) == 2
+        assert cache.info()['size'] == 0
+
+    def test_model_query_uses_cache(self):
+        af = AdvancedFilter(query=Q(first_name__iexact='foo'))
+        af.query.children.append(['last_name', 'bar'])
+        assert af.query.children == [['first_name__iexact', 'foo']]
+
+
+class GenerationTest(TransactionTestCase):
+    def setUp(self):
+        get_shared_cache().clear()
+        self.rep = factories.SalesRep()
+        self.Client = factories.Client._meta.model
+        track_model(self.Client)
+
+    def test_bumped_on_save_and_commit(self):
+        initial = get_generation(self.Client)
+        with transaction.atomic():
+            factories.Client(assigned_to=self.rep)
+            during = get_generation(self.Client)
+            assert during != initial
+        assert get_generation(self.Client) not in (initial, during)
+
+    def test_not_bumped_again_on_rollback(self):
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                factories.Client(assigned_to=self.rep)
+                during = get_generation(self.Client)
+                raise ValueError
+        assert get_generation(self.Client) == during
+
+    def test_autocommit(self):
+        initial = get_generation(self.Client)
+        factories.Client(assigned_to=self.rep)
+        assert get_generation(self.Client) == initial + 1
@@ -0,0 +1,54 @@
+from django.test import TestCase, override_settings
+
+from ..cache import get_shared_cache
+from ..choices import get_field_choices, get_operator_choices
+from tests import factories
+
+
+class ChoicesCacheTest(TestCase):
+    def setUp(self):
+        get_shared_cache().clear()
+        self.user = factories.SalesRep()
+        for name in ('Cindy', 'John'):
+            factories.Client(assigned_to=self.user, first_name=name)
+
+    def test_cached_until_model_changes(self):
+        expected = {'results': [{'id': 'Cindy', 'text': 'Cindy'},
+                                {'id': 'John', 'text': 'John'}],
+                    'more': False}
+        assert get_field_choices('customers.Client', 'first_name') == expected
+        with self.assertNumQueries(0):
+            assert get_field_choices(
+                'customers.Client', 'first_name') == expected
+        factories.Client(assigned_to=self.user, first_name='Mark')
+        response = get_field_choices('customers.Client', 'first_name')
+        assert [r['id'] for r in response['results']] == [
+            'Cindy', 'John', 'Mark']
+
+    def test_related_model_changes(self):
+        response = get_field_choices('customers.Client',
+                                     'assigned_to__username')
+        assert response['results'] == [{'id': 'user', 'text': 'user'}]
+        factories.SalesRep(username='other')
+        response = get_field_choices('customers.Client',
+                                     'assigned_to__username')
+        assert [r['id'] for r in response['results']] == ['other', 'user']
+
+    def test_keyed_by_parameters(self):
+        assert get_field_choices('customers.Client', 'first_name',
+                                 search='ci')['results'] == [
+            {'id': 'Cindy', 'text': 'Cindy'}]
+        assert get_field_choices('customers.Client', 'first_name',
+                                 after='Cindy')['results'] == [
+            {'id': 'John', 'text': 'John'}]
+
+    @override_settings(ADVANCED_FILTERS_CHOICES_TTL=0)
+    def test_disabled(self):
+        get_field_choices('customers.Client', 'first_name')
+        with self.assertNumQueries(1):
+            get_field_choices('customers.Client', 'first_name')
+
+    def test_operator_choices(self):
+        response = get_operator_choices('customers.Client', 'is_active')
+        assert [r['key'] for r in response['results']] == [
+            'istrue', 'isfalse', 'isnull']
@@ -0,0 +1,194 @@
+from io import StringIO
+import os
+import tempfile
+from unittest import mock
+
+from django.contrib import admin
+from django.contrib.auth.models import Group
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import Q
+from django.test import TestCase
+
+import simplejson as json
+
+from ..cache import get_shared_cache
+from ..choices import get_field_choices
+from ..management.commands.suggest_advanced_filter_indexes import (
+    suggest_index)
+from ..models import AdvancedFilter, FieldValue
+from tests import factories
+
+
+class ExportImportTest(TestCase):
+    def setUp(self):
+        self.user = factories.SalesRep()
+        self.other = factories.SalesRep(username='other')
+        self.group = Group.objects.create(name='sales')
+        for i in range(5):
+            af = AdvancedFilter(title='filter %d' % i, url='foo',
+                                created_by=self.user, model='customers.Client')
+            af.query = Q(first_name__iexact='name %d' % i)
+            af.save()
+            af.users.add(self.user, self.other)
+            if i % 2:
+                af.groups.add(self.group)
+        AdvancedFilter.objects.filter(title='filter 1').update(
+            snapshot_enabled=True)
+
+    def export(self, *args):
+        out = StringIO()
+        call_command('export_advanced_filters', *args, stdout=out,
+                     stderr=StringIO())
+        return [json.loads(line) for line in out.getvalue().splitlines()]
+
+    def test_export(self):
+        records = self.export('--chunk-size', '2')
+        assert [r['title'] for r in records] == [
+            'filter %d' % i for i in range(5)]
+        assert records[1]['created_by'] == 'user'
+        assert sorted(records[1]['users']) == ['other', 'user']
+        assert records[1]['groups'] == ['sales']
+        assert records[0]['groups'] == []
+        assert [r['snapshot_enabled'] for r in records[:2]] == [False, True]
+        assert self.export('--model', 'reps.SalesRep') == []
+
+    def test_import(self):
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'w') as fh:
+            for record in self.export():
+                fh.write(json.dumps(record) + '\n')
+            fh.write(json.dumps(dict(record, created_by='missing')) + '\n')
+        AdvancedFilter.objects.all().delete()
+
+        err = StringIO()
+        call_command('import_advanced_filters', path, '--chunk-size', '2',
+                     stderr=err)
+        assert 'Imported 5 advanced filters, skipped 1' in err.getvalue()
+        imported = AdvancedFilter.objects.order_by('pk')
+        assert [af.title for af in imported] == [
+            'filter %d' % i for i in range(5)]
+        af = imported[1]
+        assert af.created_by == self.user
+        assert set(af.users.all()) == {self.user, self.other}
+        assert list(af.groups.all()) == [self.group]
+        assert af.query.children == [['first_name__iexact', 'name 1']]
+        assert af.snapshot_enabled and not imported[0].snapshot_enabled
+
+
+class SuggestIndexesTest(TestCase):
+    def setUp(self):
+        user = factories.SalesRep()
+        queries = [
+            Q(email__iexact='a@a.com') | Q(first_name__icontains='b'),
+            Q(email__iexact='b@b.com', language='en'),
+            Q(assigned_to__email__iexact='c') & Q(is_active=True),
+            Q(date_joined__year__gte=2000),
+        ]
+        for i, query in enumerate(queries):
+            af = AdvancedFilter(title='filter %d' % i, url='foo',
+                                created_by=user, model='customers.Client')
+            af.query = query
+            af.save()
+
+    def suggest(self, *args):
+        out = StringIO()
+        call_command('suggest_advanced_filter_indexes', *args, stdout=out,
+                     stderr=StringIO())
+        return out.getvalue()
+
+    def test_suggestions(self):
+        output = self.suggest('customers.Client', '--chunk-size', '3')
+        lines = output.splitlines()
+        # most used first
+        assert lines[0].split() == ['2', 'customers.Client.email', 'iexact']
+        assert lines[1].strip() == (
+            'migrations.RunSQL("CREATE INDEX client_email_ci ON '
+            'customers_client (email COLLATE NOCASE);", '
+            '"DROP INDEX client_email_ci;")')
+        assert 'customers.Client.language exact' in output
+        assert 'reps.SalesRep.email iexact' in output
+        assert 'customers.Client.date_joined year' in output
+        # no index for booleans, nor trigram indexes on SQLite
+        assert 'is_active' not in output
+        assert 'first_name' not in output
+        # the foreign key is already indexed
+        assert 'assigned_to' not in output
+
+    def test_existing_case_insensitive_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE INDEX client_email_ci ON customers_client '
+                           '(email COLLATE NOCASE)')
+        output = self.suggest('customers.Client')
+        assert 'customers.Client.email' not in output
+
+    def test_postgresql_suggestions(self):
+        email = factories.Client._meta.model._meta.get_field('email')
+        indexes = (set(), set(), set())
+        python, sql = suggest_index(email, 'istartswith', indexes,
+                                    'postgresql')
+        assert sql == ('CREATE INDEX client_email_ci ON customers_client '
+                       '(UPPER(email) varchar_pattern_ops);')
+        assert python.startswith('migrations.RunSQL(')
+        python, sql = suggest_index(email, 'iexact', indexes, 'mysql')
+        assert python == (
+            "models.Index(fields=['email'], name='client_email_idx')")
+        assert suggest_index(email, 'month', indexes, 'postgresql') is None
+
+    def test_unknown_model(self):
+        self.assertRaises(CommandError, self.suggest, 'foo.Bar')
+
+
+class WarmChoicesTest(TestCase):
+    def setUp(self):
+        get_shared_cache().clear()
+        self.user = factories.SalesRep()
+        for name in ('Cindy', 'John', 'Mark'):
+            factories.Client(assigned_to=self.user, first_name=name)
+
+    def test_warm(self):
+        out = StringIO()
+        with self.settings(ADVANCED_FILTERS_PAGE_SIZE=2):
+            call_command('warm_advanced_filter_choices', 'customers.Client',
+                         '--pages', '2', stdout=out)
+            with self.assertNumQueries(0):
+                get_field_choices('customers.Client', 'first_name')
+                get_field_choices('customers.Client', 'first_name', page=2,
+                                  after='John')
+                get_field_choices('customers.Client', 'assigned_to__email')
+        # first_name takes 2 pages, language (static choices) and
+        # assigned_to__email 1
+        assert '4 pages of choices cached' in out.getvalue()
+
+    def test_invalid_field(self):
+        model_admin = admin.site._registry[factories.Client._meta.model]
+        out, err = StringIO(), StringIO()
+        with mock.patch.object(model_admin, 'advanced_filter_fields',
+                               ('first_name__foo', 'last_name')):
+            call_command('warm_advanced_filter_choices', 'customers.Client',
+                         stdout=out, stderr=err)
+        assert 'customers.Client.first_name__foo' in err.getvalue()
+        assert '1 pages of choices cached' in out.getvalue()
+
+    def test_unknown_model(self):
+        with self.assertRaises(CommandError):
+            call_command('warm_advanced_filter_choices', 'customers.Nope')
+
+
+class RebuildDictionariesTest(TestCase):
+    def test_rebuild(self):
+        user = factories.SalesRep()
+        factories.Client(assigned_to=user, last_name='Smith')
+        model_admin = admin.site._registry[factories.Client._meta.model]
+        out = StringIO()
+        with mock.patch.object(model_admin, 'advanced_filter_dictionary_fields',
+                               ('last_name', 'assigned_to__username'),
+                               create=True):
+            call_command('rebuild_advanced_filter_dictionaries',
+                         'customers.Client', stdout=out)
+        assert '2 dictionaries rebuilt' in out.getvalue()
+        assert set(FieldValue.objects.values_list(
+            'model', 'field', 'value', 'count')) == {
+            ('customers.client', 'last_name', 'Smith', 1),
+            ('reps.salesrep', 'username', 'user', 1)}
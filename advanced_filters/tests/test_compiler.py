@@ -0,0 +1,95 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db.models import Q
+from django.test import TestCase
+
+from ..compiler import (EXISTS, JOIN, apply_query, get_query_mode,
+                        iter_lookups, requires_distinct, resolve_lookup,
+                        rewrite_exists)
+from tests import factories
+
+
+class RequiresDistinctTest(TestCase):
+    def setUp(self):
+        self.Rep = get_user_model()
+        self.Client = factories.Client._meta.model
+
+    def test_resolve_lookup(self):
+        fields = resolve_lookup(self.Client, 'assigned_to__email__iexact')
+        assert [f.name for f in fields] == ['assigned_to', 'email']
+        assert resolve_lookup(self.Client, 'foo__bar') is None
+
+    def test_local_and_forward_fields(self):
+        query = (Q(first_name__iexact='a') & ~Q(language='en') |
+                 Q(assigned_to__email__icontains='b') |
+                 Q(date_joined__year__gte=2000))
+        assert not requires_distinct(self.Client, query)
+        qs = apply_query(self.Client.objects.all(), query)
+        assert not qs.query.distinct
+
+    def test_multivalued_relations(self):
+        # many to many
+        assert requires_distinct(self.Rep, Q(groups__name__iexact='a'))
+        # reverse foreign key
+        assert requires_distinct(self.Rep, Q(first_name='a') |
+                                 Q(client__email__icontains='b'))
+        assert requires_distinct(self.Client,
+                                 Q(assigned_to__groups__name='a'))
+        qs = apply_query(self.Rep.objects.all(), Q(groups__name='a'))
+        assert qs.query.distinct
+
+    def test_unknown_paths(self):
+        assert requires_distinct(self.Client, Q(foo__bar=1))
+
+
+class ExistsModeTest(TestCase):
+    def setUp(self):
+        self.Rep = get_user_model()
+        a = Group.objects.create(name='a')
+        b = Group.objects.create(name='b')
+        self.both = factories.SalesRep(username='both')
+        self.both.groups.add(a, b)
+        self.only_a = factories.SalesRep(username='only_a')
+        self.only_a.groups.add(a)
+        self.none = factories.SalesRep(username='none')
+
+    def filter(self, query, mode):
+        qs = apply_query(self.Rep.objects.all(), query, mode=mode)
+        return sorted(qs.values_list('username', flat=True))
+
+    def assert_same(self, query):
+        exists = self.filter(query, EXISTS)
+        assert exists == self.filter(query, JOIN)
+        return exists
+
+    def test_rewrite(self):
+        query = Q(groups__name='a', groups__id__gt=0) | ~Q(groups__name='b')
+        rewritten, annotations = rewrite_exists(self.Rep, query)
+        assert len(annotations) == 2
+        assert set(iter_lookups(rewritten)) == set(annotations)
+        # the original query is left untouched
+        assert query.children[0].children[0] == ('groups__id__gt', 0)
+
+    def test_results_match_join_mode(self):
+        assert self.assert_same(Q(groups__name__in=['a', 'b'])) == [
+            'both', 'only_a']
+        assert self.assert_same(~Q(groups__name='b')) == ['none', 'only_a']
+        assert self.assert_same(
+            Q(groups__name='a') & Q(groups__name='b')) == []
+        assert self.assert_same(
+            Q(username='none') | Q(groups__name='b')) == ['both', 'none']
+
+    def test_no_distinct(self):
+        qs = apply_query(self.Rep.objects.all(), Q(groups__name='a'),
+                         mode=EXISTS)
+        assert not qs.query.distinct
+        assert qs.count() == 2
+
+    def test_query_mode(self):
+        assert get_query_mode() == JOIN
+        with self.settings(ADVANCED_FILTERS_QUERY_MODE=EXISTS):
+            assert get_query_mode() == EXISTS
+            admin = type('Admin', (), {'advanced_filter_query_mode': JOIN})
+            assert get_query_mode(admin) == JOIN
+        with self.settings(ADVANCED_FILTERS_QUERY_MODE='foo'):
+            self.assertRaises(ValueError, get_query_mode)
@@ -0,0 +1,76 @@
+import time
+
+from django.db.models import Q
+from django.test import TestCase, override_settings
+
+from ..cache import get_generation, get_shared_cache, track_model
+from ..counts import get_filter_counts
+from ..models import AdvancedFilter
+from tests import factories
+
+
+@override_settings(ADVANCED_FILTERS_COUNT_REFRESH_BUDGET=1)
+class FilterCountsTest(TestCase):
+    def setUp(self):
+        get_shared_cache().clear()
+        self.Client = factories.Client._meta.model
+        self.clients = self.Client.objects.all()
+        track_model(self.Client)
+        self.user = factories.SalesRep()
+        factories.Client.create_batch(3, assigned_to=self.user,
+                                      language='en')
+        factories.Client.create_batch(2, assigned_to=self.user,
+                                      language='ru')
+        self.afilters = []
+        for language in ('en', 'ru'):
+            afilter = AdvancedFilter(title=language, url='foo',
+                                     created_by=self.user,
+                                     model='customers.Client')
+            afilter.query = Q(language=language)
+            afilter.save()
+            self.afilters.append(afilter)
+
+    def test_counts_are_cached_within_budget(self):
+        with self.assertNumQueries(1):
+            counts = get_filter_counts(self.clients, self.afilters)
+        en, ru = [afilter.pk for afilter in self.afilters]
+        assert counts == {en: 3, ru: None}
+        with self.assertNumQueries(1):
+            counts = get_filter_counts(self.clients, self.afilters)
+        assert counts == {en: 3, ru: 2}
+        with self.assertNumQueries(0):
+            get_filter_counts(self.clients, self.afilters)
+
+    def test_invalidated_by_changes(self):
+        en = self.afilters[0]
+        assert get_filter_counts(self.clients, [en]) == {en.pk: 3}
+        generation = get_generation(self.Client)
+        client = factories.Client(assigned_to=self.user, language='en')
+        assert get_generation(self.Client) > generation
+        assert get_filter_counts(self.clients, [en]) == {en.pk: 4}
+        client.delete()
+        assert get_filter_counts(self.clients, [en]) == {en.pk: 3}
+
+    def test_scoped_by_queryset(self):
+        en = self.afilters[0]
+        other = factories.SalesRep(username='other')
+        factories.Client(assigned_to=other, language='en')
+        assert get_filter_counts(self.clients, [en]) == {en.pk: 4}
+        own = self.Client.objects.filter(assigned_to=self.user)
+        assert get_filter_counts(own, [en]) == {en.pk: 3}
+        with self.assertNumQueries(0):
+            assert get_filter_counts(self.clients, [en]) == {en.pk: 4}
+
+    @override_settings(ADVANCED_FILTERS_COUNT_TTL=0.1)
+    def test_expire_after_ttl(self):
+        en = self.afilters[0]
+        assert get_filter_counts(self.clients, [en]) == {en.pk: 3}
+        # bulk updates don't send signals
+        self.Client.objects.update(language='en')
+        time.sleep(0.2)
+        assert get_filter_counts(self.clients, [en]) == {en.pk: 5}
+
+    def test_generation_survives_eviction(self):
+        generation = get_generation(self.Client)
+        get_shared_cache().clear()
+        assert get_generation(self.Client) >= generation
@@ -0,0 +1,113 @@
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from ..cache import get_generation, get_shared_cache
+from ..choices import get_field_choices
+from ..dictionaries import (_PendingCounts, _fields, rebuild_dictionary,
+                            track_dictionary)
+from ..models import FieldValue
+from tests import factories
+
+
+class DictionaryMixin(object):
+    def setUp(self):
+        get_shared_cache().clear()
+        self.Client = factories.Client._meta.model
+        self.field = self.Client._meta.get_field('last_name')
+        self.user = factories.SalesRep()
+        for name in ('Smith', 'Smith', 'Rossi'):
+            factories.Client(assigned_to=self.user, last_name=name)
+        track_dictionary(self.field)
+
+    def tearDown(self):
+        _fields[self.Client].pop('last_name', None)
+
+    def counts(self):
+        return dict(FieldValue.objects.filter(
+            model='customers.client', field='last_name').values_list(
+                'value', 'count'))
+
+
+class ValueDictionaryTest(DictionaryMixin, TestCase):
+    def test_rebuild(self):
+        assert rebuild_dictionary(self.field) == 2
+        assert self.counts() == {'Smith': 2, 'Rossi': 1}
+
+    def test_choices_served_from_dictionary(self):
+        rebuild_dictionary(self.field)
+        with self.assertNumQueries(1):
+            response = get_field_choices('customers.Client', 'last_name',
+                                         search='s')
+        assert response == {
+            'results': [{'id': 'Smith', 'text': 'Smith', 'count': 2}],
+            'more': False,
+        }
+        # the dictionary is the source, not the table
+        FieldValue.objects.filter(value='Rossi').delete()
+        get_shared_cache().clear()
+        response = get_field_choices('customers.Client', 'last_name')
+        assert [r['id'] for r in response['results']] == ['Smith']
+
+    def test_pending_counts_bump_generation(self):
+        rebuild_dictionary(self.field)
+        generation = get_generation(self.Client)
+        _PendingCounts({(self.Client, 'last_name', 'Novak'): 1,
+                        (self.Client, 'last_name', 'Rossi'): -1})()
+        assert self.counts() == {'Smith': 2, 'Novak': 1}
+        # choices cached before the counts were applied are stale
+        assert get_generation(self.Client) == generation + 1
+
+
+class DictionarySignalsTest(DictionaryMixin, TransactionTestCase):
+    def test_maintained_by_signals(self):
+        rebuild_dictionary(self.field)
+        client = factories.Client(assigned_to=self.user, last_name='Novak')
+        assert self.counts() == {'Smith': 2, 'Rossi': 1, 'Novak': 1}
+        client = self.Client.objects.get(pk=client.pk)
+        client.last_name = 'Smith'
+        client.save()
+        assert self.counts() == {'Smith': 3, 'Rossi': 1}
+        # unchanged fields or values are not counted again
+        client.save(update_fields=['first_name'])
+        self.Client.objects.only('pk').get(pk=client.pk).save()
+        assert self.counts() == {'Smith': 3, 'Rossi': 1}
+        self.Client.objects.filter(last_name='Rossi').get().delete()
+        assert self.counts() == {'Smith': 3}
+
+    def test_applied_on_commit(self):
+        rebuild_dictionary(self.field)
+        with transaction.atomic():
+            factories.Client(assigned_to=self.user, last_name='Novak')
+            factories.Client(assigned_to=self.user, last_name='Novak')
+            self.Client.objects.filter(last_name='Rossi').get().delete()
+            assert self.counts() == {'Smith': 2, 'Rossi': 1}
+        assert self.counts() == {'Smith': 2, 'Novak': 2}
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                for i in range(3):
+                    factories.Client(assigned_to=self.user,
+                                     last_name='Smith')
+        # a single update of the count, however many rows were saved
+        updates = [q['sql'] for q in queries.captured_queries
+                   if 'fieldvalue' in q['sql']]
+        assert len(updates) == 1
+        assert self.counts() == {'Smith': 5, 'Novak': 2}
+        try:
+            with transaction.atomic():
+                factories.Client(assigned_to=self.user, last_name='Rossi')
+                raise ValueError
+        except ValueError:
+            pass
+        assert self.counts() == {'Smith': 5, 'Novak': 2}
+        # the rolled back batch is not applied by the next commit
+        with transaction.atomic():
+            factories.Client(assigned_to=self.user, last_name='Novak')
+        assert self.counts() == {'Smith': 5, 'Novak': 3}
+
+    def test_deleted_counts_remembered_values(self):
+        rebuild_dictionary(self.field)
+        client = self.Client.objects.filter(last_name='Rossi').get()
+        client.last_name = 'Novak'  # not saved
+        client.delete()
+        assert self.counts() == {'Smith': 2}
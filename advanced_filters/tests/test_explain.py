@@ -0,0 +1,58 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+from django.test import TestCase, override_settings
+
+from ..explain import Estimate, check_estimate, estimate_query
+from ..forms import AdvancedFilterForm
+from .test_forms import CommonFormTest
+
+
+class EstimateTest(TestCase):
+    def setUp(self):
+        self.Rep = get_user_model()
+
+    def test_sqlite_scans(self):
+        estimate = estimate_query(self.Rep.objects.all(),
+                                  Q(first_name__icontains='a'))
+        assert estimate.scans == 1
+        assert estimate.cost is None
+        estimate = estimate_query(self.Rep.objects.all(), Q(pk=1))
+        assert estimate.scans == 0
+
+    @override_settings(ADVANCED_FILTERS_WARN_COST=100,
+                       ADVANCED_FILTERS_REFUSE_COST=1000,
+                       ADVANCED_FILTERS_WARN_SCANS=1)
+    def test_thresholds(self):
+        assert check_estimate(None) is None
+        assert check_estimate(Estimate(10, 1, 0, '')) is None
+        assert check_estimate(Estimate(500, 1, 0, ''))[0] == 'warning'
+        assert check_estimate(Estimate(5000, 1, 0, ''))[0] == 'error'
+        assert check_estimate(Estimate(None, None, 1, '')) is None
+        assert check_estimate(Estimate(None, None, 2, ''))[0] == 'warning'
+
+
+class FormCostTest(CommonFormTest):
+    def get_form(self):
+        return AdvancedFilterForm(self._create_query_form_data(),
+                                  instance=self.af,
+                                  filter_fields=['first_name'])
+
+    def test_disabled_by_default(self):
+        form = self.get_form()
+        with self.assertNumQueries(0):
+            assert form.is_valid()
+        assert form.warnings == []
+
+    @override_settings(ADVANCED_FILTERS_WARN_SCANS=0)
+    def test_warn(self):
+        form = self.get_form()
+        assert form.is_valid()
+        assert form.warnings == [
+            'This filter is expensive to run (1 full table scans).']
+
+    @override_settings(ADVANCED_FILTERS_REFUSE_SCANS=0)
+    def test_refuse(self):
+        form = self.get_form()
+        assert not form.is_valid()
+        assert form.non_field_errors() == [
+            'This filter is expensive to run (1 full table scans).']
@@ -1,8 +1,12 @@
 from datetime import datetime
+import importlib
 import time
+from unittest import mock
 
 from django.contrib import admin
 from django.contrib.auth import get_user_model
+from django.apps import apps
+from django.db import connection
 from django.db.models import Q, FieldDoesNotExist
 from django.test import TestCase
 from django.conf import settings
@@ -286,6 +290,61 @@ class TestAdvancedFilterForm(CommonFormTest):
         self._assert_query_content(new_instance.query,
                                    ['last_name__iexact', 'john'])
 
+    def test_form_rows_stored_on_save(self):
+        form = AdvancedFilterForm(self._create_query_form_data(),
+                                  instance=self.af, filter_fields=['first_name'])
+        assert form.is_valid(), (form.errors, form.fields_formset.errors)
+        instance = form.save()
+        assert instance.get_form_rows() == [{
+            'field': 'first_name', 'negate': False, 'operator': 'iexact',
+            'value': 'john'}]
+
+        # opening the filter again skips decoding and field path lookups
+        with mock.patch('advanced_filters.forms.get_fields_from_path') as m:
+            form = AdvancedFilterForm(instance=instance)
+        assert not m.called
+        assert form.fields_formset.initial == instance.get_form_rows()
+
+    def test_stale_form_rows_ignored(self):
+        self.af.set_form_rows([{'field': 'stale'}])
+        self.af.query = Q(last_name__iexact='bar')
+        assert self.af.get_form_rows() is None
+        self.af.set_form_rows([{'field': 'stale'}])
+        self.af.b64_query = AdvancedFilter(query=Q(email='a')).b64_query
+        assert self.af.get_form_rows() is None
+        form = AdvancedFilterForm(instance=self.af, filter_fields=['email'])
+        assert form.fields_formset.initial[0]['field'] == 'email'
+
+    def test_form_rows_keep_value_types(self):
+        self.af.query = Q(last_login__lt=datetime(2020, 1, 2, 3, 4),
+                          first_name__iexact='foo')
+        parsed = AdvancedFilterForm.parse_form_rows(self.af, self.Rep)
+        assert isinstance(parsed[1]['value'], datetime)
+        self.af.set_form_rows(parsed)
+        assert self.af.get_form_rows() == AdvancedFilterForm.parse_form_rows(
+            self.af, self.Rep)
+
+    def test_backfill_migration(self):
+        self.af.save()
+        migration = importlib.import_module(
+            'advanced_filters.migrations.0006_advancedfilter_form_rows')
+        migration.backfill_form_rows(apps, mock.Mock(connection=connection))
+        self.af.refresh_from_db()
+        assert self.af.get_form_rows() == [{
+            'field': 'first_name', 'negate': False, 'operator': 'iexact',
+            'value': 'foo'}]
+
+    def test_backfill_migration_matches_form(self):
+        self.af.query = Q(last_login__lt=datetime(2020, 1, 2, 3, 4),
+                          id__in=[1, 2])
+        self.af.save()
+        migration = importlib.import_module(
+            'advanced_filters.migrations.0006_advancedfilter_form_rows')
+        migration.backfill_form_rows(apps, mock.Mock(connection=connection))
+        self.af.refresh_from_db()
+        assert self.af.get_form_rows() == AdvancedFilterForm.parse_form_rows(
+            self.af, self.Rep)
+
 
 class TestAdminInitialization(CommonFormTest):
     def setUp(self):
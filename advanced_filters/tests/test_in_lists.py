@@ -0,0 +1,84 @@
+from django.db import connection
+from django.db.models import Q
+from django.test import TestCase, override_settings
+
+from ..compiler import EXISTS, JOIN, apply_query, rewrite_in_lists
+from ..forms import AdvancedFilterQueryForm
+from ..in_lists import max_in_list_size
+from tests import factories
+
+
+class InListOperatorTest(TestCase):
+    fields = dict(email='email')
+
+    def test_parse_pasted_list(self):
+        form = AdvancedFilterQueryForm(self.fields, data=dict(
+            field='email', operator='in',
+            value='a@a.com,\r\nb@b.com\n\nc@c.com; a@a.com'))
+        assert form.is_valid(), form.errors
+        assert form.make_query().children == [
+            ('email__in', ['a@a.com', 'b@b.com', 'c@c.com'])]
+
+    def test_empty_list(self):
+        form = AdvancedFilterQueryForm(self.fields, data=dict(
+            field='email', operator='in', value=' ,\n'))
+        assert not form.is_valid()
+        assert form.errors == {'value': ['This field is required.']}
+
+    def test_invalid_values(self):
+        Client = factories.Client._meta.model
+        form = AdvancedFilterQueryForm(
+            dict(assigned_to='rep'), model=Client, data=dict(
+                field='assigned_to', operator='in', value='1, x, 3, y'))
+        assert not form.is_valid()
+        assert form.errors == {'value': ['Invalid values: x, y']}
+
+    def test_restore_form_data(self):
+        Client = factories.Client._meta.model
+        data = AdvancedFilterQueryForm._parse_query_dict(
+            {'field': 'email__in', 'value': ['a@a.com', 'b@b.com']}, Client)
+        assert data['operator'] == 'in'
+        assert data['value'] == 'a@a.com, b@b.com'
+
+
+@override_settings(ADVANCED_FILTERS_IN_LIST_MAX_PARAMS=10)
+class LongInListTest(TestCase):
+    def setUp(self):
+        self.Client = factories.Client._meta.model
+        rep = factories.SalesRep()
+        for i in range(5):
+            factories.Client(assigned_to=rep, email='%d@example.com' % i)
+        self.emails = ['%d@example.com' % i for i in range(1, 2000)]
+
+    def test_rewrite(self):
+        assert max_in_list_size(connection) == 10
+        short = Q(email__in=self.emails[:10])
+        assert rewrite_in_lists(self.Client, short, connection) is short
+        query = Q(first_name='a') | Q(email__in=self.emails)
+        rewritten = rewrite_in_lists(self.Client, query, connection)
+        assert rewritten.children[0] == ('first_name', 'a')
+        assert not isinstance(rewritten.children[1][1], list)
+        # the original query is left untouched
+        assert query.children[1] == ('email__in', self.emails)
+
+    def test_apply(self):
+        for mode in (JOIN, EXISTS):
+            qs = apply_query(self.Client.objects.all(),
+                             Q(email__in=self.emails), mode=mode)
+            assert qs.count() == 4
+            qs = apply_query(self.Client.objects.all(),
+                             ~Q(email__in=self.emails), mode=mode)
+            assert list(qs.values_list('email', flat=True)) == [
+                '0@example.com']
+
+    def test_skips_invalid_values(self):
+        pks = ['x'] + [str(pk) for pk in self.Client.objects.values_list(
+            'pk', flat=True)] * 10
+        qs = apply_query(self.Client.objects.all(), Q(id__in=pks))
+        assert qs.count() == 5
+
+    def test_related_field(self):
+        reps = [str(pk) for pk in range(1, 100)]
+        qs = apply_query(self.Client.objects.all(),
+                         Q(assigned_to__in=reps))
+        assert qs.count() == 5
@@ -59,3 +59,11 @@ class AdvancedFilterPermissions(TestCase):
             'value_to': 10,
             'negate': True,
         }]
+
+    def test_mapping_values(self):
+        self.advancedfilter.query = Q(data={'a': 1})
+        assert self.advancedfilter.query.children == [['data', {'a': 1}]]
+        # not packable, stored as JSON
+        self.advancedfilter.query = Q(data={1: 'a'})
+        assert self.advancedfilter.list_fields() == [
+            {'field': 'data', 'value': {'1': 'a'}, 'negate': False}]
@@ -0,0 +1,94 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+from django.test import TestCase
+
+from ..models import AdvancedFilter
+from ..q_optimizer import optimize_q
+
+
+class OptimizeQTest(TestCase):
+    def test_flattens_same_connector(self):
+        inner = Q(a=1) & Q(b=2)
+        outer = Q()
+        outer.children = [inner, ('c', 3)]
+        res = optimize_q(outer)
+        assert res.connector == 'AND'
+        assert res.children == [('a', 1), ('b', 2), ('c', 3)]
+
+    def test_removes_empty_nodes_and_wrappers(self):
+        wrapper = Q()
+        wrapper.children = [Q(), ~Q(), Q(Q(Q(a=1)))]
+        res = optimize_q(wrapper)
+        assert res.children == [('a', 1)]
+        assert not res.negated
+
+    def test_keeps_negated_nodes(self):
+        res = optimize_q(Q(a=1) & ~(Q(b=2) & Q(c=3)))
+        assert res.children[0] == ('a', 1)
+        assert res.children[1].negated
+        assert res.children[1].children == [('b', 2), ('c', 3)]
+
+    def test_removes_duplicates(self):
+        query = Q()
+        query.children = [('a', 1), ['a', 1], ~Q(b=[1, 2]), ~Q(b=[1, 2])]
+        res = optimize_q(query)
+        assert len(res.children) == 2
+        # OR'd sub-trees are compared regardless of their children order
+        res = optimize_q((Q(a=1) & Q(b=2)) | (Q(b=2) & Q(a=1)))
+        assert res.children == [('a', 1), ('b', 2)]
+
+    def test_does_not_mutate(self):
+        query = Q(a=1) | (Q(b=1) & Q(b=1))
+        before = repr(query)
+        optimize_q(query, merge_in=True)
+        assert repr(query) == before
+
+    def test_merge_in(self):
+        query = (Q(a__exact=1) | Q(b__iexact='x') | Q(a__exact=2) |
+                 Q(a__in=[2, 3]) | Q(c__exact=None))
+        res = optimize_q(query, merge_in=True)
+        assert res.connector == 'OR'
+        assert res.children == [
+            ('a__in', [1, 2, 3]), ('b__iexact', 'x'), ('c__exact', None)]
+        # AND'ed equality predicates are left alone
+        res = optimize_q(Q(a__exact=1) & Q(a__exact=2), merge_in=True)
+        assert res.children == [('a__exact', 1), ('a__exact', 2)]
+
+    def test_merge_in_with_model(self):
+        Rep = get_user_model()
+        query = (Q(first_name='a') | Q(first_name='b') |
+                 Q(first_name__year='c') | Q(first_name__year='d'))
+        res = optimize_q(query, merge_in=True)
+        assert len(res.children) == 4
+        res = optimize_q(query, merge_in=True, model=Rep)
+        assert res.children[0] == ('first_name__in', ['a', 'b'])
+        assert len(res.children) == 3
+
+    def test_deeply_nested(self):
+        query = Q(level=0)
+        for i in range(1, 5000):
+            parent = Q()
+            parent.connector = 'OR' if i % 2 else 'AND'
+            parent.children = [query, ('level', i)]
+            query = parent
+        res = optimize_q(query)
+        for i in range(4999, 1, -1):
+            assert res.children[1] == ('level', i)
+            res = res.children[0]
+        # the innermost single predicate wrapper is flattened
+        assert res.children == [('level', 0), ('level', 1)]
+
+    def test_keeps_values_of_different_types(self):
+        res = optimize_q(Q(a=1) | Q(a=True) | Q(a=1.0) | Q(a=1))
+        assert res.children == [('a', 1), ('a', True), ('a', 1.0)]
+        res = optimize_q(Q(a__exact=1) | Q(a__in=[1.0, 1]), merge_in=True)
+        assert res.children == [('a__in', [1, 1.0])]
+
+    def test_applied_on_load_only(self):
+        af = AdvancedFilter(model='reps.SalesRep')
+        af.query = (Q(first_name='a') | Q(first_name='a') | Q(Q()) |
+                    Q(first_name='b'))
+        # stored as entered, so that the form shows the rows that were saved
+        assert [f['value'] for f in af.list_fields()] == [
+            'a', 'null', 'a', 'null', 'null', 'b']
+        assert af.query.children == [['first_name__in', ['a', 'b']]]
@@ -1,8 +1,14 @@
+from datetime import date, datetime, timezone
+from decimal import Decimal
+import base64
+import uuid
+
+from django.core.serializers.base import SerializationError
 from django.db.models import Q
 from django.test import TestCase
 import json
 
-from ..q_serializer import QSerializer
+from ..q_serializer import PACKED_V1, QSerializer
 
 
 class QSerializerTest(TestCase):
@@ -37,3 +43,117 @@ class QSerializerTest(TestCase):
         qres = self.s.loads('{"connector": "AND", "negated": false, "children"'
                             ' :[["test", 1234]], "subtree_parents": []}')
         self.assertIsInstance(qres, Q)
+
+    def test_serialize_does_not_mutate(self):
+        query = self.query_a | ~self.query_b
+        children = list(query.children)
+        self.s.serialize(query)
+        assert query.children == children
+        assert self.s.serialize(query) == self.s.serialize(query)
+
+    def test_deserialize_does_not_mutate(self):
+        d = {'children': [['joined__range', [1, 2]],
+                          {'children': [['test', 1]], 'connector': 'OR',
+                           'negated': True}],
+             'connector': 'AND', 'negated': False}
+        expected = json.loads(json.dumps(d))
+        first = self.s.deserialize(d)
+        second = self.s.deserialize(d)
+        assert d == expected
+        assert first == second
+        assert isinstance(first.children[0][1][0], datetime)
+
+
+class PackedQSerializerTest(TestCase):
+    def setUp(self):
+        self.s = QSerializer(base64=True, packed=True)
+
+    def test_roundtrip_typed_values(self):
+        uid = uuid.uuid4()
+        aware = datetime(2020, 1, 2, 3, 4, 5, 6, tzinfo=timezone.utc)
+        query = (Q(price__gte=Decimal('10.50')) & ~Q(token=uid) |
+                 Q(day=date(2019, 5, 1), ts__lt=aware, count=-3,
+                   ratio=0.5, name=None, flag=True))
+        res = self.s.loads(self.s.dumps(query))
+        assert res.connector == 'OR'
+        first, second = res.children
+        assert first.children[0] == ['price__gte', Decimal('10.50')]
+        assert first.children[1].negated
+        assert first.children[1].children == [['token', uid]]
+        assert sorted(second.children) == [
+            ['count', -3], ['day', date(2019, 5, 1)], ['flag', True],
+            ['name', None], ['ratio', 0.5], ['ts__lt', aware]]
+
+    def test_range_values(self):
+        start, end = datetime(1980, 1, 1), datetime(1986, 1, 1)
+        res = self.s.loads(self.s.dumps(Q(joined__range=(start, end))))
+        assert res.children == [['joined__range', (start, end)]]
+
+    def test_mapping_values(self):
+        value = {'a': 1, 'b': [date(2020, 1, 2), {'c': None}]}
+        res = self.s.loads(self.s.dumps(Q(data=value) | Q(tags={})))
+        assert res.children == [['data', value], ['tags', {}]]
+        with self.assertRaises(SerializationError):
+            self.s.dumps(Q(data={1: 'a'}))
+
+    def test_header_and_size(self):
+        query = Q(first_name__iexact='foo') | Q(first_name__iexact='bar')
+        packed = self.s.dumps(query)
+        legacy = QSerializer(base64=True).dumps(query)
+        assert base64.b64decode(packed)[0] == PACKED_V1
+        assert len(packed) < len(legacy)
+
+    def test_loads_legacy_json(self):
+        query = Q(first_name__iexact='foo') & ~Q(last_name='bar')
+        legacy = QSerializer(base64=True).dumps(query)
+        res = self.s.loads(legacy)
+        assert res.children[0] == ['first_name__iexact', 'foo']
+        assert res.children[1].negated
+
+    def test_deeply_nested(self):
+        depth = 20000
+        query = Q(level=0)
+        for i in range(1, depth):
+            parent = Q()
+            parent.connector = 'OR' if i % 2 else 'AND'
+            parent.negated = not i % 3
+            parent.children = [query, ('level', i)]
+            query = parent
+        res = self.s.loads(self.s.dumps(query))
+        for i in range(depth - 1, 0, -1):
+            assert res.connector == ('OR' if i % 2 else 'AND')
+            assert res.negated == (not i % 3)
+            assert res.children[1] == ['level', i]
+            res = res.children[0]
+        assert res.children == [['level', 0]]
+        rows = self.s.get_field_values_list(
+            self.s.loads(self.s.dumps(query), raw=True))
+        assert len([r for r in rows if r['field'] == 'level']) == depth
+
+    def test_dumps_loads_many(self):
+        queries = [Q(a=i) | ~Q(b__range=(date(2020, 1, i), None))
+                   for i in range(1, 8)]
+        dumped = self.s.dumps_many(queries)
+        assert dumped == [self.s.dumps(q) for q in queries]
+        legacy = QSerializer(base64=True).dumps_many(queries[:2])
+        loaded = self.s.loads_many(dumped + legacy)
+        assert [q.children[0] for q in loaded] == (
+            [['a', i] for i in range(1, 8)] + [['a', 1], ['a', 2]])
+        raw = self.s.loads_many(dumped, raw=True)
+        assert raw[0]['connector'] == 'OR'
+
+    def test_dumps_loads_many_processes(self):
+        queries = [Q(a=i) & Q(b='x' * i) for i in range(10)]
+        dumped = self.s.dumps_many(queries, processes=2, chunksize=3)
+        assert dumped == self.s.dumps_many(queries)
+        loaded = self.s.loads_many(dumped, processes=2, chunksize=3)
+        assert [q.children for q in loaded] == [
+            [['a', i], ['b', 'x' * i]] for i in range(10)]
+        raw = self.s.loads_many(dumped, raw=True, processes=2, chunksize=3)
+        assert raw == self.s.loads_many(dumped, raw=True)
+
+    def test_unsupported_value(self):
+        with self.assertRaises(SerializationError):
+            self.s.dumps(Q(foo=object()))
+        with self.assertRaises(SerializationError):
+            self.s.loads(base64.b64encode(b'\x7f').decode())
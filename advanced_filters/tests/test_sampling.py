@@ -0,0 +1,60 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from ..cache import get_shared_cache
+from ..choices import get_field_choices
+from ..sampling import estimate_rows, sample_queryset
+from tests import factories
+
+
+class SamplingTest(TestCase):
+    def setUp(self):
+        get_shared_cache().clear()
+        self.Client = factories.Client._meta.model
+        self.user = factories.SalesRep()
+        self.clients = factories.Client.create_batch(
+            30, assigned_to=self.user)
+
+    def test_estimate_rows(self):
+        # without statistics, the largest rowid
+        assert estimate_rows(self.Client) == self.clients[-1].pk
+        get_shared_cache().clear()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        assert estimate_rows(self.Client) == 30
+
+    def test_sample_queryset(self):
+        queryset = self.Client.objects.all()
+        sample = sample_queryset(queryset, estimate_rows(self.Client),
+                                 size=10)
+        assert 0 < sample.count() <= 10
+        # the same sample until the model changes
+        assert list(sample) == list(sample_queryset(
+            queryset, estimate_rows(self.Client), size=10))
+
+    @override_settings(ADVANCED_FILTERS_APPROXIMATE_ROWS=10,
+                       ADVANCED_FILTERS_SAMPLE_ROWS=10)
+    def test_approximate_choices(self):
+        response = get_field_choices('customers.Client', 'email')
+        assert response['approximate'] is True
+        assert 0 < len(response['results']) <= 10
+        emails = set(c.email for c in self.clients)
+        assert set(r['id'] for r in response['results']) <= emails
+
+    @override_settings(ADVANCED_FILTERS_APPROXIMATE_ROWS=1000)
+    def test_small_tables_are_exact(self):
+        response = get_field_choices('customers.Client', 'email')
+        assert 'approximate' not in response
+
+    @override_settings(ADVANCED_FILTERS_APPROXIMATE_ROWS=10,
+                       ADVANCED_FILTERS_SAMPLE_ROWS=10)
+    def test_indexed_searches_are_exact(self):
+        email = self.clients[0].email
+        response = get_field_choices('customers.Client', 'email',
+                                     search=email)
+        assert 'approximate' not in response
+        assert [r['id'] for r in response['results']] == [email]
+        with override_settings(ADVANCED_FILTERS_SEARCH_MODE='icontains'):
+            response = get_field_choices('customers.Client', 'email',
+                                         search=email)
+        assert response['approximate'] is True
@@ -0,0 +1,69 @@
+try:
+    from django.urls import reverse
+except ImportError:  # Django < 2.0
+    from django.core.urlresolvers import reverse
+from django.contrib.auth.models import Permission
+from django.db.models import Q
+from django.test import TestCase
+
+from .. import signals
+from ..admin import AdvancedListFilters
+from ..cache import query_cache
+from ..models import AdvancedFilter
+from ..views import GetFieldChoices, GetOperatorChoices
+from tests import factories
+
+
+class SignalsTest(TestCase):
+    def setUp(self):
+        self.user = factories.SalesRep()
+        assert self.client.login(username='user', password='test')
+        factories.Client.create_batch(3, assigned_to=self.user, language='en')
+        self.user.user_permissions.add(Permission.objects.get(
+            codename='change_client'))
+        self.a = AdvancedFilter(title='English', url='foo',
+                                created_by=self.user, model='customers.Client')
+        self.a.query = Q(language='en')
+        self.a.save()
+        self.a.users.add(self.user)
+        query_cache.clear()
+        self.received = []
+
+    def connect(self, signal):
+        def receiver(signal, sender, **kwargs):
+            self.received.append((signal, sender, kwargs))
+        signal.connect(receiver, weak=False)
+        self.addCleanup(signal.disconnect, receiver)
+
+    def test_filter_signals(self):
+        for signal in (signals.query_decode_started, signals.query_decoded,
+                       signals.query_compiled, signals.filter_applied):
+            self.connect(signal)
+        url = reverse('admin:customers_client_changelist')
+        self.client.get(url, data={'_afilter': self.a.pk})
+        assert [r[0] for r in self.received] == [
+            signals.query_decode_started, signals.query_decoded,
+            signals.query_compiled, signals.filter_applied]
+        decoded, compiled, applied = [r[2] for r in self.received[1:]]
+        assert decoded['filter_id'] == self.a.pk
+        assert [tuple(c) for c in decoded['query'].children] == [
+            ('language', 'en')]
+        assert compiled['mode'] == 'join'
+        assert self.received[2][1] is factories.Client._meta.model
+        assert self.received[3][1] is AdvancedListFilters
+        assert applied['filter_id'] == self.a.pk
+        assert not applied['snapshot']
+        assert applied['duration'] >= compiled['duration'] >= 0
+
+    def test_choices_signals(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.connect(signals.choices_looked_up)
+        kwargs = dict(model='customers.Client', field_name='email')
+        self.client.get(reverse('afilters_get_field_choices', kwargs=kwargs))
+        self.client.get(reverse('afilters_get_operator_choices',
+                                kwargs=kwargs))
+        assert [r[1] for r in self.received] == [
+            GetFieldChoices, GetOperatorChoices]
+        assert self.received[0][2]['results'] == 3
+        assert self.received[1][2]['field_name'] == 'email'
@@ -0,0 +1,115 @@
+from datetime import timedelta
+
+try:
+    from django.urls import reverse
+except ImportError:  # Django < 2.0
+    from django.core.urlresolvers import reverse
+from django.contrib.auth.models import Permission
+from django.db.models import Q
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from ..forms import AdvancedFilterForm
+from ..models import AdvancedFilter
+from ..snapshots import filter_pks, pack_pks, unpack_pks
+from tests import factories
+
+
+class PackPksTest(TestCase):
+    def test_roundtrip(self):
+        pks = [5, 3, 2 ** 40, 1, 7]
+        packed = pack_pks(pks)
+        assert unpack_pks(packed) == sorted(pks)
+        assert unpack_pks(memoryview(packed)) == sorted(pks)
+        assert unpack_pks(pack_pks([])) == []
+
+    def test_compact(self):
+        # 800kB of raw 64 bit integers
+        assert len(pack_pks(range(100000))) < 2000
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, unpack_pks, b'\x00foo')
+
+    def test_filter_more_pks_than_query_params(self):
+        Client = factories.Client._meta.model
+        factories.Client.create_batch(3, assigned_to=factories.SalesRep())
+        pks = sorted(Client.objects.values_list('pk', flat=True))
+        many = pks[1:] + list(range(pks[-1] + 1, pks[-1] + 5000))
+        qs = filter_pks(Client.objects.all(), many)
+        assert sorted(qs.values_list('pk', flat=True)) == pks[1:]
+        assert not filter_pks(Client.objects.all(), []).exists()
+
+
+class AdvancedFilterSnapshotTest(TestCase):
+    def setUp(self):
+        self.user = factories.SalesRep()
+        factories.Client.create_batch(2, assigned_to=self.user,
+                                      language='ru')
+        factories.Client.create_batch(3, assigned_to=self.user,
+                                      language='en')
+        self.a = AdvancedFilter(title='Russian speakers', url='foo',
+                                created_by=self.user, model='customers.Client',
+                                snapshot_enabled=True)
+        self.a.query = Q(language='ru')
+        self.a.save()
+        self.a.users.add(self.user)
+
+    def test_refresh_and_staleness(self):
+        assert self.a.get_snapshot() is None
+        pks = self.a.refresh_snapshot()
+        assert len(pks) == 2
+        a = AdvancedFilter.objects.get(pk=self.a.pk)
+        assert a.get_snapshot() == pks
+        a.snapshot_at -= timedelta(hours=2)
+        assert a.get_snapshot() is None
+        with override_settings(ADVANCED_FILTERS_SNAPSHOT_MAX_AGE=86400):
+            assert a.get_snapshot() == pks
+        a.snapshot_at = timezone.now()
+        a.snapshot_enabled = False
+        assert a.get_snapshot() is None
+
+    def test_changing_the_query_drops_the_snapshot(self):
+        self.a.refresh_snapshot()
+        self.a.query = Q(language='en')
+        assert self.a.snapshot is None
+        assert self.a.get_snapshot() is None
+
+    def test_changelist_reuses_snapshot(self):
+        self.user.user_permissions.add(Permission.objects.get(
+            codename='change_client'))
+        assert self.client.login(username='user', password='test')
+        url = reverse('admin:customers_client_changelist')
+        res = self.client.get(url, data={'_afilter': self.a.pk})
+        assert res.context_data['cl'].queryset.count() == 2
+        assert AdvancedFilter.objects.get(pk=self.a.pk).snapshot_at
+        # new records only show up once the snapshot is refreshed
+        factories.Client(assigned_to=self.user, language='ru')
+        res = self.client.get(url, data={'_afilter': self.a.pk})
+        assert res.context_data['cl'].queryset.count() == 2
+        self.a.refresh_snapshot()
+        res = self.client.get(url, data={'_afilter': self.a.pk})
+        assert res.context_data['cl'].queryset.count() == 3
+
+    def test_refresh_unsupported_models(self):
+        self.a.model = 'sessions.Session'
+        with self.assertNumQueries(0):
+            assert self.a.refresh_snapshot() is None
+        self.a.model = 'customers.Removed'
+        with self.assertNumQueries(0):
+            assert self.a.refresh_snapshot() is None
+        assert self.a.snapshot is None
+
+    def test_form_refuses_unsupported_models(self):
+        afilter = AdvancedFilter(model='sessions.Session')
+        data = {'title': 'sessions', 'snapshot_enabled': True,
+                'form-TOTAL_FORMS': 1, 'form-INITIAL_FORMS': 0,
+                'form-0-field': 'session_key', 'form-0-operator': 'iexact',
+                'form-0-value': 'abc'}
+        form = AdvancedFilterForm(data, instance=afilter,
+                                  filter_fields=['session_key'])
+        assert not form.is_valid()
+        assert list(form.errors) == ['snapshot_enabled']
+        data['snapshot_enabled'] = False
+        form = AdvancedFilterForm(data, instance=afilter,
+                                  filter_fields=['session_key'])
+        assert form.is_valid(), form.errors
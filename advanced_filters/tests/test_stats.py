@@ -0,0 +1,86 @@
+try:
+    from django.urls import reverse
+except ImportError:  # Django < 2.0
+    from django.core.urlresolvers import reverse
+from django.contrib.auth.models import Permission
+from django.db.models import Q
+from django.test import TestCase, override_settings
+
+from ..models import AdvancedFilter
+from ..stats import UsageRecorder, recorder
+from tests import factories
+
+
+class UsageRecorderTest(TestCase):
+    def setUp(self):
+        self.user = factories.SalesRep()
+        self.a = AdvancedFilter.objects.create(
+            title='a', url='foo', created_by=self.user,
+            model='customers.Client', b64_query='')
+        self.recorder = UsageRecorder()
+
+    def test_buffered_writes(self):
+        with self.assertNumQueries(0):
+            for i in range(1, 21):
+                self.recorder.record(self.a.pk, i / 100.0, i)
+        self.recorder.flush()
+        self.a.refresh_from_db()
+        assert self.a.usage_count == 20
+        assert self.a.last_used_at is not None
+        assert abs(self.a.total_time - 2.1) < 1e-6
+        assert self.a.p95_time == 0.19
+        assert self.a.last_result_size == 20
+        with self.assertNumQueries(0):
+            self.recorder.flush()  # nothing pending
+
+    @override_settings(ADVANCED_FILTERS_STATS_WINDOW=5)
+    def test_p95_over_recent_window(self):
+        self.recorder.record(self.a.pk, 10.0)
+        self.recorder.flush()
+        for i in range(5):
+            self.recorder.record(self.a.pk, 0.5)
+        self.recorder.flush()
+        self.a.refresh_from_db()
+        assert self.a.usage_count == 6
+        assert self.a.p95_time == 0.5
+        assert self.a.last_result_size is None
+
+    @override_settings(ADVANCED_FILTERS_STATS_FLUSH_SIZE=2)
+    def test_flush_when_full(self):
+        b = AdvancedFilter.objects.create(
+            title='b', url='foo', created_by=self.user,
+            model='customers.Client', b64_query='')
+        self.recorder.record(self.a.pk, 0.1)
+        self.recorder.record(b.pk, 0.1)
+        assert AdvancedFilter.objects.filter(usage_count=1).count() == 2
+
+
+@override_settings(ADVANCED_FILTERS_STATS_FLUSH_SIZE=1)
+class ChangelistUsageTest(TestCase):
+    def setUp(self):
+        recorder.flush()  # uses buffered by other tests
+        self.user = factories.SalesRep()
+        assert self.client.login(username='user', password='test')
+        factories.Client.create_batch(3, assigned_to=self.user, language='en')
+        self.user.user_permissions.add(Permission.objects.get(
+            codename='change_client'))
+        self.a = AdvancedFilter(title='English', url='foo',
+                                created_by=self.user, model='customers.Client')
+        self.a.query = Q(language='en')
+        self.a.save()
+        self.a.users.add(self.user)
+
+    def test_usage_recorded(self):
+        url = reverse('admin:customers_client_changelist')
+        self.client.get(url, data={'_afilter': self.a.pk})
+        self.a.refresh_from_db()
+        assert self.a.usage_count == 1
+        assert self.a.last_result_size == 3
+        assert self.a.p95_time > 0
+
+    @override_settings(ADVANCED_FILTERS_TRACK_USAGE=False)
+    def test_tracking_disabled(self):
+        url = reverse('admin:customers_client_changelist')
+        self.client.get(url, data={'_afilter': self.a.pk})
+        self.a.refresh_from_db()
+        assert self.a.usage_count == 0
@@ -0,0 +1,87 @@
+from unittest import mock
+
+try:
+    from django.urls import reverse
+except ImportError:  # Django < 2.0
+    from django.core.urlresolvers import reverse
+from django.contrib.auth.models import Permission
+from django.db import connection
+from django.db.models import Q
+from django.test import RequestFactory, TestCase, override_settings
+
+from ..admin import site
+from ..models import AdvancedFilter
+from ..timeouts import QueryTimeout, query_timeout
+from tests import factories
+
+SLOW_CONDITION = (
+    '(WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c '
+    'WHERE x < 1000000000) SELECT count(*) FROM c) > 0')
+
+
+def slow_apply_query(queryset, query, mode=None):
+    return queryset.filter(query).extra(where=[SLOW_CONDITION])
+
+
+class QueryTimeoutTest(TestCase):
+    def run_slow_query(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT %s' % SLOW_CONDITION)
+
+    def test_sqlite_timeout(self):
+        with self.assertRaises(QueryTimeout):
+            with query_timeout(0.05):
+                self.run_slow_query()
+        # the connection is still usable, without the progress handler
+        with query_timeout(0.05):
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+
+    def test_no_timeout_configured(self):
+        with query_timeout():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+
+
+@override_settings(ADVANCED_FILTERS_QUERY_TIMEOUT=0.05)
+class ChangelistTimeoutTest(TestCase):
+    def setUp(self):
+        self.user = factories.SalesRep()
+        assert self.client.login(username='user', password='test')
+        factories.Client.create_batch(2, assigned_to=self.user)
+        self.user.user_permissions.add(Permission.objects.get(
+            codename='change_client'))
+        self.a = AdvancedFilter(title='slow', url='foo',
+                                created_by=self.user, model='customers.Client')
+        self.a.query = Q(language='en')
+        self.a.save()
+        self.a.users.add(self.user)
+        self.url = reverse('admin:customers_client_changelist')
+
+    def test_fast_filter(self):
+        res = self.client.get(self.url, data={'_afilter': self.a.pk})
+        assert res.status_code == 200
+
+    def test_response_rendered_later(self):
+        request = RequestFactory().get(self.url, {'_afilter': self.a.pk})
+        request.user = self.user
+        model_admin = site._registry[factories.Client._meta.model]
+        with mock.patch('advanced_filters.admin.query_timeout',
+                        wraps=query_timeout) as guard:
+            res = model_admin.changelist_view(request)
+        guard.assert_called_once_with(using='default')
+        # left to the template response middlewares
+        assert not res.is_rendered
+        with self.assertNumQueries(0):
+            assert len(res.context_data['cl'].result_list) == 2
+
+    @mock.patch('advanced_filters.admin.apply_query', slow_apply_query)
+    def test_falls_back_to_unfiltered_changelist(self):
+        res = self.client.get(self.url, data={'_afilter': self.a.pk,
+                                              'o': '1'})
+        assert res.status_code == 302
+        assert res['Location'] == '%s?o=1' % self.url
+        res = self.client.get(res['Location'])
+        assert res.status_code == 200
+        assert [m.message for m in res.context['messages']] == [
+            'The advanced filter took too long to run and was not applied.']
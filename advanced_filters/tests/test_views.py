@@ -1,6 +1,10 @@
 import sys
+from unittest import mock
 
+from django.contrib import admin
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 try:
     from django.test import override_settings
 except ImportError:
@@ -13,6 +17,7 @@ except ImportError:  # Django < 2.0
 import django
 
 from tests import factories
+from advanced_filters.cache import get_shared_cache
 from advanced_filters.forms import AdvancedFilterQueryForm
 
 
@@ -20,6 +25,7 @@ class TestGetFieldChoicesView(TestCase):
     url_name = 'afilters_get_field_choices'
 
     def setUp(self):
+        get_shared_cache().clear()
         self.user = factories.SalesRep()
         assert self.client.login(username='user', password='test')
 
@@ -108,7 +114,8 @@ class TestGetFieldChoicesView(TestCase):
             model='customers.Client', field_name='email'))
         res = self.client.get(view_url)
         self.assert_json(res, {
-            'results': [dict(id=e.email, text=e.email) for e in clients],
+            'results': [dict(id=email, text=email) for email in sorted(
+                c.email for c in clients)],
             'more': False
         })
 
@@ -119,6 +126,7 @@ class TestGetFieldChoicesView(TestCase):
         res = self.client.get(view_url)
         self.assert_json(res, {'results': [{'id': 'foo@bar.com', 'text': 'foo@bar.com'}], 'more': False})
 
+    @override_settings(ADVANCED_FILTERS_SEARCH_MODE='icontains')
     def test_search(self):
         factories.Client.create(assigned_to=self.user, first_name="Franscisco")
         factories.Client.create(assigned_to=self.user, first_name="Cindy")
@@ -137,6 +145,46 @@ class TestGetFieldChoicesView(TestCase):
             'more': False
         })
 
+    def test_search_prefix_by_default(self):
+        for name in ('Franscisco', 'Cindy', 'cinthia', 'Patricia'):
+            factories.Client.create(assigned_to=self.user, first_name=name)
+        view_url = reverse(self.url_name, kwargs=dict(
+            model='customers.Client', field_name='first_name'))
+        res = self.client.get(view_url, {'search': 'Ci'})
+        self.assert_json(res, {
+            'results': [
+                {'id': 'Cindy', 'text': 'Cindy'},
+                {'id': 'cinthia', 'text': 'cinthia'},
+            ],
+            'more': False
+        })
+
+    def test_search_mode_of_model_admin(self):
+        factories.Client.create(assigned_to=self.user, first_name='Cindy')
+        view_url = reverse(self.url_name, kwargs=dict(
+            model='customers.Client', field_name='first_name'))
+        model_admin = admin.site._registry[factories.Client._meta.model]
+        with mock.patch.object(model_admin, 'advanced_filter_search_modes',
+                               {'first_name': 'exact'}, create=True):
+            res = self.client.get(view_url, {'search': 'Cin'})
+            self.assert_json(res, {'results': [], 'more': False})
+            res = self.client.get(view_url, {'search': 'Cindy'})
+            self.assert_json(res, {
+                'results': [{'id': 'Cindy', 'text': 'Cindy'}],
+                'more': False
+            })
+
+    def test_exact_search_of_other_types(self):
+        view_url = reverse(self.url_name, kwargs=dict(
+            model='customers.Client', field_name='assigned_to__id'))
+        res = self.client.get(view_url, {'search': str(self.user.pk)})
+        self.assert_json(res, {
+            'results': [{'id': self.user.pk, 'text': str(self.user.pk)}],
+            'more': False
+        })
+        res = self.client.get(view_url, {'search': 'abc'})
+        self.assert_json(res, {'results': [], 'more': False})
+
     @override_settings(ADVANCED_FILTERS_PAGE_SIZE=3)
     def test_multiple_pages(self):
         factories.Client.create(assigned_to=self.user, first_name="Franscisco")
@@ -166,6 +214,35 @@ class TestGetFieldChoicesView(TestCase):
             'more': False
         })
 
+    @override_settings(ADVANCED_FILTERS_PAGE_SIZE=2)
+    def test_pages_after_cursor(self):
+        for name in ('Franscisco', 'Cindy', 'John', 'Mark', 'Amelie'):
+            factories.Client.create(assigned_to=self.user, first_name=name)
+        view_url = reverse(self.url_name, kwargs=dict(
+            model='customers.Client', field_name='first_name'))
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(view_url, {'page': '2', 'after': 'Cindy'})
+        self.assert_json(res, {
+            'results': [
+                {'id': 'Franscisco', 'text': 'Franscisco'},
+                {'id': 'John', 'text': 'John'},
+            ],
+            'more': True
+        })
+        assert not any('COUNT(' in q['sql'] for q in queries.captured_queries)
+        res = self.client.get(view_url, {'page': '3', 'after': 'John'})
+        self.assert_json(res, {
+            'results': [{'id': 'Mark', 'text': 'Mark'}],
+            'more': False
+        })
+
+    def test_invalid_after_cursor(self):
+        view_url = reverse(self.url_name, kwargs=dict(
+            model='customers.Client', field_name='assigned_to__id'))
+        res = self.client.get(view_url, {'after': 'abc'})
+        assert res.status_code == 400
+        assert 'error' in res.json()
+
     @override_settings(ADVANCED_FILTERS_PAGE_SIZE=3)
     def test_invalid_page(self):
         factories.Client.create(assigned_to=self.user, first_name="Mark")
@@ -184,6 +261,7 @@ class TestGetOperatorChoices(TestCase):
     url_name = 'afilters_get_operator_choices'
 
     def setUp(self):
+        get_shared_cache().clear()
         self.user = factories.SalesRep()
         assert self.client.login(username='user', password='test')
         self.options = dict(AdvancedFilterQueryForm.OPERATORS)
@@ -264,6 +342,10 @@ class TestGetOperatorChoices(TestCase):
                 'key': 'iregex',
                 'value': self.options['iregex']
             },
+            {
+                'key': 'in',
+                'value': self.options['in']
+            },
             {
                 'key': 'isnull',
                 'value': self.options['isnull']
@@ -309,6 +391,10 @@ class TestGetOperatorChoices(TestCase):
                 'key': 'iregex',
                 'value': self.options['iregex']
             },
+            {
+                'key': 'in',
+                'value': self.options['in']
+            },
             {
                 'key': 'isnull',
                 'value': self.options['isnull']
@@ -0,0 +1,90 @@
+"""
+Bound the time spent running the queries of an advanced filter.
+
+On PostgreSQL the queries run in a transaction with a local
+``statement_timeout``; on SQLite a progress handler interrupts them once
+the deadline has passed. Other backends are not limited.
+"""
+from contextlib import contextmanager
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+# SQLSTATE of PostgreSQL's query_canceled error
+QUERY_CANCELED = '57014'
+# number of SQLite virtual machine instructions between deadline checks
+SQLITE_PROGRESS_STEPS = 10000
+
+
+class QueryTimeout(Exception):
+    """The queries did not complete within the time budget"""
+
+
+def get_timeout():
+    """Time budget in seconds (ADVANCED_FILTERS_QUERY_TIMEOUT), or None"""
+    return getattr(settings, 'ADVANCED_FILTERS_QUERY_TIMEOUT', None)
+
+
+@contextmanager
+def _postgresql_timeout(connection, using, seconds):
+    try:
+        with transaction.atomic(using=using):
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL statement_timeout = %s',
+                               [max(1, int(seconds * 1000))])
+            yield
+    except OperationalError as e:
+        if getattr(e.__cause__, 'pgcode', None) == QUERY_CANCELED:
+            raise QueryTimeout(str(e)) from e
+        raise
+
+
+@contextmanager
+def _sqlite_timeout(connection, using, seconds):
+    deadline = time.monotonic() + seconds
+    expired = []
+
+    def progress_handler():
+        if time.monotonic() > deadline:
+            expired.append(True)
+            return 1
+        return 0
+
+    connection.ensure_connection()
+    connection.connection.set_progress_handler(
+        progress_handler, SQLITE_PROGRESS_STEPS)
+    try:
+        yield
+    except OperationalError as e:
+        if expired:
+            raise QueryTimeout(str(e)) from e
+        raise
+    finally:
+        connection.connection.set_progress_handler(
+            None, SQLITE_PROGRESS_STEPS)
+
+
+@contextmanager
+def _no_timeout(connection, using, seconds):
+    yield
+
+
+GUARDS = {
+    'postgresql': _postgresql_timeout,
+    'sqlite': _sqlite_timeout,
+}
+
+
+def query_timeout(seconds=None, using=DEFAULT_DB_ALIAS):
+    """
+    Context manager raising QueryTimeout when the queries run in its block
+    on the ``using`` database take longer than ``seconds`` (defaults to
+    ADVANCED_FILTERS_QUERY_TIMEOUT; no limit if not set).
+    """
+    if seconds is None:
+        seconds = get_timeout()
+    connection = connections[using]
+    guard = GUARDS.get(connection.vendor, _no_timeout) if seconds else \
+        _no_timeout
+    return guard(connection, using, seconds)
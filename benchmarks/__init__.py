@@ -0,0 +1,10 @@
+"""
+Benchmarks for django-advanced-filters hot paths.
+
+These are not part of the test suite; run a module directly, i.e.:
+
+    python -m benchmarks.q_serializer
+    python -m benchmarks.suite --save before.json
+    python -m benchmarks.suite --compare before.json
+    python -m benchmarks.load --clients 2000000 --concurrency 8
+"""
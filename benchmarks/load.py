@@ -0,0 +1,224 @@
+"""
+Load harness for the field choices and filtered changelist endpoints, on a
+large file-based SQLite copy of the bundled ``tests/test_project``.
+
+    python -m benchmarks.load [--db PATH] [--clients N] [--reps N]
+                              [--requests N] [--concurrency N] [--rebuild]
+
+The database is generated once with bulk ``executemany`` inserts (and kept
+for later runs, unless --rebuild is given). Requests are then sent
+concurrently with the Django test client, one client per thread, and the
+latency percentiles and number of queries per request are reported for each
+endpoint.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import itertools
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_NAMES = ('Anna', 'Brian', 'Carla', 'Dan', 'Elena', 'Frank', 'Grace',
+               'Hector', 'Ines', 'Jonas', 'Karen', 'Liam', 'Maria', 'Nadia',
+               'Oscar', 'Paula', 'Quentin', 'Rosa', 'Sam', 'Tanya')
+LAST_NAMES = ('Smith', 'Garcia', 'Rossi', 'Novak', 'Schmidt', 'Dubois',
+              'Kowalski', 'Silva', 'Jensen', 'Murphy', 'Costa', 'Meyer')
+LANGUAGES = ('en', 'sp', 'it')
+BATCH_SIZE = 10000
+
+
+def setup_django(db_path):
+    """Configure the test project to use a SQLite database file"""
+    sys.path.insert(0, ROOT)
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'tests.test_project.settings'
+    from tests.test_project import settings
+    settings.DATABASES['default']['NAME'] = db_path
+    settings.DEBUG = False
+    settings.ALLOWED_HOSTS = ['testserver']
+    import django
+    django.setup()
+
+
+def insert_rows(cursor, table, columns, rows):
+    """Insert an iterable of rows in batches with executemany"""
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        table, ', '.join(columns), ', '.join(['%s'] * len(columns)))
+    rows = iter(rows)
+    count = 0
+    while True:
+        batch = list(itertools.islice(rows, BATCH_SIZE))
+        if not batch:
+            return count
+        cursor.executemany(sql, batch)
+        count += len(batch)
+
+
+def generate(clients, reps, seed=0):
+    """Create the schema and fill it with ``reps`` and ``clients`` rows"""
+    from django.contrib.auth.hashers import make_password
+    from django.core.management import call_command
+    from django.db import connection, transaction
+    from tests.customers.models import Client
+    from tests.reps.models import SalesRep
+
+    call_command('migrate', verbosity=0, interactive=False)
+    rand = random.Random(seed)
+    password = make_password(None)
+    joined = datetime(2015, 1, 1)
+    started = time.perf_counter()
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode = OFF')
+        cursor.execute('PRAGMA synchronous = OFF')
+    with transaction.atomic(), connection.cursor() as cursor:
+        insert_rows(cursor, SalesRep._meta.db_table, (
+            'password', 'is_superuser', 'username', 'first_name', 'last_name',
+            'email', 'is_staff', 'is_active', 'date_joined'), (
+            (password, False, 'rep%d' % i, rand.choice(FIRST_NAMES),
+             rand.choice(LAST_NAMES), 'rep%d@example.com' % i, True, True,
+             joined) for i in range(reps)))
+        rep_ids = [pk for pk, in cursor.execute(
+            'SELECT id FROM %s' % SalesRep._meta.db_table)]
+        insert_rows(cursor, Client._meta.db_table, (
+            'password', 'language', 'email', 'first_name', 'last_name',
+            'is_active', 'assigned_to_id', 'date_joined'), (
+            (password, rand.choice(LANGUAGES), 'client%d@example.com' % i,
+             rand.choice(FIRST_NAMES), rand.choice(LAST_NAMES),
+             rand.random() > 0.1, rand.choice(rep_ids),
+             joined + timedelta(minutes=i)) for i in range(clients)))
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    print('Generated %d sales reps and %d clients in %.1fs' % (
+        reps, clients, time.perf_counter() - started))
+
+
+def create_filters(user):
+    """Saved filters of various shapes, returns their ids"""
+    from django.db.models import Q
+    from advanced_filters.models import AdvancedFilter
+
+    AdvancedFilter.objects.filter(created_by=user).delete()
+    queries = {
+        'language': Q(language='it'),
+        'name contains': Q(first_name__icontains='an'),
+        'rep email': Q(assigned_to__email__iexact='rep1@example.com'),
+        'or of ands': (Q(language='sp', last_name__iexact='rossi') |
+                       Q(first_name__iexact='liam', is_active=False)),
+        'in list': Q(email__in=['client%d@example.com' % i
+                                for i in range(0, 20000, 7)]),
+    }
+    ids = {}
+    for title, query in queries.items():
+        afilter = AdvancedFilter(title=title, url='load', created_by=user,
+                                 model='customers.Client', is_public=True)
+        afilter.query = query
+        afilter.save()
+        ids[title] = afilter.pk
+    return ids
+
+
+def build_requests(count, filter_ids, seed=0):
+    """A shuffled list of (endpoint, url, params) to request"""
+    from django.urls import reverse
+
+    rand = random.Random(seed)
+    changelist = reverse('admin:customers_client_changelist')
+    requests = []
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            title = rand.choice(sorted(filter_ids))
+            requests.append(('changelist %s' % title, changelist,
+                             {'_afilter': filter_ids[title]}))
+        else:
+            field = rand.choice(('first_name', 'last_name', 'email'))
+            url = reverse('afilters_get_field_choices', kwargs=dict(
+                model='customers.Client', field_name=field))
+            params = {'search': rand.choice(('', 'a', 'ro', 'client1')),
+                      'page': rand.randint(1, 5)}
+            requests.append(('field choices %s' % field, url, params))
+    return requests
+
+
+def run_requests(requests, user, concurrency):
+    """Send the requests from ``concurrency`` threads, return the timings"""
+    import threading
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+
+    local = threading.local()
+
+    def send(request):
+        endpoint, url, params = request
+        if not hasattr(local, 'client'):
+            local.client = Client()
+            local.client.force_login(user)
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = local.client.get(url, params)
+            elapsed = time.perf_counter() - started
+        return endpoint, elapsed, len(queries), response.status_code
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(send, requests))
+
+
+def report(results):
+    from advanced_filters.stats import percentile
+
+    by_endpoint = {}
+    for endpoint, elapsed, queries, status in results:
+        by_endpoint.setdefault(endpoint, []).append((elapsed, queries, status))
+    print('%-32s %6s %9s %9s %9s %9s %8s %6s' % (
+        'endpoint', 'count', 'p50 (ms)', 'p90 (ms)', 'p99 (ms)', 'max (ms)',
+        'queries', 'errors'))
+    for endpoint in sorted(by_endpoint):
+        rows = by_endpoint[endpoint]
+        times = [r[0] * 1000 for r in rows]
+        print('%-32s %6d %9.1f %9.1f %9.1f %9.1f %8.1f %6d' % (
+            endpoint, len(rows), percentile(times, 50), percentile(times, 90),
+            percentile(times, 99), max(times),
+            statistics.mean(r[1] for r in rows),
+            sum(1 for r in rows if r[2] != 200)))
+
+
+def main(args):
+    exists = os.path.exists(args.db)
+    if args.rebuild and exists:
+        os.remove(args.db)
+        exists = False
+    setup_django(args.db)
+    if not exists:
+        generate(args.clients, args.reps, seed=args.seed)
+
+    from tests.reps.models import SalesRep
+    user, created = SalesRep.objects.get_or_create(
+        username='load-admin', defaults=dict(is_staff=True, is_superuser=True))
+    filter_ids = create_filters(user)
+    requests = build_requests(args.requests, filter_ids, seed=args.seed)
+    started = time.perf_counter()
+    results = run_requests(requests, user, args.concurrency)
+    elapsed = time.perf_counter() - started
+    print('%d requests with %d threads in %.1fs (%.1f requests/s)' % (
+        len(results), args.concurrency, elapsed, len(results) / elapsed))
+    report(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--db', default=os.path.join(ROOT, 'load.sqlite3'),
+                        help='SQLite database file, generated if missing.')
+    parser.add_argument('--clients', type=int, default=2000000)
+    parser.add_argument('--reps', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Regenerate the database even if it exists.')
+    main(parser.parse_args())
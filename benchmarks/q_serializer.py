@@ -0,0 +1,121 @@
+"""
+Compare QSerializer throughput against the previous recursive
+implementation, which mutated the Q objects passed to ``serialize`` (so
+callers had to deep-copy them first) and popped keys from the dicts
+passed to ``deserialize``.
+
+Each timed call gets a freshly built input, outside of the timings. The
+cost of the deep copy the legacy implementation required is reported in
+its own column.
+
+    python -m benchmarks.q_serializer [--repeat N]
+"""
+import argparse
+import copy
+import time
+
+from django.db.models import Q
+
+from advanced_filters.q_serializer import QSerializer
+
+
+class LegacyQSerializer(QSerializer):
+    """The recursive serializer core as shipped up to version 1.1.1"""
+
+    def serialize(self, q):
+        children = []
+        for child in q.children:
+            if isinstance(child, Q):
+                children.append(self.serialize(child))
+            else:
+                children.append(child)
+        serialized = q.__dict__
+        serialized['children'] = children
+        return serialized
+
+    def deserialize(self, d):
+        children = []
+        for child in d.pop('children'):
+            if isinstance(child, dict):
+                children.append(self.deserialize(child))
+            else:
+                children.append(self.prepare_value(child))
+        query = Q()
+        query.children = children
+        query.connector = d['connector']
+        query.negated = d['negated']
+        return query
+
+
+def build_tree(depth, width):
+    """A Q tree ``depth`` levels deep, with ``width`` leaves per level"""
+    query = Q(**{'field_0__iexact': 'value'})
+    for level in range(1, depth):
+        node = Q()
+        node.connector = 'OR' if level % 2 else 'AND'
+        node.children = [query] + [
+            ('field_%d__icontains' % i, 'value %d' % i) for i in range(width)]
+        query = node
+    return query
+
+
+def bench(func, make_input, repeat, number):
+    """
+    Best time of ``func`` per call over ``repeat`` runs of ``number``
+    calls, each given a new ``make_input()`` built before the run starts.
+    """
+    best = None
+    for _ in range(repeat):
+        inputs = [make_input() for _ in range(number)]
+        started = time.perf_counter()
+        for value in inputs:
+            func(value)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / number
+
+
+def format_time(func, make_input, repeat, number):
+    try:
+        return '%14.1f' % (bench(func, make_input, repeat, number) * 1e6)
+    except RecursionError:
+        return '%14s' % 'RecursionError'
+
+
+def run(repeat=5, shapes=((4, 4), (16, 4), (64, 2), (256, 1), (4096, 1))):
+    current = QSerializer()
+    legacy = LegacyQSerializer()
+    print('%-12s %-12s %14s %14s %14s %8s' % (
+        'shape', 'operation', 'legacy (us)', 'current (us)', 'deepcopy (us)',
+        'speedup'))
+    for depth, width in shapes:
+        number = max(1, 2000 // (depth * (width + 1)))
+
+        def make_query():
+            return build_tree(depth, width)
+
+        def make_raw():
+            return current.serialize(build_tree(depth, width))
+
+        cases = (
+            ('serialize', legacy.serialize, current.serialize, make_query),
+            ('deserialize', legacy.deserialize, current.deserialize,
+             make_raw),
+        )
+        for name, old, new, make_input in cases:
+            t_new = bench(new, make_input, repeat, number)
+            t_old = format_time(old, make_input, repeat, number)
+            t_copy = format_time(copy.deepcopy, make_input, repeat, number)
+            try:
+                speedup = '%7.1fx' % (float(t_old) / (t_new * 1e6))
+            except ValueError:
+                speedup = '%8s' % '-'
+            print('%-12s %-12s %s %14.1f %s %s' % (
+                '%dx%d' % (depth, width), name, t_old, t_new * 1e6, t_copy,
+                speedup))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    run(repeat=parser.parse_args().repeat)
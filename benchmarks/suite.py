@@ -0,0 +1,199 @@
+"""
+Micro-benchmarks of the serializer, forms and admin hot paths, run offline
+against the bundled ``tests/test_project`` (with an in-memory database).
+
+    python -m benchmarks.suite [--repeat N] [--only NAME] [--save FILE]
+                               [--compare FILE]
+
+Each case is timed ``--repeat`` times (after a warm-up run) and the minimum,
+median and interquartile range of the time per call are reported. Results
+can be saved as JSON with ``--save`` and compared with a previous run with
+``--compare``, to spot regressions between releases.
+"""
+import argparse
+import os
+import statistics
+import sys
+import timeit
+
+import simplejson as json
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_django():
+    """Configure the test project and create its (in-memory) database"""
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE',
+                          'tests.test_project.settings')
+    import django
+    from django.core.management import call_command
+    django.setup()
+    call_command('migrate', verbosity=0, interactive=False)
+
+
+def measure(func, repeat, number=None):
+    """
+    Return statistics of the time per call of ``func``, in seconds. The
+    number of calls per sample is calibrated to take about 20ms unless
+    given.
+    """
+    timer = timeit.Timer(func)
+    if number is None:
+        number, elapsed = timer.autorange()
+        number = max(1, int(number * 0.02 / max(elapsed, 1e-9)))
+    timer.timeit(number)  # warm-up, i.e. fill caches
+    samples = sorted(t / number for t in timer.repeat(repeat, number))
+    quartiles = statistics.quantiles(samples, n=4) if repeat > 1 else (
+        samples[0],) * 3
+    return {
+        'min': samples[0],
+        'median': statistics.median(samples),
+        'iqr': quartiles[2] - quartiles[0],
+        'calls': number,
+    }
+
+
+def serializer_cases():
+    from advanced_filters.q_serializer import QSerializer
+    from .q_serializer import build_tree
+
+    serializer = QSerializer(base64=True, packed=True)
+    for depth, width in ((1, 1), (4, 4), (16, 4), (64, 2), (256, 1)):
+        query = build_tree(depth, width)
+        dumped = serializer.dumps(query)
+        shape = '%dx%d' % (depth, width)
+        yield ('serializer.dumps %s' % shape,
+               lambda q=query: serializer.dumps(q))
+        yield ('serializer.loads %s' % shape,
+               lambda d=dumped: serializer.loads(d))
+
+
+def form_cases():
+    from django.contrib import admin
+    from advanced_filters.forms import AdvancedFilterForm
+    from tests.customers.models import Client
+
+    model_admin = admin.site._registry[Client]
+    for rows in (1, 10, 50, 200):
+        data = {'title': 'benchmark', 'form-TOTAL_FORMS': rows,
+                'form-INITIAL_FORMS': 0}
+        for i in range(rows):
+            data.update({
+                'form-%d-field' % i: 'first_name',
+                'form-%d-operator' % i: 'iexact',
+                'form-%d-value' % i: 'name %d' % i,
+            })
+
+        def build(data=data):
+            return AdvancedFilterForm(data=data, model_admin=model_admin)
+
+        def generate(data=data):
+            form = build(data)
+            assert form.is_valid(), form.errors
+            return form.generate_query()
+
+        yield 'AdvancedFilterForm() %d rows' % rows, build
+        yield 'generate_query %d rows' % rows, generate
+
+
+def field_choices_cases():
+    from advanced_filters.forms import AdvancedFilterQueryForm
+
+    form = AdvancedFilterQueryForm()
+    for count in (100, 500, 1000):
+        fields = dict(('field_%d' % i, 'Field %d' % (count - i))
+                      for i in range(count))
+        yield ('_build_field_choices %d fields' % count,
+               lambda f=fields: form._build_field_choices(f))
+
+
+def list_filter_cases():
+    from django.contrib import admin
+    from django.db.models import Q
+    from django.test import RequestFactory
+    from advanced_filters.admin import AdvancedListFilters
+    from advanced_filters.models import AdvancedFilter
+    from tests.customers.models import Client
+    from tests.reps.models import SalesRep
+
+    model_admin = admin.site._registry[Client]
+    user, _ = SalesRep.objects.get_or_create(username='benchmark')
+    factory = RequestFactory()
+    for count in (10, 100, 1000):
+        AdvancedFilter.objects.filter(created_by=user).delete()
+        afilters = []
+        for i in range(count):
+            afilter = AdvancedFilter(title='filter %d' % i, url='foo',
+                                     created_by=user, model='customers.Client',
+                                     is_public=True)
+            afilter.query = (Q(first_name__iexact='name %d' % i) |
+                             Q(assigned_to__email__icontains='rep'))
+            afilters.append(afilter)
+        AdvancedFilter.objects.bulk_create(afilters)
+        afilter_id = str(AdvancedFilter.objects.filter(
+            created_by=user).order_by('pk').values_list('pk', flat=True)[0])
+
+        def apply(afilter_id=afilter_id):
+            # a new request for each call, like a changelist page view
+            request = factory.get('/', {'_afilter': afilter_id})
+            request.user = user
+            list_filter = AdvancedListFilters(
+                request, {'_afilter': afilter_id}, Client, model_admin)
+            queryset = list_filter.queryset(request, Client.objects.all())
+            return queryset.query.sql_with_params()
+
+        # cases are generated lazily, filters are created right before
+        # they are measured
+        yield 'lookups+queryset %d filters' % count, apply
+
+
+GROUPS = (
+    ('serializer', serializer_cases),
+    ('forms', form_cases),
+    ('field_choices', field_choices_cases),
+    ('list_filter', list_filter_cases),
+)
+
+
+def run(repeat=7, only=None, save=None, compare=None):
+    setup_django()
+    baseline = {}
+    if compare:
+        with open(compare) as fh:
+            baseline = json.load(fh)
+    results = {}
+    print('%-40s %12s %12s %10s %8s' % (
+        'case', 'min (us)', 'median (us)', 'iqr (us)', 'change'))
+    for group, cases in GROUPS:
+        if only and group not in only:
+            continue
+        for name, func in cases():
+            stats = measure(func, repeat)
+            results[name] = stats
+            change = ''
+            if name in baseline:
+                change = '%+.1f%%' % (
+                    (stats['median'] / baseline[name]['median'] - 1) * 100)
+            print('%-40s %12.1f %12.1f %10.1f %8s' % (
+                name, stats['min'] * 1e6, stats['median'] * 1e6,
+                stats['iqr'] * 1e6, change))
+    if save:
+        with open(save, 'w') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--only', action='append',
+                        choices=[name for name, _ in GROUPS],
+                        help='Only run this group of cases (repeatable).')
+    parser.add_argument('--save', help='Save the results to a JSON file.')
+    parser.add_argument('--compare',
+                        help='Compare with results saved by --save.')
+    args = parser.parse_args()
+    run(repeat=args.repeat, only=args.only, save=args.save,
+        compare=args.compare)
@@ -61,7 +61,8 @@ setup(
     description='A Django application for advanced admin filters',
     keywords='django-admin admin advanced filters custom query',
     long_description=get_full_description(),
-    packages=find_packages(exclude=['tests*', 'tests.*', '*.tests']),
+    packages=find_packages(exclude=['tests*', 'tests.*', '*.tests',
+                                    'benchmarks*']),
     include_package_data=True,
     install_requires=[
         'django-braces>=1.4.0,<2',